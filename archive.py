@@ -0,0 +1,266 @@
+"""終わった年度の出欠データの書き出し・切り離し
+
+年度 (4月〜翌3月) ごとのパーティションを gzip 圧縮の CSV に書き出し、
+読み戻して件数を確かめてから DB から切り離して削除する。DB に残るのは
+ATTENDANCE_LIVE_YEARS 年度分だけになる。出欠状況ページの集計
+(attendance_monthly_rollup) は切り離した年度の分も残る。
+
+    python archive.py status                    # 年度ごとの件数
+    python archive.py archive 2023              # 2023年度 (2023-04〜2024-03) を書き出して切り離す
+    python archive.py archive --closed          # ATTENDANCE_LIVE_YEARS より前の年度をすべて
+    python archive.py archive 2023 --keep       # 書き出すだけで切り離さない
+    python archive.py read archive/attendance_y2023.csv.gz --class R4A1 --student s20250001
+    python archive.py verify archive/attendance_y2023.csv.gz
+
+書き出すファイル (ARCHIVE_DIR):
+    attendance_y2023.csv.gz      出欠1件1行 (日付・時限・クラス名・生徒名も含め、これだけで読める)
+    class_sessions_y2023.csv.gz  授業セッション (結果のないものも含む)
+    attendance_y2023.json        件数と sha256
+"""
+import os
+import csv
+import sys
+import gzip
+import json
+import asyncio
+import hashlib
+import argparse
+import datetime
+from typing import Iterator, Optional
+
+from sqlalchemy import text
+
+from database import engine
+from partitions import academic_year, year_range, partition_names, live_years, ensure_partitions
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive"))
+# DB に残す年度数 (今年度を含む)。これより前が --closed の対象
+ATTENDANCE_LIVE_YEARS = int(os.getenv("ATTENDANCE_LIVE_YEARS", "1"))
+
+ATTENDANCE_EXPORT_SQL = """
+    SELECT ar.result_id, ar.session_id, s.date, s.period, s.class_id, c.class_name,
+           ar.student_number, st.name AS student_name, st.homeroom_class, ar.status, ar.note,
+           ar.registered_at, ar.updated_at
+    FROM {results} ar
+    JOIN {sessions} s ON s.session_id = ar.session_id AND s.date = ar.session_date
+    LEFT JOIN classes c ON c.class_id = s.class_id
+    LEFT JOIN students st ON st.student_number = ar.student_number
+    ORDER BY s.date, s.period, c.class_name, st.attendance_no, ar.student_number, ar.result_id
+"""
+
+SESSIONS_EXPORT_SQL = """
+    SELECT session_id, class_id, date, period, sound_token, created_at
+    FROM {sessions}
+    ORDER BY session_id
+"""
+
+
+def archive_paths(year: int, out_dir: str = ARCHIVE_DIR) -> dict:
+    return {
+        "attendance": os.path.join(out_dir, f"attendance_y{year}.csv.gz"),
+        "class_sessions": os.path.join(out_dir, f"class_sessions_y{year}.csv.gz"),
+        "manifest": os.path.join(out_dir, f"attendance_y{year}.json"),
+    }
+
+
+def _file_digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _count_rows(path: str) -> int:
+    with gzip.open(path, "rt", encoding="utf-8", newline="") as f:
+        return sum(1 for _ in csv.reader(f)) - 1   # ヘッダーを除く
+
+
+async def _copy_to_gzip(raw, sql: str, path: str):
+    # COPY の結果をそのまま圧縮しながら書く (年度分を丸ごとメモリに載せない)
+    with gzip.open(path, "wb", compresslevel=6) as f:
+        async def write(chunk):
+            f.write(chunk)
+        await raw.copy_from_query(sql, output=write, format="csv", header=True)
+
+
+async def archive_year(year: int, out_dir: str = ARCHIVE_DIR, keep: bool = False) -> dict:
+    current = academic_year(datetime.date.today())
+    if year > current - ATTENDANCE_LIVE_YEARS:
+        raise ValueError(f"{year}年度はまだ DB に残す年度です (今年度 {current}, ATTENDANCE_LIVE_YEARS={ATTENDANCE_LIVE_YEARS})")
+    sessions, results = partition_names(year)
+    paths = archive_paths(year, out_dir)
+    os.makedirs(out_dir, exist_ok=True)
+
+    async with engine.begin() as conn:
+        exists = (await conn.execute(text("SELECT to_regclass(:s) IS NOT NULL AND to_regclass(:r) IS NOT NULL"),
+                                     {"s": sessions, "r": results})).scalar()
+        if not exists:
+            raise ValueError(f"{year}年度のパーティションがありません (切り離し済み?)")
+        # 書き出しから切り離しまでの間に書き込まれないよう止める (読み出しはできる)
+        await conn.execute(text(f"LOCK TABLE {results}, {sessions} IN SHARE MODE"))
+        counts = (await conn.execute(text(
+            f"SELECT (SELECT COUNT(*) FROM {results}) AS results, (SELECT COUNT(*) FROM {sessions}) AS sessions"
+        ))).fetchone()
+
+        raw = (await conn.get_raw_connection()).driver_connection
+        parts = {k: paths[k] + ".part" for k in ("attendance", "class_sessions")}
+        await _copy_to_gzip(raw, ATTENDANCE_EXPORT_SQL.format(results=results, sessions=sessions), parts["attendance"])
+        await _copy_to_gzip(raw, SESSIONS_EXPORT_SQL.format(sessions=sessions), parts["class_sessions"])
+
+        # 読み戻して件数が合うことを確かめてから切り離す
+        written = {k: _count_rows(p) for k, p in parts.items()}
+        if written["attendance"] != counts.results or written["class_sessions"] != counts.sessions:
+            for p in parts.values():
+                os.remove(p)
+            raise RuntimeError(f"書き出した件数が合いません: {written} / DB: results={counts.results}, sessions={counts.sessions}")
+
+        for k, p in parts.items():
+            os.replace(p, paths[k])
+        start, end = year_range(year)
+        manifest = {
+            "academic_year": year,
+            "from": start.isoformat(),
+            "to": (end - datetime.timedelta(days=1)).isoformat(),
+            "archived_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            # 切り離しがコミットされてから True に書き換える (途中で失敗したら DB に残ったまま)
+            "detached": False,
+            "files": {
+                os.path.basename(paths[k]): {"rows": written[k], "sha256": _file_digest(paths[k])}
+                for k in ("attendance", "class_sessions")
+            },
+        }
+        _write_manifest(paths["manifest"], manifest)
+
+        if not keep:
+            # 参照している側 (attendance_results) から切り離して削除する
+            await conn.execute(text(f"ALTER TABLE attendance_results DETACH PARTITION {results}"))
+            await conn.execute(text(f"DROP TABLE {results}"))
+            await conn.execute(text(f"ALTER TABLE class_sessions DETACH PARTITION {sessions}"))
+            await conn.execute(text(f"DROP TABLE {sessions}"))
+
+    if not keep:
+        manifest["detached"] = True
+        _write_manifest(paths["manifest"], manifest)
+    return manifest
+
+
+def _write_manifest(path: str, manifest: dict):
+    # 書きかけのマニフェストが残らないよう、別名で書いてから置き換える
+    part = path + ".part"
+    with open(part, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(part, path)
+
+
+def iter_archive(path: str, class_name: Optional[str] = None, student_number: Optional[str] = None,
+                 start: Optional[datetime.date] = None, end: Optional[datetime.date] = None) -> Iterator[dict]:
+    """書き出した attendance_y*.csv.gz を1行ずつ dict で返す (監査用の読み戻し)"""
+    with gzip.open(path, "rt", encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            if class_name and row["class_name"] != class_name:
+                continue
+            if student_number and row["student_number"] != student_number:
+                continue
+            if start or end:
+                d = datetime.date.fromisoformat(row["date"])
+                if (start and d < start) or (end and d > end):
+                    continue
+            yield row
+
+
+def verify_archive(path: str) -> bool:
+    """マニフェストの sha256・件数と一致するか"""
+    name = os.path.basename(path)
+    year = name.split("_y")[-1].split(".")[0]
+    manifest_path = os.path.join(os.path.dirname(path), f"attendance_y{year}.json")
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    ok = True
+    for fname, info in manifest["files"].items():
+        p = os.path.join(os.path.dirname(path), fname)
+        digest, rows = _file_digest(p), _count_rows(p)
+        good = digest == info["sha256"] and rows == info["rows"]
+        ok = ok and good
+        print(f"{'✅' if good else '❌'} {fname}: {rows} rows (expected {info['rows']}), sha256 {'ok' if digest == info['sha256'] else 'mismatch'}")
+    return ok
+
+
+async def status():
+    current = academic_year(datetime.date.today())
+    async with engine.connect() as conn:
+        years = await live_years(conn)
+        print(f"今年度: {current}  DB に残す年度数: {ATTENDANCE_LIVE_YEARS}")
+        for y in years:
+            sessions, results = partition_names(y.year)
+            counts = (await conn.execute(text(
+                f"SELECT (SELECT COUNT(*) FROM {sessions}) AS sessions, (SELECT COUNT(*) FROM {results}) AS results"
+            ))).fetchone()
+            mark = "archive 対象" if y.year <= current - ATTENDANCE_LIVE_YEARS else ""
+            print(f"  {y.year}年度 {y.start} 〜 {y.end - datetime.timedelta(days=1)}: "
+                  f"{counts.sessions} sessions, {counts.results} results {mark}")
+    archived = sorted(f for f in os.listdir(ARCHIVE_DIR) if f.endswith(".json")) if os.path.isdir(ARCHIVE_DIR) else []
+    for f in archived:
+        print(f"  書き出し済み: {os.path.join(ARCHIVE_DIR, f)}")
+
+
+async def _archive(args) -> int:
+    if args.closed:
+        current = academic_year(datetime.date.today())
+        async with engine.connect() as conn:
+            years = [y.year for y in await live_years(conn) if y.year <= current - ATTENDANCE_LIVE_YEARS]
+    else:
+        years = args.years
+    if not years:
+        print("切り離す年度はありません")
+        return 0
+    for year in years:
+        manifest = await archive_year(year, args.dir, keep=args.keep)
+        files = ", ".join(f"{name} ({info['rows']} rows)" for name, info in manifest["files"].items())
+        print(f"✅ {year}年度: {files}{'' if args.keep else ' → 切り離しました'}")
+    # 切り離した後も今年度・来年度の分は必ず残す
+    await ensure_partitions()
+    return 0
+
+
+async def _main(args) -> int:
+    try:
+        if args.command == "status":
+            await status()
+        elif args.command == "archive":
+            return await _archive(args)
+        elif args.command == "read":
+            writer = None
+            n = 0
+            for row in iter_archive(args.path, args.class_name, args.student, args.start, args.end):
+                if writer is None:
+                    writer = csv.DictWriter(sys.stdout, fieldnames=list(row.keys()))
+                    writer.writeheader()
+                writer.writerow(row)
+                n += 1
+            print(f"{n} rows", file=sys.stderr)
+        elif args.command == "verify":
+            return 0 if verify_archive(args.path) else 1
+        return 0
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("status")
+    p_archive = sub.add_parser("archive")
+    p_archive.add_argument("years", type=int, nargs="*")
+    p_archive.add_argument("--closed", action="store_true", help="ATTENDANCE_LIVE_YEARS より前の年度をすべて")
+    p_archive.add_argument("--keep", action="store_true", help="書き出すだけで切り離さない")
+    p_archive.add_argument("--dir", default=ARCHIVE_DIR)
+    p_read = sub.add_parser("read")
+    p_read.add_argument("path")
+    p_read.add_argument("--class", dest="class_name")
+    p_read.add_argument("--student")
+    p_read.add_argument("--start", type=datetime.date.fromisoformat)
+    p_read.add_argument("--end", type=datetime.date.fromisoformat)
+    p_verify = sub.add_parser("verify")
+    p_verify.add_argument("path")
+    sys.exit(asyncio.run(_main(parser.parse_args())))
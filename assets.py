@@ -0,0 +1,131 @@
+"""静的ファイル (/static) の配信
+
+python build_assets.py で static/dist/ に作った、内容のハッシュ入りの名前のファイルと
+gzip / brotli 圧縮済みのファイルを配る。
+
+- テンプレートでは asset_url('css/common.css') と書く。static/dist/manifest.json があれば
+  ハッシュ入りの /static/dist/css/common.3f9a1c2b4d.css を返し、無ければ (開発中など)
+  元の /static/css/common.css を返す。
+- dist/ の下は名前が内容ごとに変わるので1年間キャッシュさせ (immutable)、再読み込みでも
+  問い合わせない。それ以外は毎回 ETag で確かめさせる (変わっていなければ 304)。
+- ブラウザが受け取れる場合は、同じ場所にある .br / .gz をそのまま返す (その場では圧縮しない)。
+"""
+import os
+import json
+import mimetypes
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from starlette.staticfiles import StaticFiles
+from starlette.responses import Response
+from starlette.datastructures import Headers
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+DIST_DIR = "dist"
+MANIFEST_NAME = "manifest.json"
+
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "no-cache"
+
+# Accept-Encoding に含まれていれば、この順で圧縮済みのファイルを探す
+PRECOMPRESSED = (("br", ".br"), ("gzip", ".gz"))
+
+# 出席確認のBGM。先に書いたものほど小さい (ブラウザが再生できる最初のものを使う)
+BGM_VARIANTS = (
+    ("sounds/bgm.opus.ogg", 'audio/ogg; codecs="opus"'),
+    ("sounds/bgm.compact.wav", "audio/wav"),
+    ("sounds/bgm.wav", "audio/wav"),
+)
+
+
+@lru_cache(maxsize=1)
+def load_manifest() -> Dict[str, str]:
+    """元の名前 -> dist/ の下のハッシュ入りの名前。ビルドしていなければ空"""
+    path = os.path.join(STATIC_DIR, DIST_DIR, MANIFEST_NAME)
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)["files"]
+    except FileNotFoundError:
+        return {}
+    except (ValueError, KeyError) as e:
+        print(f"Asset Manifest Error: {e}")
+        return {}
+
+
+def asset_url(path: str) -> str:
+    path = path.lstrip("/")
+    hashed = load_manifest().get(path)
+    if hashed:
+        return f"/static/{DIST_DIR}/{hashed}"
+    return f"/static/{path}"
+
+
+def bgm_sources() -> List[dict]:
+    """teacher.js に渡すBGMの候補 (ビルドしていなければ元の WAV だけ)"""
+    manifest = load_manifest()
+    sources = [{"url": asset_url(path), "type": mime}
+               for path, mime in BGM_VARIANTS if path in manifest]
+    return sources or [{"url": asset_url("sounds/bgm.wav"), "type": "audio/wav"}]
+
+
+def accepted_encodings(headers: Headers) -> set:
+    """Accept-Encoding で受け取れる圧縮形式 (q=0 のものは除く)"""
+    accepted = set()
+    for part in headers.get("accept-encoding", "").split(","):
+        name, _, params = part.partition(";")
+        name = name.strip().lower()
+        q = params.strip().replace(" ", "")
+        if not name or (q.startswith("q=") and _quality(q[2:]) <= 0):
+            continue
+        accepted.add(name)
+    return accepted
+
+
+def _quality(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        return 0.0
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """圧縮済みファイルの選択と Cache-Control を足した StaticFiles"""
+
+    async def get_response(self, path: str, scope) -> Response:
+        variants = []
+        if scope["method"] in ("GET", "HEAD"):
+            variants = [(encoding, found) for encoding, suffix in PRECOMPRESSED
+                        if (found := self._lookup_variant(path, suffix)) is not None]
+        response = None
+        if variants:
+            accepted = accepted_encodings(Headers(scope=scope))
+            for encoding, (full_path, stat_result) in variants:
+                if encoding in accepted:
+                    response = self.file_response(full_path, stat_result, scope)
+                    response.headers["Content-Encoding"] = encoding
+                    media_type = self._media_type(path)
+                    if media_type:
+                        response.headers["Content-Type"] = media_type
+                    break
+        if response is None:
+            response = await super().get_response(path, scope)
+        if variants:
+            # 受け取れる圧縮形式ごとに別々にキャッシュさせる
+            response.headers["Vary"] = "Accept-Encoding"
+        if response.status_code in (200, 206, 304):
+            immutable = path.replace("\\", "/").startswith(DIST_DIR + "/")
+            response.headers["Cache-Control"] = IMMUTABLE_CACHE if immutable else REVALIDATE_CACHE
+        return response
+
+    def _lookup_variant(self, path: str, suffix: str) -> Optional[Tuple[str, os.stat_result]]:
+        full_path, stat_result = self.lookup_path(path + suffix)
+        if stat_result is None or not os.path.isfile(full_path):
+            return None
+        return full_path, stat_result
+
+    @staticmethod
+    def _media_type(path: str) -> Optional[str]:
+        media_type, _ = mimetypes.guess_type(path)
+        if media_type and media_type.startswith("text/"):
+            media_type += "; charset=utf-8"
+        return media_type
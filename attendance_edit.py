@@ -0,0 +1,172 @@
+"""出席簿の手動変更をまとめて行う (/api/update_status_batch)
+
+1件ずつの /api/update_status は、クラス・セッション・結果を順に問い合わせて
+最大5回DBとやりとりする。こちらは全件を配列で渡し、クラスと生徒の確認、
+手動変更用セッションの作成、結果の INSERT ... ON CONFLICT DO UPDATE を
+1つのSQLで行う (呼び出し側の1トランザクションで全件が反映される)。
+"""
+import os
+import datetime
+from dataclasses import dataclass, asdict
+from typing import List, Optional
+
+from sqlalchemy import text
+
+from attendance_matrix import PERIODS, STATUS_CLASSES, NO_DATA_TEXT
+from partitions import academic_year
+
+# パーティションの無い年度 (切り離し済み・まだ作っていない) の日付を変更しようとした場合
+NO_PARTITION_MESSAGE = "この日付の年度の出欠は変更できません (DBにありません)"
+
+# 1回に変更できるマスの数
+STATUS_BATCH_MAX = int(os.getenv("STATUS_BATCH_MAX", "500"))
+
+# 手動変更で書き込める状態 (/api/update_status と同じく「データなし」もそのまま書く)
+EDITABLE_STATUSES = set(STATUS_CLASSES) | {NO_DATA_TEXT}
+
+# セッションが無いコマは手動変更用 (sound_token '0000') として作る。
+# 同じ文の中では new_sessions で作った行は class_sessions から見えないので、両方を合わせて使う。
+# 状態・備考が同じなら書き換えない (集計トリガーや updated_at を動かさない)
+# パーティションの無い年度 (切り離し済み・未作成) のマスは書き込まない。
+# 別に問い合わせるとDBとのやりとりが1回増えるので、同じ文の中で pg_inherits を見る
+UPSERT_STATUSES_SQL = text("""
+    WITH input AS (
+        SELECT * FROM unnest(
+            CAST(:idx AS INT[]), CAST(:class_names AS TEXT[]), CAST(:stus AS TEXT[]), CAST(:dates AS DATE[]),
+            CAST(:years AS INT[]), CAST(:periods AS INT[]), CAST(:statuses AS TEXT[]), CAST(:notes AS TEXT[])
+        ) AS t(idx, class_name, student_number, session_date, year, period, status, note)
+    ),
+    live_years AS (
+        SELECT substring(c.relname FROM '_y([0-9]{4})$')::int AS year
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent IN ('class_sessions'::regclass, 'attendance_results'::regclass)
+        GROUP BY 1
+        HAVING count(*) = 2
+    ),
+    resolved AS (
+        SELECT i.*, c.class_id, (s.student_number IS NOT NULL) AS known_student,
+               (i.year IN (SELECT year FROM live_years)) AS live
+        FROM input i
+        LEFT JOIN classes c ON c.class_name = i.class_name
+        LEFT JOIN students s ON s.student_number = i.student_number
+    ),
+    slots AS (
+        SELECT DISTINCT class_id, session_date, period FROM resolved
+        WHERE class_id IS NOT NULL AND known_student AND live
+    ),
+    new_sessions AS (
+        INSERT INTO class_sessions (class_id, date, period, sound_token)
+        SELECT class_id, session_date, period, '0000' FROM slots
+        ON CONFLICT (class_id, date, period) DO NOTHING
+        RETURNING session_id, class_id, date, period
+    ),
+    sessions AS (
+        SELECT session_id, class_id, date, period FROM new_sessions
+        UNION ALL
+        SELECT cs.session_id, cs.class_id, cs.date, cs.period
+        FROM class_sessions cs
+        JOIN slots sl ON cs.class_id = sl.class_id AND cs.date = sl.session_date AND cs.period = sl.period
+    ),
+    upserted AS (
+        INSERT INTO attendance_results (session_id, session_date, student_number, status, note)
+        SELECT se.session_id, r.session_date, r.student_number, r.status, r.note
+        FROM resolved r
+        JOIN sessions se ON se.class_id = r.class_id AND se.date = r.session_date AND se.period = r.period
+        WHERE r.known_student AND r.live
+        ON CONFLICT (session_id, student_number, session_date) DO UPDATE
+            SET status = EXCLUDED.status, note = EXCLUDED.note
+            WHERE attendance_results.status IS DISTINCT FROM EXCLUDED.status
+               OR attendance_results.note IS DISTINCT FROM EXCLUDED.note
+        RETURNING session_id, student_number, session_date
+    )
+    SELECT r.idx, r.live, (r.class_id IS NOT NULL) AS known_class, r.known_student,
+           (se.session_id IS NOT NULL) AS has_session, (u.session_id IS NOT NULL) AS changed
+    FROM resolved r
+    LEFT JOIN sessions se ON se.class_id = r.class_id AND se.date = r.session_date AND se.period = r.period
+    LEFT JOIN upserted u ON u.session_id = se.session_id AND u.student_number = r.student_number
+                        AND u.session_date = r.session_date
+""").execution_options(metrics_name="upsert_statuses")
+
+
+@dataclass
+class StatusEdit:
+    class_name: str
+    student_number: str
+    date: str
+    period: int
+    status: str
+    note: Optional[str] = None
+
+
+@dataclass
+class EditResult:
+    # "success" / "unchanged" / "invalid" / "unknown_class" / "unknown_student" / "archived" / "conflict"
+    status: str
+    message: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def _validate(edit: StatusEdit) -> Optional[EditResult]:
+    if edit.status not in EDITABLE_STATUSES:
+        return EditResult("invalid", f"状態「{edit.status}」は選べません")
+    if edit.period not in PERIODS:
+        return EditResult("invalid", f"{edit.period}コマ目はありません")
+    return None
+
+
+async def apply_status_edits(conn, edits: List[StatusEdit]) -> List[EditResult]:
+    """edits と同じ順で、マスごとの結果を返す。同じマスへの変更が重なった場合は後のものを使う"""
+    results: List[Optional[EditResult]] = [None] * len(edits)
+
+    # 同じマス (クラス, 生徒, 日付, 時限) は最後の変更だけを書き込む
+    # (ON CONFLICT DO UPDATE は1つの文で同じ行を2回更新できない)
+    latest = {}
+    for i, edit in enumerate(edits):
+        try:
+            day = datetime.date.fromisoformat(edit.date)
+        except ValueError:
+            results[i] = EditResult("invalid", f"日付「{edit.date}」が正しくありません")
+            continue
+        bad = _validate(edit)
+        if bad is not None:
+            results[i] = bad
+            continue
+        latest[(edit.class_name, edit.student_number, day, edit.period)] = i
+
+    if latest:
+        keys = list(latest)
+        rows = (await conn.execute(UPSERT_STATUSES_SQL, {
+            "idx": [latest[k] for k in keys],
+            "class_names": [k[0] for k in keys],
+            "stus": [k[1] for k in keys],
+            "dates": [k[2] for k in keys],
+            "years": [academic_year(k[2]) for k in keys],
+            "periods": [k[3] for k in keys],
+            "statuses": [edits[latest[k]].status for k in keys],
+            "notes": [edits[latest[k]].note for k in keys],
+        })).fetchall()
+        for r in rows:
+            if not r.live:
+                res = EditResult("archived", NO_PARTITION_MESSAGE)
+            elif not r.known_class:
+                res = EditResult("unknown_class", "クラス不明")
+            elif not r.known_student:
+                res = EditResult("unknown_student", "生徒不明")
+            elif not r.has_session:
+                # 同時に別の変更が同じコマのセッションを作った
+                res = EditResult("conflict", "同時に変更されました。もう一度保存してください")
+            elif r.changed:
+                res = EditResult("success")
+            else:
+                res = EditResult("unchanged")
+            results[r.idx] = res
+
+    # 後の変更で上書きされたものは、書き込んだ方と同じ結果にする
+    for i, edit in enumerate(edits):
+        if results[i] is None:
+            day = datetime.date.fromisoformat(edit.date)
+            results[i] = results[latest[(edit.class_name, edit.student_number, day, edit.period)]]
+    return results
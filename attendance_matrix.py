@@ -0,0 +1,144 @@
+import os
+import hashlib
+import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+
+PERIODS = (1, 2, 3, 4)
+
+# 状態 -> 表示用CSSクラス
+STATUS_CLASSES = {
+    "出席": "attend",
+    "欠席": "absent",
+    "遅刻": "late",
+    "早退": "early",
+    "公欠": "public-abs",
+    "特欠": "special-abs",
+}
+NO_DATA_TEXT = "データなし"
+
+# /api/attendance_matrix の1ページの生徒数と、1回に返す日数の上限
+MATRIX_PAGE_STUDENTS = int(os.getenv("MATRIX_PAGE_STUDENTS", "50"))
+MATRIX_WINDOW_DAYS = int(os.getenv("MATRIX_WINDOW_DAYS", "31"))
+
+# 生徒ごと・日付ごと・時限ごとの最新の結果 (CSV出力で日付×時限×生徒の表と結合する)
+# :c_name のクラスの生徒について :start 〜 :end の結果を返す
+# (両方のテーブルを分割キーの日付で絞り、範囲外の年度のパーティションは読まない)
+LATEST_RESULTS_CTE = """
+    res AS (
+        SELECT DISTINCT ON (ar.student_number, s.date, COALESCE(s.period, 1))
+            ar.student_number, s.date, COALESCE(s.period, 1) AS period, ar.status, ar.note
+        FROM attendance_results ar
+        JOIN class_sessions s ON s.session_id = ar.session_id AND s.date = ar.session_date
+        JOIN students stu ON stu.student_number = ar.student_number
+        WHERE stu.homeroom_class = :c_name
+          AND ar.session_date >= :start
+          AND ar.session_date <= :end
+          AND s.date >= :start
+          AND s.date <= :end
+        ORDER BY ar.student_number, s.date, COALESCE(s.period, 1), ar.result_id DESC
+    ),
+    days AS (
+        SELECT CAST(g AS DATE) AS day
+        FROM generate_series(CAST(:start AS DATE), CAST(:end AS DATE), INTERVAL '1 day') AS g
+    )
+"""
+
+# 1生徒1行で、期間内の結果を (マス番号, 状態) の配列にまとめて返す。
+# マス番号 = (日付 - 開始日) * 4 + (時限 - 1)。結果のないマスは返さない (疎な表現)
+# 同じマスに複数の結果がある場合は result_id 順に並ぶので、後のものが優先される
+MATRIX_SQL = text("""
+    SELECT st.student_number, st.name, st.attendance_no, r.slots, r.statuses
+    FROM students st
+    LEFT JOIN LATERAL (
+        SELECT array_agg(x.slot ORDER BY x.result_id) AS slots,
+               array_agg(x.status ORDER BY x.result_id) AS statuses
+        FROM (
+            SELECT (s.date - CAST(:start AS DATE)) * 4 + COALESCE(s.period, 1) - 1 AS slot,
+                   ar.status, ar.result_id
+            FROM attendance_results ar
+            JOIN class_sessions s ON s.session_id = ar.session_id AND s.date = ar.session_date
+            WHERE ar.student_number = st.student_number
+              AND ar.session_date >= :start
+              AND ar.session_date <= :end
+              AND s.date >= :start
+              AND s.date <= :end
+              AND COALESCE(s.period, 1) BETWEEN 1 AND 4
+        ) x
+    ) r ON true
+    WHERE st.homeroom_class = :c_name
+    ORDER BY st.attendance_no, st.student_number
+    LIMIT :limit OFFSET :offset
+""").execution_options(metrics_name="attendance_matrix")
+
+# ETag 用: ページの生徒の並びと、範囲内の結果の件数・最終更新時刻
+# (結果の追加・削除は件数、状態の変更は updated_at、生徒の追加・変更は roster で変わる)
+MATRIX_VERSION_SQL = text("""
+    WITH page AS (
+        SELECT student_number, name, attendance_no
+        FROM students
+        WHERE homeroom_class = :c_name
+        ORDER BY attendance_no, student_number
+        LIMIT :limit OFFSET :offset
+    )
+    SELECT
+        (SELECT COUNT(*) FROM students WHERE homeroom_class = :c_name) AS total_students,
+        (SELECT md5(string_agg(student_number || '|' || name || '|' || COALESCE(CAST(attendance_no AS TEXT), ''), ','
+                               ORDER BY attendance_no, student_number)) FROM page) AS roster,
+        COUNT(ar.result_id) AS result_count,
+        MAX(ar.updated_at) AS last_updated
+    FROM attendance_results ar
+    WHERE ar.student_number IN (SELECT student_number FROM page)
+      AND ar.session_date >= :start
+      AND ar.session_date <= :end
+""").execution_options(metrics_name="attendance_matrix_etag")
+
+
+def date_range(start: datetime.date, end: datetime.date) -> List[str]:
+    return [(start + datetime.timedelta(days=i)).strftime('%Y-%m-%d') for i in range((end - start).days + 1)]
+
+
+def clamp_window(start: datetime.date, end: datetime.date,
+                 max_days: int = MATRIX_WINDOW_DAYS) -> Tuple[datetime.date, Optional[datetime.date]]:
+    # 1回に返す日付の終わりと、続きがある場合は次の開始日を返す
+    window_end = min(end, start + datetime.timedelta(days=max_days - 1))
+    next_start = window_end + datetime.timedelta(days=1) if window_end < end else None
+    return window_end, next_start
+
+
+async def matrix_etag(conn, class_name: str, start: datetime.date, end: datetime.date,
+                      offset: int, limit: int) -> Tuple[str, int]:
+    """出席簿の1ページ分の ETag と、クラスの生徒数を返す。表の組み立てよりずっと軽い"""
+    r = (await conn.execute(MATRIX_VERSION_SQL, {
+        "c_name": class_name, "start": start, "end": end, "limit": limit, "offset": offset
+    })).one()
+    key = f"{class_name}|{start}|{end}|{offset}|{limit}|{r.roster}|{r.result_count}|{r.last_updated}"
+    return '"' + hashlib.sha1(key.encode("utf-8")).hexdigest() + '"', r.total_students
+
+
+async def build_matrix_page(conn, class_name: str, start: datetime.date, end: datetime.date,
+                            offset: int, limit: int) -> dict:
+    """出席簿APIの1ページ分 (生徒 offset から limit 人、start 〜 end)。
+
+    セルは1生徒あたり 日数×4 の状態の配列 (データなしは null) で返し、
+    表示用のCSSクラスは status_classes で対応付ける。
+    """
+    n = len(PERIODS)
+    date_headers = date_range(start, end)
+    rows = (await conn.execute(MATRIX_SQL, {
+        "c_name": class_name, "start": start, "end": end, "limit": limit, "offset": offset
+    })).fetchall()
+
+    students = []
+    for r in rows:
+        cells = [None] * (len(date_headers) * n)
+        for slot, status in zip(r.slots or (), r.statuses or ()):
+            cells[slot] = status if status in STATUS_CLASSES else None
+        students.append({
+            "student_number": r.student_number,
+            "name": r.name,
+            "number": r.attendance_no,
+            "cells": cells,
+        })
+    return {"date_headers": date_headers, "periods": list(PERIODS), "students": students}
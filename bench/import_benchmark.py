@@ -0,0 +1,116 @@
+"""生徒CSV一括登録 (/api/upload_users_csv) の速度の比較
+
+旧実装 (ファイル全体を読み込み、1行ごとに SELECT + INSERT) と
+user_import.import_students を同じCSVで実行し、1秒あたりの行数を比べる。
+登録は1トランザクション内で行い、最後にロールバックするので既存のDBは汚れない。
+
+import_students は平文のパスワードを import_hasher (IMPORT_HASH_WORKERS スレッド) で
+scrypt にしてから登録するので、行数あたりの時間はほぼハッシュ計算で決まる。
+--prehashed を付けると、CSVに作成済みのハッシュを入れてハッシュ計算を除いた速度を測る
+(旧実装は平文のまま保存するので、差はハッシュ計算の分になる)。
+
+    python bench/import_benchmark.py --rows 1000 10000
+    python bench/import_benchmark.py --rows 10000 --skip-legacy --prehashed
+"""
+import io
+import os
+import csv
+import sys
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+from starlette.datastructures import UploadFile
+
+from database import engine
+from passwords import make_hash
+from user_import import import_students, import_hasher
+
+
+def make_csv(n_rows: int, encoding: str = "cp932", prehashed: bool = False) -> bytes:
+    # 作成済みのハッシュは全行で同じものを使う (作るのに時間がかかるため)
+    password = make_hash("pass") if prehashed else "pass"
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(["学籍番号", "氏名", "メール", "パスワード", "クラス", "出席番号"])
+    for i in range(n_rows):
+        writer.writerow([f"i{i:07d}", f"一括 {i}", f"i{i:07d}@bench.invalid", password, "BENCH_IMPORT", i % 40 + 1])
+    return buf.getvalue().encode(encoding)
+
+
+async def legacy_import(conn, content: bytes) -> int:
+    decoded = None
+    for encoding in ['utf-8-sig', 'utf-8', 'cp932']:
+        try:
+            decoded = content.decode(encoding)
+            break
+        except UnicodeDecodeError:
+            continue
+    rows = list(csv.reader(io.StringIO(decoded)))
+    count = 0
+    for i, row in enumerate(rows):
+        if not row or len(row) < 6:
+            continue
+        if i == 0 and "学籍番号" in row[0]:
+            continue
+        s_no = row[0].strip()
+        exist = (await conn.execute(text("SELECT 1 FROM students WHERE student_number = :id"), {"id": s_no})).fetchone()
+        if not exist:
+            await conn.execute(
+                text("INSERT INTO students (student_number, name, email, password_hash, homeroom_class, attendance_no) VALUES (:id, :name, :email, :pass, :cls, :no)"),
+                {"id": s_no, "name": row[1].strip(), "email": row[2].strip(), "pass": row[3].strip(),
+                 "cls": row[4].strip(), "no": int(row[5].strip())}
+            )
+            count += 1
+    return count
+
+
+async def streaming_import(conn, content: bytes) -> int:
+    report = await import_students(conn, UploadFile(io.BytesIO(content), filename="bench.csv"))
+    return len(report.inserted)
+
+
+async def run_once(func, content: bytes, n_rows: int) -> float:
+    async with engine.connect() as conn:
+        trans = await conn.begin()
+        try:
+            start = time.perf_counter()
+            inserted = await func(conn, content)
+            elapsed = time.perf_counter() - start
+        finally:
+            await trans.rollback()
+    assert inserted == n_rows, f"{func.__name__}: expected {n_rows} rows, got {inserted}"
+    return elapsed
+
+
+async def main(args):
+    try:
+        passwords = "prehashed" if args.prehashed else f"hashed on import, {import_hasher.workers} thread(s)"
+        for n_rows in args.rows:
+            content = make_csv(n_rows, prehashed=args.prehashed)
+            print(f"--- {n_rows} rows ({len(content) / 1024 / 1024:.1f} MiB, cp932, passwords {passwords}) ---")
+            funcs = [streaming_import] if args.skip_legacy else [legacy_import, streaming_import]
+            results = {}
+            for func in funcs:
+                elapsed = await run_once(func, content, n_rows)
+                results[func.__name__] = elapsed
+                print(f"{func.__name__:<18} {elapsed:8.2f}s  {n_rows / elapsed:10.0f} rows/s")
+            if len(results) == 2:
+                print(f"speed-up x{results['legacy_import'] / results['streaming_import']:.1f}")
+        stats = import_hasher.stats()
+        if stats["completed"]:
+            print(f"import_hasher: {stats['completed']} hashes, avg {stats['avg_compute_ms']} ms each")
+    finally:
+        import_hasher.shutdown()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--skip-legacy", action="store_true", help="旧実装を実行しない (行数が多い場合)")
+    parser.add_argument("--prehashed", action="store_true", help="CSVに作成済みのハッシュを入れる (ハッシュ計算を除いて測る)")
+    asyncio.run(main(parser.parse_args()))
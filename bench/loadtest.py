@@ -0,0 +1,491 @@
+"""教室単位の同時アクセスの負荷試験
+
+クラス数 × 生徒数 × 過去の週数 を指定してベンチ用のデータを作り、
+全クラスで同時に出席確認を行ったときのエンドポイントごとの
+スループットと p50/p95/p99 を JSON で出力する。変更前後の JSON を compare で比べる。
+
+1回の出席確認 (ラウンド) で、全クラスが同時に次を行う:
+    - 教師が /api/generate_otp を呼ぶ
+    - 生徒全員が --burst 秒の間に /api/check_attend を送る (一部は一度コードを間違える)
+    - その間に教師が /api/update_status で過去の出欠を修正し、
+      /attendanceResult と /api/attendance_matrix (全期間をスクロールした分)、
+      /api/download_csv (全期間) を読む
+
+    # db/init.sql と db/test_data.sql で作り直してから 20クラス × 40人 × 12週 を投入
+    python bench/loadtest.py seed --reset --classes 20 --students 40 --weeks 12
+
+    # アプリを同じプロセス内で動かして計測 (--url を付けると起動中のサーバーに送る)
+    python bench/loadtest.py run --classes 20 --rounds 4 --output baseline.json
+    python bench/loadtest.py run --url http://localhost:8000 --classes 20 --output after.json
+
+    python bench/loadtest.py compare baseline.json after.json
+
+生徒・教師のパスワードは現在の PASSWORD_SCRYPT_N でハッシュ化するので、
+ログイン (/login) も本番と同じコストで計測される。
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import datetime
+import platform
+import subprocess
+from collections import defaultdict
+from contextlib import AsyncExitStack
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from sqlalchemy import text
+
+import migrations
+from database import engine
+from passwords import make_hash
+from attendance_matrix import STATUS_CLASSES
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLASS_PREFIX = "LT"
+BENCH_PASSWORD = "bench-pass"
+STATUSES = list(STATUS_CLASSES.keys())
+# 過去の出欠の割合 (出席, 欠席, 遅刻, 早退, 公欠, 特欠)
+STATUS_WEIGHTS = [85, 5, 5, 2, 2, 1]
+
+
+def student_number(c: int, n: int) -> str:
+    return f"lt{c:03d}{n:03d}"
+
+
+def teacher_email(c: int) -> str:
+    return f"lt{c:03d}-teacher@bench.invalid"
+
+
+def student_email(c: int, n: int) -> str:
+    return f"{student_number(c, n)}@bench.invalid"
+
+
+def history_range(weeks: int) -> tuple:
+    # 今日を含まない過去 weeks 週分 (今日の分は出席確認で作る)
+    end = datetime.date.today() - datetime.timedelta(days=1)
+    return end - datetime.timedelta(weeks=weeks) + datetime.timedelta(days=1), end
+
+
+# ==========================================
+# データ投入
+# ==========================================
+
+async def run_sql_file(path: str):
+    with open(path, encoding="utf-8") as f:
+        sql = f.read()
+    async with engine.begin() as conn:
+        await migrations.run_script(conn, sql)
+
+
+async def cleanup(conn):
+    like = {"pattern": CLASS_PREFIX + "%"}
+    await conn.execute(text("""
+        DELETE FROM attendance_results WHERE session_id IN (
+            SELECT cs.session_id FROM class_sessions cs JOIN classes c ON c.class_id = cs.class_id
+            WHERE c.class_name LIKE :pattern)
+    """), like)
+    await conn.execute(text("""
+        DELETE FROM class_sessions WHERE class_id IN (SELECT class_id FROM classes WHERE class_name LIKE :pattern)
+    """), like)
+    await conn.execute(text("DELETE FROM attendance_results WHERE student_number IN "
+                            "(SELECT student_number FROM students WHERE homeroom_class LIKE :pattern)"), like)
+    await conn.execute(text("DELETE FROM students WHERE homeroom_class LIKE :pattern"), like)
+    teacher_ids = (await conn.execute(
+        text("DELETE FROM classes WHERE class_name LIKE :pattern RETURNING teacher_id"), like
+    )).scalars().all()
+    await conn.execute(text("DELETE FROM teachers WHERE teacher_id = ANY(:ids) AND email LIKE '%@bench.invalid'"),
+                       {"ids": [t for t in teacher_ids if t is not None]})
+
+
+async def seed(args):
+    if args.reset:
+        print("▶ db/init.sql, db/test_data.sql を流し直します")
+        await run_sql_file(os.path.join(ROOT, "db", "init.sql"))
+        await run_sql_file(os.path.join(ROOT, "db", "test_data.sql"))
+    await migrations.upgrade(verbose=False)
+
+    start, end = history_range(args.weeks)
+    stored = make_hash(BENCH_PASSWORD)
+    began = time.perf_counter()
+    async with engine.begin() as conn:
+        await cleanup(conn)
+        # random() の結果を毎回同じにする
+        await conn.execute(text("SELECT setseed(:seed)"), {"seed": (args.seed % 1000) / 1000})
+        await conn.execute(text("""
+            WITH t AS (
+                INSERT INTO teachers (email, password_hash, name)
+                SELECT 'lt' || LPAD(CAST(c AS TEXT), 3, '0') || '-teacher@bench.invalid', :pw, '負荷試験 ' || c
+                FROM generate_series(1, :classes) AS c
+                RETURNING teacher_id, email
+            )
+            INSERT INTO classes (class_name, teacher_id)
+            SELECT :prefix || SUBSTRING(email FROM 3 FOR 3), teacher_id FROM t
+        """), {"pw": stored, "classes": args.classes, "prefix": CLASS_PREFIX})
+        await conn.execute(text("""
+            INSERT INTO students (student_number, email, password_hash, name, homeroom_class, attendance_no)
+            SELECT 'lt' || LPAD(CAST(c AS TEXT), 3, '0') || LPAD(CAST(n AS TEXT), 3, '0'),
+                   'lt' || LPAD(CAST(c AS TEXT), 3, '0') || LPAD(CAST(n AS TEXT), 3, '0') || '@bench.invalid',
+                   :pw, '負荷 ' || c || '-' || n, :prefix || LPAD(CAST(c AS TEXT), 3, '0'), n
+            FROM generate_series(1, :classes) AS c CROSS JOIN generate_series(1, :students) AS n
+        """), {"pw": stored, "classes": args.classes, "students": args.students, "prefix": CLASS_PREFIX})
+        # 平日 × 4コマ
+        await conn.execute(text("""
+            INSERT INTO class_sessions (class_id, date, period, sound_token, created_at)
+            SELECT c.class_id, CAST(d AS DATE), p, '0000', d + INTERVAL '9 hours'
+            FROM classes c
+            CROSS JOIN generate_series(CAST(:start AS TIMESTAMP), CAST(:end AS TIMESTAMP), INTERVAL '1 day') AS d
+            CROSS JOIN generate_series(1, 4) AS p
+            WHERE c.class_name LIKE :pattern AND EXTRACT(ISODOW FROM d) < 6
+        """), {"start": start, "end": end, "pattern": CLASS_PREFIX + "%"})
+        # 記録のない (データなし) コマも少し残す
+        bounds, acc = [], 0
+        for w in STATUS_WEIGHTS:
+            acc += w
+            bounds.append(acc / sum(STATUS_WEIGHTS))
+        await conn.execute(text("""
+            INSERT INTO attendance_results (session_id, session_date, student_number, status, registered_at)
+            SELECT session_id, date, student_number,
+                   (CAST(:statuses AS TEXT[]))[(SELECT COUNT(*) + 1 FROM unnest(CAST(:bounds AS FLOAT8[])) AS b WHERE b < r)],
+                   created_at
+            FROM (
+                SELECT cs.session_id, cs.date, s.student_number, cs.created_at, random() AS r, random() AS keep
+                FROM class_sessions cs
+                JOIN classes c ON c.class_id = cs.class_id
+                JOIN students s ON s.homeroom_class = c.class_name
+                WHERE c.class_name LIKE :pattern
+            ) AS x
+            WHERE keep < 0.97
+        """), {"statuses": STATUSES, "bounds": bounds[:-1], "pattern": CLASS_PREFIX + "%"})
+        counts = (await conn.execute(text("""
+            SELECT (SELECT COUNT(*) FROM class_sessions cs JOIN classes c ON c.class_id = cs.class_id
+                    WHERE c.class_name LIKE :pattern) AS sessions,
+                   (SELECT COUNT(*) FROM attendance_results ar JOIN students s ON s.student_number = ar.student_number
+                    WHERE s.homeroom_class LIKE :pattern) AS results
+        """), {"pattern": CLASS_PREFIX + "%"})).fetchone()
+    async with engine.connect() as conn:
+        await conn.execute(text("ANALYZE"))
+    print(f"✅ {args.classes} classes × {args.students} students, {start} ~ {end}: "
+          f"{counts.sessions} sessions, {counts.results} results ({time.perf_counter() - began:.1f}s)")
+
+
+# ==========================================
+# 計測
+# ==========================================
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.errors = defaultdict(int)
+
+    def record(self, name: str, elapsed: float, status):
+        self.latencies[name].append(elapsed)
+        self.statuses[name][str(status)] += 1
+        if status == "exception" or (isinstance(status, int) and status >= 500):
+            self.errors[name] += 1
+
+    def summary(self, durations: dict) -> dict:
+        """durations: エンドポイントごとの計測時間 (秒)。"*" はそれ以外すべて"""
+        out = {}
+        for name, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            out[name] = {
+                "requests": len(values),
+                "errors": self.errors[name],
+                "status": dict(sorted(self.statuses[name].items())),
+                "throughput_rps": round(len(values) / durations.get(name, durations["*"]), 1),
+                "mean_ms": round(sum(values) / len(values) * 1000, 2),
+                "p50_ms": round(percentile(values, 50) * 1000, 2),
+                "p95_ms": round(percentile(values, 95) * 1000, 2),
+                "p99_ms": round(percentile(values, 99) * 1000, 2),
+                "max_ms": round(values[-1] * 1000, 2),
+            }
+        return out
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    # nearest-rank
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(round(q / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+
+class User:
+    """ログイン済みのブラウザ1つ分 (Cookie を持つクライアント)"""
+
+    def __init__(self, client: httpx.AsyncClient, recorder: Recorder, limit: asyncio.Semaphore):
+        self.client = client
+        self.recorder = recorder
+        self.limit = limit
+
+    async def request(self, name: str, method: str, url: str, stream: bool = False, **kwargs):
+        async with self.limit:
+            started = time.perf_counter()
+            try:
+                if stream:
+                    # CSV は最後の1バイトまで受け取った時間を測る
+                    async with self.client.stream(method, url, **kwargs) as r:
+                        async for _ in r.aiter_bytes():
+                            pass
+                else:
+                    r = await self.client.request(method, url, **kwargs)
+            except Exception as e:
+                self.recorder.record(name, time.perf_counter() - started, "exception")
+                print(f"❌ {name}: {e!r}")
+                return None
+            self.recorder.record(name, time.perf_counter() - started, r.status_code)
+            return r
+
+
+async def login_all(make_client, recorder, limit, emails: list) -> list:
+    async def one(email):
+        user = User(make_client(), recorder, limit)
+        r = await user.request("login", "POST", "/login", data={"email": email, "password": BENCH_PASSWORD})
+        if r is None or r.status_code != 303 or r.headers.get("location", "/?").startswith("/?"):
+            raise RuntimeError(f"ログインに失敗しました: {email} (seed を先に実行してください)")
+        return user
+
+    users = await asyncio.gather(*(one(e) for e in emails))
+    return list(users)
+
+
+async def classroom_round(cls: dict, teacher: User, students: list, period: int, args, rng: random.Random,
+                          history: tuple):
+    r = await teacher.request("generate_otp", "POST", "/api/generate_otp",
+                              json={"class_id": str(cls["class_id"]), "period": period})
+    if r is None or r.status_code != 200:
+        return
+    otp = r.json()["otp_display"]
+    wrong = (otp + 1) % 2 ** max(1, len(r.json()["otp_binary"]))
+
+    async def student(user: User, delay: float, mistake: bool):
+        await asyncio.sleep(delay)
+        if mistake:
+            await user.request("check_attend", "POST", "/api/check_attend", json={"otp_value": wrong})
+        await user.request("check_attend", "POST", "/api/check_attend", json={"otp_value": otp})
+
+    start, end = history
+    days = (end - start).days
+
+    async def edit(delay: float):
+        await asyncio.sleep(delay)
+        n = rng.randint(1, args.students)
+        await teacher.request("update_status", "POST", "/api/update_status", json={
+            "class_name": cls["class_name"],
+            "student_number": student_number(cls["index"], n),
+            "date": (start + datetime.timedelta(days=rng.randint(0, days))).isoformat(),
+            "period": rng.randint(1, 4),
+            "status": rng.choices(STATUSES, STATUS_WEIGHTS)[0],
+            "note": "loadtest",
+        })
+
+    async def read(delay: float):
+        await asyncio.sleep(delay)
+        params = {"class_name": cls["class_name"], "start_date": start.isoformat(), "end_date": end.isoformat()}
+        await teacher.request("attendance_result_page", "GET", "/attendanceResult", params=params)
+        # 画面を全期間・全生徒分スクロールしたときと同じ順に取得する
+        window = dict(params)
+        while window:
+            offset = 0
+            while offset is not None:
+                r = await teacher.request("attendance_matrix", "GET", "/api/attendance_matrix",
+                                          params={**window, "offset": offset})
+                if r is None or r.status_code != 200:
+                    return
+                body = r.json()
+                offset = body["next_offset"]
+            window = dict(window, start_date=body["next_start"]) if body["next_start"] else None
+        await teacher.request("download_csv", "GET", "/api/download_csv", params=params, stream=True)
+
+    tasks = [student(u, rng.uniform(0, args.burst), rng.random() < args.wrong_rate) for u in students]
+    tasks += [edit(rng.uniform(0, args.burst)) for _ in range(args.edits)]
+    tasks += [read(rng.uniform(0, args.burst)) for _ in range(args.reads)]
+    await asyncio.gather(*tasks)
+
+
+async def clear_today():
+    # 前回の実行で作った今日の出席を消して、毎回同じ条件で始める
+    async with engine.begin() as conn:
+        await conn.execute(text("""
+            DELETE FROM attendance_results WHERE session_id IN (
+                SELECT cs.session_id FROM class_sessions cs JOIN classes c ON c.class_id = cs.class_id
+                WHERE c.class_name LIKE :pattern AND cs.date >= CURRENT_DATE)
+        """), {"pattern": CLASS_PREFIX + "%"})
+
+
+async def load_classes(n_classes: int) -> list:
+    async with engine.connect() as conn:
+        rows = (await conn.execute(
+            text("SELECT class_id, class_name FROM classes WHERE class_name LIKE :pattern ORDER BY class_name"),
+            {"pattern": CLASS_PREFIX + "%"}
+        )).fetchall()
+    classes = [{"class_id": r.class_id, "class_name": r.class_name, "index": int(r.class_name[len(CLASS_PREFIX):])}
+               for r in rows][:n_classes]
+    if len(classes) < n_classes:
+        raise SystemExit(f"ベンチ用のクラスが {len(classes)} 件しかありません。seed --classes {n_classes} を先に実行してください")
+    return classes
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+async def run(args):
+    classes = await load_classes(args.classes)
+    await clear_today()
+    history = history_range(args.weeks)
+    rng = random.Random(args.seed)
+    recorder = Recorder()
+    limit = asyncio.Semaphore(args.concurrency)
+
+    async with AsyncExitStack() as stack:
+        if args.url:
+            target = args.url
+            http_limits = httpx.Limits(max_connections=4, max_keepalive_connections=4)
+
+            def make_client():
+                return httpx.AsyncClient(base_url=args.url, limits=http_limits, timeout=args.timeout,
+                                         follow_redirects=False)
+        else:
+            # アプリを同じプロセスで起動 (lifespan も実行してマイグレーション・まとめ書き込みを有効にする)
+            import main
+            target = "in-process"
+            await stack.enter_async_context(main.app.router.lifespan_context(main.app))
+            transport = httpx.ASGITransport(app=main.app)
+
+            def make_client():
+                return httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=args.timeout)
+
+        clients = []
+
+        def tracked_client():
+            c = make_client()
+            clients.append(c)
+            return c
+
+        stack.push_async_callback(lambda: asyncio.gather(*(c.aclose() for c in clients)))
+
+        print(f"▶ {len(classes)} classes × {args.students} students: logging in")
+        began = time.perf_counter()
+        teachers = await login_all(tracked_client, recorder, limit, [teacher_email(c["index"]) for c in classes])
+        students = await login_all(tracked_client, recorder, limit, [
+            student_email(c["index"], n) for c in classes for n in range(1, args.students + 1)
+        ])
+        students = [students[i * args.students:(i + 1) * args.students] for i in range(len(classes))]
+        login_elapsed = time.perf_counter() - began
+
+        began = time.perf_counter()
+        for rnd in range(args.rounds):
+            period = rnd % 4 + 1
+            t0 = time.perf_counter()
+            await asyncio.gather(*(
+                classroom_round(cls, teachers[i], students[i], period, args, rng, history)
+                for i, cls in enumerate(classes)
+            ))
+            print(f"  round {rnd + 1}/{args.rounds} (period {period}): {time.perf_counter() - t0:.2f}s")
+        elapsed = time.perf_counter() - began
+
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "target": target,
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "scale": {"classes": len(classes), "students": args.students, "weeks": args.weeks},
+            "args": {k: v for k, v in vars(args).items() if k not in ("func", "output")},
+            "env": {k: os.getenv(k) for k in (
+                "DB_POOL_SIZE", "DB_MAX_OVERFLOW", "CHECKIN_BATCH_ENABLED", "PASSWORD_SCRYPT_N",
+                "PASSWORD_HASH_WORKERS", "CHECKIN_MAX_CONCURRENCY") if os.getenv(k) is not None},
+        },
+        # スループットはログインがログインの時間、それ以外は出席確認 (全ラウンド) の時間あたり
+        "login_seconds": round(login_elapsed, 2),
+        "elapsed_seconds": round(elapsed, 2),
+        "endpoints": recorder.summary({"login": login_elapsed, "*": elapsed}),
+    }
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"✅ {args.output} に保存しました")
+    await engine.dispose()
+
+
+def print_report(report: dict):
+    print(f"{'endpoint':<24} {'req':>6} {'err':>4} {'rps':>8} {'p50(ms)':>9} {'p95(ms)':>9} {'p99(ms)':>9} {'max(ms)':>9}")
+    for name, s in report["endpoints"].items():
+        print(f"{name:<24} {s['requests']:>6} {s['errors']:>4} {s['throughput_rps']:>8.1f} "
+              f"{s['p50_ms']:>9.1f} {s['p95_ms']:>9.1f} {s['p99_ms']:>9.1f} {s['max_ms']:>9.1f}")
+
+
+def compare(args):
+    with open(args.baseline, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(args.current, encoding="utf-8") as f:
+        cur = json.load(f)
+    print(f"baseline {base['meta']['revision']} ({base['meta']['timestamp']})  ->  "
+          f"current {cur['meta']['revision']} ({cur['meta']['timestamp']})")
+    if base["meta"]["scale"] != cur["meta"]["scale"]:
+        print(f"⚠️ 規模が違います: {base['meta']['scale']} / {cur['meta']['scale']}")
+    keys = ("throughput_rps", "p50_ms", "p95_ms", "p99_ms")
+    print(f"{'endpoint':<24} " + " ".join(f"{k:>17}" for k in keys) + "   (current, current/baseline)")
+    for name in sorted(set(base["endpoints"]) | set(cur["endpoints"])):
+        b, c = base["endpoints"].get(name), cur["endpoints"].get(name)
+        if not b or not c:
+            print(f"{name:<24} (片方のみ)")
+            continue
+        cols = []
+        for key in keys:
+            ratio = c[key] / b[key] if b[key] else float("inf")
+            cols.append(f"{c[key]:>9.1f} {ratio:>6.2f}x")
+        print(f"{name:<24} " + " ".join(cols))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def scale_args(p):
+        p.add_argument("--classes", type=int, default=4)
+        p.add_argument("--students", type=int, default=40, help="1クラスあたりの生徒数")
+        p.add_argument("--weeks", type=int, default=12, help="過去の出欠の週数")
+        p.add_argument("--seed", type=int, default=1)
+
+    p_seed = sub.add_parser("seed", help="ベンチ用のデータを作る")
+    scale_args(p_seed)
+    p_seed.add_argument("--reset", action="store_true", help="db/init.sql と db/test_data.sql で作り直してから投入する")
+
+    p_run = sub.add_parser("run", help="負荷をかけて計測する")
+    scale_args(p_run)
+    p_run.add_argument("--url", help="起動中のサーバー (省略時は同じプロセス内でアプリを動かす)")
+    p_run.add_argument("--rounds", type=int, default=4, help="出席確認の回数 (1回ごとに別のコマ)")
+    p_run.add_argument("--burst", type=float, default=5.0, help="生徒全員が出席を送り終えるまでの秒数")
+    p_run.add_argument("--wrong-rate", type=float, default=0.05, help="一度コードを間違える生徒の割合")
+    p_run.add_argument("--edits", type=int, default=5, help="1ラウンドで教師1人が行う update_status の数")
+    p_run.add_argument("--reads", type=int, default=1, help="1ラウンドで教師1人が出席簿・CSVを読む回数")
+    p_run.add_argument("--concurrency", type=int, default=200, help="同時に送るリクエストの上限")
+    p_run.add_argument("--timeout", type=float, default=60.0)
+    p_run.add_argument("--output", help="結果の JSON を保存するファイル")
+
+    p_cmp = sub.add_parser("compare", help="2つの結果を比べる")
+    p_cmp.add_argument("baseline")
+    p_cmp.add_argument("current")
+
+    args = parser.parse_args()
+    if args.command == "seed":
+        asyncio.run(seed(args))
+    elif args.command == "run":
+        asyncio.run(run(args))
+    else:
+        compare(args)
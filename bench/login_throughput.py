@@ -0,0 +1,116 @@
+"""/login のスループット計測 (scrypt のコストを固定して比較)
+
+ベンチ用の生徒を登録してから、同時に --concurrency 件ずつ /login を送り、
+1秒あたりのログイン数・応答時間と、その間のイベントループの遅れを測る。
+--workers 0 はハッシュ計算をイベントループ上で行う (プールを使わない場合の比較用)。
+ベンチ用の生徒は最後に削除する。
+
+    python bench/login_throughput.py --logins 200 --concurrency 40 --workers 0 4
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from sqlalchemy import text
+
+import main
+from database import engine
+from passwords import PasswordHasher, make_hash, SCRYPT_N, SCRYPT_R, SCRYPT_P
+
+BENCH_CLASS = "BENCH_LOGIN"
+BENCH_PASSWORD = "bench-pass"
+
+
+async def seed(n_users: int):
+    stored = make_hash(BENCH_PASSWORD)
+    async with engine.begin() as conn:
+        await conn.execute(
+            text("""
+                INSERT INTO students (student_number, email, password_hash, name, homeroom_class, attendance_no)
+                SELECT 'L' || LPAD(CAST(n AS TEXT), 6, '0'), 'login' || n || '@bench.invalid', :pw, 'ログイン ' || n, :cls, n
+                FROM generate_series(1, :n) AS n
+            """),
+            {"pw": stored, "cls": BENCH_CLASS, "n": n_users}
+        )
+
+
+async def cleanup():
+    async with engine.begin() as conn:
+        await conn.execute(text("DELETE FROM students WHERE homeroom_class = :cls"), {"cls": BENCH_CLASS})
+
+
+async def loop_lag(stop: asyncio.Event, samples: list, interval: float = 0.01):
+    # 10ms ごとに起きるはずのタスクが、どれだけ遅れて起きたか
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - expected))
+
+
+async def run(workers: int, n_logins: int, concurrency: int, n_users: int) -> dict:
+    main.password_hasher = PasswordHasher(workers)
+    transport = httpx.ASGITransport(app=main.app)
+    sem = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i: int):
+        async with sem:
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                start = time.perf_counter()
+                r = await client.post("/login", data={
+                    "email": f"login{i % n_users + 1}@bench.invalid", "password": BENCH_PASSWORD
+                })
+                latencies.append(time.perf_counter() - start)
+                assert r.status_code == 303 and r.headers["location"] == "/register", r.headers.get("location")
+
+    stop = asyncio.Event()
+    lags = []
+    lag_task = asyncio.create_task(loop_lag(stop, lags))
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(n_logins)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await lag_task
+    main.password_hasher.shutdown()
+
+    latencies.sort()
+    return {
+        "workers": workers,
+        "logins_per_sec": round(n_logins / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 1),
+        "max_loop_lag_ms": round(max(lags, default=0.0) * 1000, 1),
+        "stats": main.password_hasher.stats(),
+    }
+
+
+async def amain(args):
+    print(f"scrypt n={SCRYPT_N} r={SCRYPT_R} p={SCRYPT_P}, cpu={os.cpu_count()}, "
+          f"{args.logins} logins, concurrency {args.concurrency}")
+    await cleanup()
+    await seed(args.users)
+    try:
+        for workers in args.workers:
+            res = await run(workers, args.logins, args.concurrency, args.users)
+            print(f"workers={res['workers']:<3} {res['logins_per_sec']:8.1f} logins/s  "
+                  f"p50 {res['p50_ms']:7.1f}ms  p95 {res['p95_ms']:7.1f}ms  "
+                  f"max loop lag {res['max_loop_lag_ms']:7.1f}ms  avg queue wait {res['stats']['avg_wait_ms']}ms")
+    finally:
+        await cleanup()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=40)
+    parser.add_argument("--users", type=int, default=40)
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, min(4, os.cpu_count() or 1)])
+    asyncio.run(amain(parser.parse_args()))
@@ -0,0 +1,166 @@
+"""出席簿 (attendanceResult) の組み立て速度の比較
+
+旧実装 (3クエリ + Pythonの三重ループ) と attendance_matrix.build_matrix_page (全生徒・全期間) を
+同じデータで実行して時間を比べる。データは1トランザクション内で投入し、
+最後にロールバックするので既存のDBは汚れない。
+
+    python bench/matrix_benchmark.py --students 40 --days 120 --repeat 5
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import datetime
+import statistics
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+
+from database import engine
+from attendance_matrix import build_matrix_page, STATUS_CLASSES
+from partitions import academic_year, year_range
+
+BENCH_CLASS = "BENCH_MATRIX"
+
+
+async def seed(conn, n_students: int, n_days: int, start: datetime.date):
+    cid = (await conn.execute(
+        text("INSERT INTO classes (class_name, teacher_id) VALUES (:name, NULL) RETURNING class_id"),
+        {"name": BENCH_CLASS}
+    )).scalar()
+    students = [f"b{i:06d}" for i in range(n_students)]
+    await conn.execute(
+        text("""
+            INSERT INTO students (student_number, email, password_hash, name, homeroom_class, attendance_no)
+            SELECT stu, stu || '@bench.invalid', 'x', 'ベンチ ' || no, :cls, no
+            FROM unnest(CAST(:stus AS TEXT[])) WITH ORDINALITY AS t(stu, no)
+        """),
+        {"stus": students, "cls": BENCH_CLASS}
+    )
+    sids = (await conn.execute(
+        text("""
+            INSERT INTO class_sessions (class_id, date, period, sound_token)
+            SELECT :cid, CAST(:start AS DATE) + d, p, '0000'
+            FROM generate_series(0, :days - 1) AS d CROSS JOIN generate_series(1, 4) AS p
+            RETURNING session_id
+        """),
+        {"cid": cid, "start": start, "days": n_days}
+    )).scalars().all()
+
+    statuses = list(STATUS_CLASSES.keys())
+    weights = [80, 6, 6, 4, 2, 2]
+    r_sids, r_stus, r_status = [], [], []
+    for sid in sids:
+        for stu in students:
+            if random.random() < 0.9:
+                r_sids.append(sid)
+                r_stus.append(stu)
+                r_status.append(random.choices(statuses, weights)[0])
+    await conn.execute(
+        text("""
+            INSERT INTO attendance_results (session_id, session_date, student_number, status)
+            SELECT u.sid, cs.date, u.stu, u.st
+            FROM unnest(CAST(:sids AS INT[]), CAST(:stus AS TEXT[]), CAST(:sts AS TEXT[])) AS u(sid, stu, st)
+            JOIN class_sessions cs ON cs.session_id = u.sid
+        """),
+        {"sids": r_sids, "stus": r_stus, "sts": r_status}
+    )
+    for table in ("students", "class_sessions", "attendance_results"):
+        await conn.execute(text(f"ANALYZE {table}"))
+    return len(r_sids)
+
+
+async def legacy_build(conn, class_name: str, start: datetime.date, end: datetime.date):
+    # 変更前の main.attendance_result と同じ処理
+    date_headers = [(start + datetime.timedelta(days=i)).strftime('%Y-%m-%d') for i in range((end - start).days + 1)]
+    students_rows = (await conn.execute(
+        text("SELECT student_number, name, attendance_no FROM students WHERE homeroom_class = :c_name ORDER BY attendance_no"),
+        {"c_name": class_name}
+    )).fetchall()
+    sessions_rows = (await conn.execute(text("""
+        SELECT DISTINCT s.session_id, s.date, s.period
+        FROM class_sessions s
+        JOIN attendance_results ar ON s.session_id = ar.session_id
+        JOIN students stu ON ar.student_number = stu.student_number
+        WHERE stu.homeroom_class = :c_name AND s.date >= :start AND s.date <= :end
+        ORDER BY s.date, s.period
+    """), {"c_name": class_name, "start": start, "end": end})).fetchall()
+
+    session_ids = [row.session_id for row in sessions_rows]
+    attendance_map = {}
+    if session_ids:
+        bind_params = {f"id{i}": sid for i, sid in enumerate(session_ids)}
+        bind_keys = ", ".join([f":{k}" for k in bind_params.keys()])
+        sql_results = text(f"SELECT student_number, session_id, status FROM attendance_results WHERE session_id IN ({bind_keys})")
+        for r in (await conn.execute(sql_results, bind_params)).fetchall():
+            attendance_map[(r.student_number, r.session_id)] = r.status
+
+    sessions_by_date = defaultdict(dict)
+    for row in sessions_rows:
+        sessions_by_date[row.date.strftime('%Y-%m-%d')][row.period if row.period else 1] = row.session_id
+
+    students_data = []
+    for stu in students_rows:
+        stu_record = {"number": stu.attendance_no, "student_number": stu.student_number, "name": stu.name, "dates": {}}
+        for d in date_headers:
+            day_statuses = []
+            day_session_map = sessions_by_date.get(d, {})
+            for i in range(1, 5):
+                status_data = {"period": i, "class": "no-data", "text": "データなし"}
+                if i in day_session_map:
+                    raw = attendance_map.get((stu.student_number, day_session_map[i]))
+                    if raw in STATUS_CLASSES:
+                        status_data.update({"class": STATUS_CLASSES[raw], "text": raw})
+                day_statuses.append(status_data)
+            stu_record["dates"][d] = day_statuses
+        students_data.append(stu_record)
+    return date_headers, students_data
+
+
+async def timed(fn, repeat: int):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = await fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return result, samples
+
+
+async def main(args):
+    # 今年度の初めから (今年度のパーティションはサーバーの起動時に ensure_partitions で作られる)
+    start = year_range(academic_year(datetime.date.today()))[0]
+    end = start + datetime.timedelta(days=args.days - 1)
+    async with engine.connect() as conn:
+        trans = await conn.begin()
+        try:
+            n_results = await seed(conn, args.students, args.days, start)
+            print(f"seeded: {args.students} students x {args.days} days x 4 periods ({n_results} results)")
+
+            old, old_ms = await timed(lambda: legacy_build(conn, BENCH_CLASS, start, end), args.repeat)
+            new, new_ms = await timed(
+                lambda: build_matrix_page(conn, BENCH_CLASS, start, end, offset=0, limit=None), args.repeat)
+
+            # 両実装の結果が一致するか確認
+            old_cells = [[c["class"] for d in old[0] for c in s["dates"][d]] for s in old[1]]
+            new_cells = [[STATUS_CLASSES[c] if c else "no-data" for c in s["cells"]] for s in new["students"]]
+            assert old[0] == new["date_headers"] and old_cells == new_cells, "results differ"
+
+            print(f"legacy  median {statistics.median(old_ms):8.1f} ms  (min {min(old_ms):.1f})")
+            print(f"matrix  median {statistics.median(new_ms):8.1f} ms  (min {min(new_ms):.1f})")
+            print(f"speed-up x{statistics.median(old_ms) / statistics.median(new_ms):.1f}")
+        finally:
+            await trans.rollback()
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--students", type=int, default=40)
+    parser.add_argument("--days", type=int, default=120)
+    parser.add_argument("--repeat", type=int, default=5)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,185 @@
+"""serve.py のワーカー数ごとのスループット
+
+ワーカー数を変えて serve.py を起動し、教師の出席簿の読み込み
+(/api/attendance_matrix と /attendanceResult) を --concurrency 本の接続から
+--duration 秒間送り続けて、1秒あたりの件数と応答時間を比べる。
+
+あわせて、あるワーカーで /api/generate_otp した直後に別の接続 (別のワーカーに
+届くことがある) から /api/check_attend して、セッションが他のワーカーへ
+伝わっているか (「授業なし」「コード不一致」にならないか) を確かめる。
+
+データは bench/loadtest.py seed で作ったものを使う。
+
+    python bench/loadtest.py seed --classes 4 --students 40
+    python bench/serve_scaling.py --workers 1 2 4 --duration 10 --concurrency 32
+"""
+import os
+import sys
+import json
+import time
+import random
+import signal
+import asyncio
+import argparse
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+from database import engine
+from loadtest import (
+    ROOT, BENCH_PASSWORD, Recorder, User, load_classes, clear_today, history_range,
+    teacher_email, student_email,
+)
+
+
+def start_server(workers: int, port: int, budget: int, cluster_notify: bool) -> subprocess.Popen:
+    env = dict(os.environ, DB_CONNECTION_BUDGET=str(budget), CLUSTER_NOTIFY="1" if cluster_notify else "0")
+    return subprocess.Popen(
+        [sys.executable, "serve.py", "--workers", str(workers), "--host", "127.0.0.1", "--port", str(port)],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+async def wait_ready(url: str, proc: subprocess.Popen, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=url) as client:
+        while time.monotonic() < deadline:
+            if proc.poll() is not None:
+                raise SystemExit(f"serve.py が終了しました (exit {proc.returncode})")
+            try:
+                if (await client.get("/")).status_code == 200:
+                    # 全ワーカーの起動を待つ
+                    await asyncio.sleep(2)
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.3)
+    raise SystemExit("serve.py が起動しませんでした")
+
+
+def stop_server(proc: subprocess.Popen):
+    proc.send_signal(signal.SIGINT)
+    try:
+        proc.wait(timeout=20)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+async def login(url: str, email: str, recorder: Recorder, limit: asyncio.Semaphore) -> User:
+    # 1ユーザー = 1接続 (接続ごとにどのワーカーが受け付けるかはOSが決める)
+    client = httpx.AsyncClient(base_url=url, timeout=60, limits=httpx.Limits(max_connections=1))
+    user = User(client, recorder, limit)
+    r = await user.request("login", "POST", "/login", data={"email": email, "password": BENCH_PASSWORD})
+    if r is None or r.status_code != 303 or r.headers.get("location", "/?").startswith("/?"):
+        raise SystemExit(f"ログインに失敗しました: {email} (bench/loadtest.py seed を先に実行してください)")
+    return user
+
+
+async def propagation_check(url: str, cls: dict, n_students: int, limit: asyncio.Semaphore) -> dict:
+    """generate_otp の直後に、別の接続から check_attend して届いているかを数える"""
+    await clear_today()
+    recorder = Recorder()
+    teacher = await login(url, teacher_email(cls["index"]), recorder, limit)
+    students = [await login(url, student_email(cls["index"], n), recorder, limit) for n in range(1, n_students + 1)]
+    # no_session: セッションが伝わっていない、stale_otp: 前回のOTPのまま (新しいOTPが伝わっていない)
+    result = {"attempts": 0, "ok": 0, "no_session": 0, "stale_otp": 0, "other": 0}
+    try:
+        for i, student in enumerate(students):
+            r = await teacher.request("generate_otp", "POST", "/api/generate_otp",
+                                      json={"class_id": str(cls["class_id"]), "period": i % 4 + 1})
+            otp = r.json()["otp_display"]
+            r = await student.request("check_attend", "POST", "/api/check_attend", json={"otp_value": otp})
+            message = r.json().get("message")
+            result["attempts"] += 1
+            if r.json().get("status") == "success":
+                result["ok"] += 1
+            elif message == "授業なし":
+                result["no_session"] += 1
+            elif message == "コード不一致":
+                result["stale_otp"] += 1
+            else:
+                result["other"] += 1
+        r = await teacher.request("stats", "GET", "/api/cluster_bus/stats")
+        result["bus"] = r.json().get("stats") if r is not None and r.status_code == 200 else None
+    finally:
+        for u in [teacher] + students:
+            await u.client.aclose()
+    return result
+
+
+async def throughput(url: str, classes: list, args) -> dict:
+    recorder = Recorder()
+    limit = asyncio.Semaphore(args.concurrency)
+    start, end = history_range(args.weeks)
+    users = [await login(url, teacher_email(classes[i % len(classes)]["index"]), recorder, limit)
+             for i in range(args.concurrency)]
+    rng = random.Random(args.seed)
+    stop_at = time.perf_counter() + args.duration
+
+    async def virtual_user(i: int, user: User):
+        cls = classes[i % len(classes)]
+        while time.perf_counter() < stop_at:
+            params = {"class_name": cls["class_name"], "start_date": start.isoformat(), "end_date": end.isoformat()}
+            if rng.random() < 0.8:
+                await user.request("attendance_matrix", "GET", "/api/attendance_matrix", params=params)
+            else:
+                await user.request("attendance_result_page", "GET", "/attendanceResult", params=params)
+
+    began = time.perf_counter()
+    try:
+        await asyncio.gather(*(virtual_user(i, u) for i, u in enumerate(users)))
+    finally:
+        for u in users:
+            await u.client.aclose()
+    elapsed = time.perf_counter() - began
+    summary = recorder.summary({"*": elapsed})
+    summary.pop("login", None)
+    total = sum(s["requests"] for s in summary.values())
+    return {"requests": total, "rps": round(total / elapsed, 1), "endpoints": summary}
+
+
+async def amain(args):
+    classes = await load_classes(args.classes)
+    await engine.dispose()
+    url = f"http://127.0.0.1:{args.port}"
+    results = []
+    for workers in args.workers:
+        proc = start_server(workers, args.port, args.budget, not args.no_cluster_notify)
+        try:
+            await wait_ready(url, proc)
+            prop = await propagation_check(url, classes[0], args.propagation, asyncio.Semaphore(args.concurrency))
+            res = await throughput(url, classes, args)
+        finally:
+            stop_server(proc)
+        res.update(workers=workers, propagation=prop)
+        results.append(res)
+        base = results[0]["rps"] or 1
+        m = res["endpoints"].get("attendance_matrix", {})
+        print(f"workers={workers:<3} {res['rps']:8.1f} req/s ({res['rps'] / base:4.2f}x)  "
+              f"matrix p50 {m.get('p50_ms', 0):7.1f}ms p99 {m.get('p99_ms', 0):7.1f}ms  "
+              f"check_attend after generate_otp: {prop['ok']}/{prop['attempts']} ok "
+              f"({prop['no_session']} 授業なし, {prop['stale_otp']} コード不一致)")
+    await engine.dispose()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"cpu_count": os.cpu_count(), "args": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"✅ {args.output} に保存しました")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=sorted({1, 2, os.cpu_count() or 1}))
+    parser.add_argument("--classes", type=int, default=4)
+    parser.add_argument("--weeks", type=int, default=4, help="読み込む期間 (週)")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--concurrency", type=int, default=32, help="同時に使う接続数")
+    parser.add_argument("--propagation", type=int, default=20, help="セッションの伝わり方を確かめる回数")
+    parser.add_argument("--budget", type=int, default=40, help="DB_CONNECTION_BUDGET (全ワーカー合計の接続数)")
+    parser.add_argument("--no-cluster-notify", action="store_true", help="LISTEN/NOTIFY なしで比べる")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output")
+    asyncio.run(amain(parser.parse_args()))
@@ -0,0 +1,221 @@
+"""静的ファイルのビルド (static/ -> static/dist/)
+
+    python build_assets.py            # static/dist/ を作り直す
+    python build_assets.py --check    # 作ったものの一覧とサイズ
+
+static/ の下のファイルを、内容の sha256 の先頭10桁を入れた名前で static/dist/ に書き出す
+(css/common.css -> dist/css/common.3f9a1c2b4d.css)。元の名前との対応は
+static/dist/manifest.json に書き、テンプレートの asset_url() がこれを読む (assets.py)。
+名前が内容ごとに変わるので、ブラウザには1年間キャッシュさせてよい。
+
+- 圧縮の効くファイル (CSS / JS / WAV / ico など) は .gz と .br を隣に置く。
+  .br は brotli モジュールがあるときだけ作る。元より1割以上小さくならないものは置かない。
+- 出席確認のBGM (sounds/bgm.wav) は、小さく符号化したものも作る。
+  ffmpeg があれば Opus (bgm.opus.ogg)、無くてもモノラル・半分のサンプリング周波数の
+  WAV (bgm.compact.wav) を作る。信号音 (17〜19kHz) より上の帯域は元々BGMに要らないので、
+  BGMの高音が信号に重ならなくなる。
+"""
+import io
+import os
+import sys
+import gzip
+import json
+import wave
+import shutil
+import hashlib
+import argparse
+import subprocess
+from typing import Dict, Optional
+
+import numpy as np
+
+from assets import STATIC_DIR, DIST_DIR, MANIFEST_NAME
+
+try:
+    import brotli
+except ImportError:  # .br は作らず .gz だけにする
+    brotli = None
+
+HASH_LENGTH = 10
+# 圧縮済みのファイルを作る拡張子 (画像の webp / png や Opus は元々圧縮されている)
+COMPRESSIBLE = {".css", ".js", ".json", ".svg", ".ico", ".txt", ".wav", ".html"}
+# 元の何割以下になったら圧縮済みのファイルを置くか
+MIN_COMPRESSION_RATIO = 0.9
+
+BGM_SOURCE = "sounds/bgm.wav"
+BGM_OPUS = "sounds/bgm.opus.ogg"
+BGM_COMPACT = "sounds/bgm.compact.wav"
+BGM_OPUS_BITRATE = "64k"
+
+
+def fingerprint(rel_path: str, data: bytes) -> str:
+    digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+    head, ext = os.path.splitext(rel_path)
+    # bgm.opus.ogg -> bgm.opus.<hash>.ogg
+    return f"{head}.{digest}{ext}"
+
+
+def write_file(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def write_precompressed(path: str, data: bytes) -> Dict[str, int]:
+    """.gz / .br を書き、作ったものの大きさを返す"""
+    sizes = {}
+    # mtime=0 にして、同じ内容からは同じ .gz ができるようにする
+    variants = [(".gz", gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append((".br", brotli.compress(data, quality=11)))
+    for suffix, compressed in variants:
+        if len(compressed) <= len(data) * MIN_COMPRESSION_RATIO:
+            write_file(path + suffix, compressed)
+            sizes[suffix] = len(compressed)
+    return sizes
+
+
+def encode_bgm_opus(src: str) -> Optional[bytes]:
+    """ffmpeg で Opus にする (ffmpeg が無ければ None)"""
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        return None
+    try:
+        result = subprocess.run(
+            [ffmpeg, "-v", "error", "-i", src, "-ac", "1", "-c:a", "libopus", "-b:a", BGM_OPUS_BITRATE,
+             "-f", "ogg", "pipe:1"],
+            check=True, capture_output=True,
+        )
+    except subprocess.CalledProcessError as e:
+        print(f"Opus Encode Error: {e.stderr.decode(errors='replace').strip()}")
+        return None
+    return result.stdout
+
+
+def encode_bgm_compact(src: str) -> Optional[bytes]:
+    """モノラル・半分のサンプリング周波数の 16bit WAV にする (どのブラウザでも再生できる)"""
+    with wave.open(src, "rb") as w:
+        channels, sampwidth, rate = w.getnchannels(), w.getsampwidth(), w.getframerate()
+        frames = w.readframes(w.getnframes())
+    if sampwidth != 2 or rate < 32000:
+        print(f"BGM: {src} は 16bit / 32kHz 以上ではないので小さくしません")
+        return None
+
+    samples = np.frombuffer(frames, dtype="<i2").astype(np.float64)
+    mono = samples.reshape(-1, channels).mean(axis=1)
+
+    # 新しいナイキスト周波数の手前で切る低域通過フィルタ (窓関数法) をかけてから間引く
+    taps = 101
+    cutoff = 0.45 / 2  # 元のサンプリング周波数に対する比
+    n = np.arange(taps) - (taps - 1) / 2
+    kernel = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(taps)
+    kernel /= kernel.sum()
+    filtered = np.convolve(mono, kernel, mode="same")[::2]
+
+    out = np.clip(np.round(filtered), -32768, 32767).astype("<i2")
+    return _wav_bytes(out.tobytes(), rate // 2)
+
+
+def _wav_bytes(frames: bytes, rate: int) -> bytes:
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(frames)
+    return buf.getvalue()
+
+
+def build(static_dir: str = STATIC_DIR) -> dict:
+    dist_dir = os.path.join(static_dir, DIST_DIR)
+    if os.path.isdir(dist_dir):
+        shutil.rmtree(dist_dir)
+
+    sources: Dict[str, bytes] = {}
+    for root, dirs, files in os.walk(static_dir):
+        if os.path.abspath(root) == os.path.abspath(static_dir):
+            dirs[:] = [d for d in dirs if d != DIST_DIR]
+        for name in sorted(files):
+            if name.startswith("."):
+                continue
+            full = os.path.join(root, name)
+            rel = os.path.relpath(full, static_dir).replace(os.sep, "/")
+            with open(full, "rb") as f:
+                sources[rel] = f.read()
+
+    bgm_path = os.path.join(static_dir, BGM_SOURCE)
+    if BGM_SOURCE in sources:
+        opus = encode_bgm_opus(bgm_path)
+        if opus:
+            sources[BGM_OPUS] = opus
+        else:
+            print("BGM: ffmpeg が無いので Opus は作りません")
+        compact = encode_bgm_compact(bgm_path)
+        if compact:
+            sources[BGM_COMPACT] = compact
+
+    files, report = {}, {}
+    for rel, data in sorted(sources.items()):
+        hashed = fingerprint(rel, data)
+        out = os.path.join(dist_dir, hashed)
+        write_file(out, data)
+        files[rel] = hashed
+        sizes = {"": len(data)}
+        if os.path.splitext(rel)[1].lower() in COMPRESSIBLE:
+            sizes.update(write_precompressed(out, data))
+        report[hashed] = sizes
+
+    manifest = {"files": files}
+    write_file(os.path.join(dist_dir, MANIFEST_NAME),
+               json.dumps(manifest, ensure_ascii=False, indent=2, sort_keys=True).encode("utf-8"))
+    return report
+
+
+def print_report(report: dict):
+    total = {"": 0, ".gz": 0, ".br": 0}
+    for name, sizes in sorted(report.items()):
+        variants = "  ".join(f"{suffix} {size:,}" for suffix, size in sizes.items() if suffix)
+        print(f"{name:<48} {sizes[''] :>10,}  {variants}")
+        for suffix in total:
+            # 圧縮版が無いものは元の大きさのまま配られる
+            total[suffix] += sizes.get(suffix, sizes[""])
+    print(f"{'合計':<46} {total[''] :>10,}  .gz {total['.gz']:,}" + (f"  .br {total['.br']:,}" if brotli else ""))
+
+
+def scan_dist(static_dir: str = STATIC_DIR) -> dict:
+    dist_dir = os.path.join(static_dir, DIST_DIR)
+    manifest_path = os.path.join(dist_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, encoding="utf-8") as f:
+        files = json.load(f)["files"]
+    report = {}
+    for hashed in files.values():
+        out = os.path.join(dist_dir, hashed)
+        sizes = {"": os.path.getsize(out)}
+        for suffix in (".gz", ".br"):
+            if os.path.exists(out + suffix):
+                sizes[suffix] = os.path.getsize(out + suffix)
+        report[hashed] = sizes
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="静的ファイルのビルド")
+    parser.add_argument("--check", action="store_true", help="作り直さずに一覧を出す")
+    args = parser.parse_args()
+
+    if args.check:
+        report = scan_dist()
+        if not report:
+            print("static/dist がありません (python build_assets.py で作ってください)")
+            sys.exit(1)
+    else:
+        if brotli is None:
+            print("brotli モジュールが無いので .br は作りません")
+        report = build()
+    print_report(report)
+
+
+if __name__ == "__main__":
+    main()
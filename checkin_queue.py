@@ -0,0 +1,163 @@
+import os
+import asyncio
+import datetime
+from dataclasses import dataclass
+from typing import Optional, List, Tuple
+
+from sqlalchemy import text
+
+# まとめ書き込み (グループコミット) を使うかどうか。既定はOFF
+CHECKIN_BATCH_ENABLED = os.getenv("CHECKIN_BATCH_ENABLED", "0") == "1"
+# 1回の書き込みでまとめる最大件数
+CHECKIN_BATCH_MAX_ROWS = int(os.getenv("CHECKIN_BATCH_MAX_ROWS", "200"))
+# 最初の1件が来てから書き込むまでの最大待ち時間 (ミリ秒)
+CHECKIN_BATCH_INTERVAL_MS = int(os.getenv("CHECKIN_BATCH_INTERVAL_MS", "50"))
+# キューの上限。溢れた場合は空きができるまで呼び出し側が待つ
+CHECKIN_QUEUE_SIZE = int(os.getenv("CHECKIN_QUEUE_SIZE", "2000"))
+
+# 複数人分の出席を1文で登録し、生徒情報もまとめて返す
+# (既に登録済みの行は挿入せず inserted = false になる)
+# session_date は attendance_results の分割キー (セッションの日付)
+INSERT_CHECKINS_SQL = text("""
+    WITH input AS (
+        SELECT * FROM unnest(CAST(:sids AS INT[]), CAST(:dates AS DATE[]), CAST(:stus AS TEXT[]))
+            AS t(session_id, session_date, student_number)
+    ),
+    ins AS (
+        INSERT INTO attendance_results (session_id, session_date, student_number, status, note)
+        SELECT i.session_id, i.session_date, i.student_number, '出席', 'アプリ'
+        FROM input i
+        JOIN students s ON s.student_number = i.student_number
+        ON CONFLICT (session_id, student_number, session_date) DO NOTHING
+        RETURNING session_id, student_number
+    )
+    SELECT i.session_id, i.student_number, s.name, s.attendance_no,
+           (ins.student_number IS NOT NULL) AS inserted
+    FROM input i
+    LEFT JOIN students s ON s.student_number = i.student_number
+    LEFT JOIN ins ON ins.session_id = i.session_id AND ins.student_number = i.student_number
+""").execution_options(metrics_name="insert_checkins")
+
+
+@dataclass
+class CheckinResult:
+    # "success" / "duplicate" / "unknown_student"
+    status: str
+    name: Optional[str] = None
+    attendance_no: Optional[int] = None
+
+
+async def insert_checkins(conn, items: List[Tuple[int, datetime.date, str]]) -> List[CheckinResult]:
+    """items: (セッションID, セッションの日付, 学籍番号) のリスト"""
+    # 同じ (セッション, 生徒) が複数あれば最初の1件だけ登録し、残りは重複扱い
+    unique_items = list(dict.fromkeys(items))
+    rows = (await conn.execute(INSERT_CHECKINS_SQL, {
+        "sids": [sid for sid, _, _ in unique_items],
+        "dates": [d for _, d, _ in unique_items],
+        "stus": [stu for _, _, stu in unique_items],
+    })).fetchall()
+
+    by_key = {}
+    for r in rows:
+        if r.inserted:
+            res = CheckinResult("success", r.name, r.attendance_no)
+        elif r.name is None:
+            res = CheckinResult("unknown_student")
+        else:
+            res = CheckinResult("duplicate", r.name, r.attendance_no)
+        by_key[(r.session_id, r.student_number)] = res
+
+    results = []
+    seen = set()
+    for key in items:
+        res = by_key.get((key[0], key[2]), CheckinResult("unknown_student"))
+        if key in seen and res.status == "success":
+            res = CheckinResult("duplicate", res.name, res.attendance_no)
+        seen.add(key)
+        results.append(res)
+    return results
+
+
+class CheckinQueue:
+    """出席登録をキューに溜め、バックグラウンドでまとめてINSERTする。
+
+    40人分の出席が数秒に集中しても、コミット回数は
+    (待ち時間 or 件数) ごとに1回で済む。呼び出し側には
+    自分の行の結果 (成功 / 重複) が個別に返る。
+    """
+
+    def __init__(self, engine, max_rows: int = CHECKIN_BATCH_MAX_ROWS,
+                 interval_ms: int = CHECKIN_BATCH_INTERVAL_MS, maxsize: int = CHECKIN_QUEUE_SIZE):
+        self.engine = engine
+        self.max_rows = max_rows
+        self.interval = interval_ms / 1000
+        self.maxsize = maxsize
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # 統計
+        self.flushed_batches = 0
+        self.flushed_rows = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if not self.running:
+            return
+        # 残っている分を書き込んでから止める
+        await self._queue.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def submit(self, session_id: int, session_date: datetime.date, student_number: str) -> CheckinResult:
+        fut = asyncio.get_running_loop().create_future()
+        await self._queue.put(((session_id, session_date, student_number), fut))
+        return await fut
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.interval
+            while len(batch) < self.max_rows:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._flush(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _flush(self, batch):
+        items = [item for item, _ in batch]
+        try:
+            async with self.engine.begin() as conn:
+                results = await insert_checkins(conn, items)
+        except Exception as e:
+            print(f"❌ Checkin Batch Error: {e}")
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+
+        self.flushed_batches += 1
+        self.flushed_rows += len(batch)
+        for (_, fut), res in zip(batch, results):
+            if not fut.done():
+                fut.set_result(res)
@@ -0,0 +1,110 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional
+
+# 担任クラス一覧のキャッシュ有効期限 (秒)
+CLASS_CACHE_TTL = float(os.getenv("CLASS_CACHE_TTL", "300"))
+# 保持する教師の最大数。超えた分は最も使われていないものから捨てる
+CLASS_CACHE_MAX_ENTRIES = int(os.getenv("CLASS_CACHE_MAX_ENTRIES", "256"))
+
+
+class TeacherClassCache:
+    """教師ごとの担任クラス一覧 (TTL + LRU)。
+
+    教師向けページは表示のたびにクラス一覧を使うが、内容はほとんど変わらない。
+    classes を変更したら invalidate / clear を呼ぶこと。
+    同じ教師の読み込みが同時に来た場合、DBへの問い合わせは1回にまとめる。
+    """
+
+    def __init__(self, ttl: float = CLASS_CACHE_TTL, max_entries: int = CLASS_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # 教師ID -> (有効期限, クラス一覧)。末尾ほど最近使われたもの
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        # 読み込み中の教師ID -> Future
+        self._loading: Dict[int, asyncio.Future] = {}
+        # invalidate されるたびに増やし、それ以前に始まった読み込み結果は保存しない
+        self._generation = 0
+        # 統計
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, teacher_id: int) -> Optional[List[dict]]:
+        entry = self._entries.get(teacher_id)
+        if entry is None:
+            return None
+        expires_at, classes = entry
+        if expires_at <= time.monotonic():
+            del self._entries[teacher_id]
+            return None
+        self._entries.move_to_end(teacher_id)
+        return classes
+
+    def put(self, teacher_id: int, classes: List[dict]) -> None:
+        self._entries[teacher_id] = (time.monotonic() + self.ttl, classes)
+        self._entries.move_to_end(teacher_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get_or_load(self, teacher_id: int, loader: Callable[[int], Awaitable[List[dict]]]) -> List[dict]:
+        classes = self.get(teacher_id)
+        if classes is not None:
+            self.hits += 1
+            return classes
+
+        pending = self._loading.get(teacher_id)
+        if pending is not None:
+            self.hits += 1
+            return await asyncio.shield(pending)
+
+        self.misses += 1
+        generation = self._generation
+        fut = asyncio.get_running_loop().create_future()
+        self._loading[teacher_id] = fut
+        try:
+            classes = await loader(teacher_id)
+        except BaseException as e:
+            fut.set_exception(e)
+            # 待っている呼び出しがない場合に「未取得の例外」警告を出さない
+            fut.exception()
+            raise
+        finally:
+            self._loading.pop(teacher_id, None)
+
+        if generation == self._generation:
+            self.put(teacher_id, classes)
+        fut.set_result(classes)
+        return classes
+
+    def invalidate(self, teacher_id: Optional[int] = None) -> None:
+        # teacher_id を省略した場合は全件 (クラス名の変更など複数の教師に関わる場合)
+        self._generation += 1
+        if teacher_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(teacher_id, None)
+
+    def clear(self) -> None:
+        self.invalidate()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 3) if total else None,
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+teacher_class_cache = TeacherClassCache()
@@ -0,0 +1,188 @@
+"""ワーカー間の通知 (PostgreSQL の LISTEN/NOTIFY)
+
+serve.py で複数ワーカーを起動すると、メモリ上の状態 (出席確認中のセッション、
+担任クラス一覧のキャッシュ、出席確認画面への通知) はワーカーごとに別々になる。
+変更したワーカーが publish し、他のワーカーが on で登録した処理で同じ変更を反映する。
+外部のメッセージブローカーは使わず、既にある PostgreSQL だけで完結させる。
+"""
+import os
+import json
+import time
+import asyncio
+import secrets
+from typing import Any, Callable, Dict, List, Optional
+
+import asyncpg
+
+# 1 で有効 (serve.py がワーカー数2以上で起動したときに自動で 1 にする)
+CLUSTER_NOTIFY = os.getenv("CLUSTER_NOTIFY", "0") == "1"
+CLUSTER_CHANNEL = os.getenv("CLUSTER_CHANNEL", "cocone_events")
+# 接続が生きているかを確かめる間隔と、切れた後に再接続するまでの待ち時間 (秒)
+CLUSTER_KEEPALIVE = float(os.getenv("CLUSTER_KEEPALIVE", "30"))
+CLUSTER_RECONNECT_DELAY = float(os.getenv("CLUSTER_RECONNECT_DELAY", "1"))
+# 未送信のまま溜めておく最大数 (DBに繋がらない間はここで古いものから捨てる)
+CLUSTER_OUTBOX_MAX = 10000
+
+# NOTIFY のペイロードは 8000 バイトまで
+MAX_PAYLOAD_BYTES = 7900
+
+NOTIFY_SQL = "SELECT pg_notify($1, p) FROM unnest($2::text[]) AS p"
+
+
+class ClusterBus:
+    """LISTEN 用の専用接続を1本持ち、送信もその接続でまとめて行う。
+
+    publish は待たずに送信待ちに積むだけなので、リクエストの処理を遅らせない。
+    自分が送ったものは受け取っても無視する (送る側で既に反映している)。
+    接続が切れていた間の通知は届かないので、再接続したら on_resync の処理で
+    DBから読み直す。
+    """
+
+    def __init__(self, dsn: str, channel: str = CLUSTER_CHANNEL, enabled: bool = CLUSTER_NOTIFY):
+        self.dsn = dsn
+        self.channel = channel
+        self.enabled = enabled
+        self.worker_id = f"{os.getpid()}-{secrets.token_hex(3)}"
+        self._handlers: Dict[str, List[Callable[[dict], Any]]] = {}
+        self._resync: List[Callable[[], Any]] = []
+        self._outbox: List[str] = []
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.connected = False
+        # 統計
+        self.sent = 0
+        self.received = 0
+        self.dropped = 0
+        self.errors = 0
+        self.reconnects = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def on(self, kind: str, handler: Callable[[dict], Any]) -> None:
+        """他のワーカーから kind の通知が届いたときに handler(data) を呼ぶ"""
+        self._handlers.setdefault(kind, []).append(handler)
+
+    def on_resync(self, handler: Callable[[], Any]) -> None:
+        """再接続したときに呼ぶ (同期関数・コルーチン関数のどちらでもよい)"""
+        self._resync.append(handler)
+
+    def publish(self, kind: str, data: dict) -> None:
+        if not self.enabled or self._wake is None:
+            return
+        payload = json.dumps({"o": self.worker_id, "k": kind, "t": time.time(), "d": data},
+                             ensure_ascii=False, default=str)
+        if len(payload.encode("utf-8")) > MAX_PAYLOAD_BYTES:
+            print(f"Cluster Bus Error: payload too large ({kind})")
+            self.errors += 1
+            return
+        if len(self._outbox) >= CLUSTER_OUTBOX_MAX:
+            self._outbox.pop(0)
+            self.dropped += 1
+        self._outbox.append(payload)
+        self._wake.set()
+
+    async def start(self):
+        if not self.enabled or self._task is not None:
+            return
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._wake = None
+
+    async def _run(self):
+        first = True
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(self.dsn)
+                await conn.add_listener(self.channel, self._on_notification)
+                conn.add_termination_listener(lambda _c: self._wake.set())
+                self.connected = True
+                if not first:
+                    self.reconnects += 1
+                    await self._run_resync()
+                first = False
+                await self._serve(conn)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                print(f"Cluster Bus Error: {e}")
+            finally:
+                self.connected = False
+                if conn is not None and not conn.is_closed():
+                    try:
+                        await asyncio.shield(conn.close(timeout=2))
+                    except Exception:
+                        conn.terminate()
+            await asyncio.sleep(CLUSTER_RECONNECT_DELAY)
+
+    async def _serve(self, conn):
+        while not conn.is_closed():
+            try:
+                await asyncio.wait_for(self._wake.wait(), CLUSTER_KEEPALIVE)
+            except asyncio.TimeoutError:
+                await conn.fetchval("SELECT 1")
+                continue
+            self._wake.clear()
+            if not self._outbox:
+                continue
+            batch, self._outbox = self._outbox, []
+            try:
+                # 1文で送るので、全部届くか全部届かないかのどちらか
+                await conn.execute(NOTIFY_SQL, self.channel, batch)
+            except Exception:
+                self._outbox[:0] = batch
+                raise
+            self.sent += len(batch)
+
+    async def _run_resync(self):
+        for handler in self._resync:
+            try:
+                result = handler()
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as e:
+                print(f"Cluster Bus Resync Error: {e}")
+
+    def _on_notification(self, _conn, _pid, _channel, payload: str):
+        try:
+            msg = json.loads(payload)
+        except ValueError:
+            return
+        if msg.get("o") == self.worker_id:
+            return
+        self.received += 1
+        latency = max(0.0, time.time() - msg.get("t", time.time()))
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        for handler in self._handlers.get(msg.get("k"), ()):
+            try:
+                handler(msg.get("d") or {})
+            except Exception as e:
+                self.errors += 1
+                print(f"Cluster Bus Handler Error ({msg.get('k')}): {e}")
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "connected": self.connected,
+            "worker_id": self.worker_id,
+            "pending": len(self._outbox),
+            "sent": self.sent,
+            "received": self.received,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "reconnects": self.reconnects,
+            "avg_latency_ms": round(self.total_latency / self.received * 1000, 2) if self.received else 0.0,
+            "max_latency_ms": round(self.max_latency * 1000, 2),
+        }
@@ -0,0 +1,80 @@
+import io
+import csv
+import codecs
+import datetime
+from typing import AsyncIterator, Callable, Optional
+
+from sqlalchemy import text
+
+from attendance_matrix import LATEST_RESULTS_CTE, NO_DATA_TEXT
+
+CSV_HEADER = ['日付', '時限', 'クラス', '出席番号', '学籍番号', '氏名', '状態', '備考']
+# サーバーサイドカーソルから一度に取り出す行数 (= 1チャンクの行数)
+EXPORT_FETCH_ROWS = 1000
+
+# 日付 × 時限(1〜4) × 生徒 の全組み合わせをDB側で作り、
+# 各生徒のその日・その時限の結果を (なければ NULL で) 付けて返す
+EXPORT_ROWS_SQL = text(f"""
+    WITH {LATEST_RESULTS_CTE}
+    SELECT d.day AS date, p.period, st.attendance_no, st.student_number, st.name, res.status, res.note
+    FROM days d
+    CROSS JOIN generate_series(1, 4) AS p(period)
+    JOIN students st ON st.homeroom_class = :c_name
+    LEFT JOIN res ON res.student_number = st.student_number
+                 AND res.date = d.day
+                 AND res.period = p.period
+    ORDER BY d.day, p.period, st.attendance_no
+""").execution_options(metrics_name="attendance_csv_export")
+
+
+# 書き出す行数 (日数 × 4時限 × クラスの生徒数)。バックグラウンド出力の進み具合に使う
+COUNT_STUDENTS_SQL = text("SELECT COUNT(*) FROM students WHERE homeroom_class = :c_name")
+
+
+async def count_export_rows(conn, class_name: str, start_date: str, end_date: str) -> int:
+    days = (datetime.date.fromisoformat(end_date) - datetime.date.fromisoformat(start_date)).days + 1
+    students = (await conn.execute(COUNT_STUDENTS_SQL, {"c_name": class_name})).scalar()
+    return max(0, days) * 4 * students
+
+
+def _csv_line(row) -> str:
+    buf = io.StringIO()
+    csv.writer(buf).writerow(row)
+    return buf.getvalue()
+
+
+async def stream_attendance_csv(engine, class_name: str, start_date: str, end_date: str,
+                                on_rows: Optional[Callable[[int], None]] = None,
+                                raise_errors: bool = False) -> AsyncIterator[bytes]:
+    """on_rows: チャンクごとに書いた行数を受け取る。raise_errors: エラーをCSVに書かず例外にする (ジョブ用)"""
+    # BOM(先頭のみ)とヘッダーは問い合わせ前に送り、すぐにダウンロードを開始させる
+    yield codecs.BOM_UTF8 + _csv_line(CSV_HEADER).encode('utf-8')
+
+    try:
+        s_date = datetime.date.fromisoformat(start_date)
+        e_date = datetime.date.fromisoformat(end_date)
+
+        async with engine.connect() as conn:
+            result = await conn.stream(
+                EXPORT_ROWS_SQL.execution_options(yield_per=EXPORT_FETCH_ROWS),
+                {"c_name": class_name, "start": s_date, "end": e_date}
+            )
+            async for rows in result.partitions():
+                buf = io.StringIO()
+                writer = csv.writer(buf)
+                for r in rows:
+                    writer.writerow([
+                        r.date.strftime('%Y-%m-%d'), r.period, class_name,
+                        r.attendance_no, r.student_number, r.name,
+                        r.status or NO_DATA_TEXT, r.note or ""
+                    ])
+                yield buf.getvalue().encode('utf-8')
+                if on_rows:
+                    on_rows(len(rows))
+
+    except Exception as e:
+        print(f"CSV Gen Error: {e}")
+        if raise_errors:
+            raise
+        yield _csv_line(["Error", str(e)]).encode('utf-8')
+
@@ -11,6 +11,8 @@ DROP TABLE IF EXISTS classes CASCADE;
 DROP TABLE IF EXISTS teachers CASCADE;
 -- 古いテーブルが残っている場合のために念のため削除
 DROP TABLE IF EXISTS courses CASCADE;
+-- マイグレーション履歴もリセット (起動時に db/migrations が再適用される)
+DROP TABLE IF EXISTS schema_migrations CASCADE;
 
 -- 2. テーブル作成
 
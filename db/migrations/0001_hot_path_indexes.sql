@@ -0,0 +1,51 @@
+-- ==========================================
+-- 0001: よく使う検索条件へのインデックスと一意制約
+-- ==========================================
+
+-- ▼ 同じクラス・日付・コマのセッションが複数ある場合は最新の1件にまとめる
+UPDATE attendance_results ar
+SET session_id = keep.session_id
+FROM (
+    SELECT session_id AS old_id,
+           MAX(session_id) OVER (PARTITION BY class_id, date, period) AS session_id
+    FROM class_sessions
+    WHERE class_id IS NOT NULL
+) keep
+WHERE ar.session_id = keep.old_id
+  AND keep.old_id <> keep.session_id;
+
+DELETE FROM class_sessions cs
+USING class_sessions newer
+WHERE cs.class_id = newer.class_id
+  AND cs.date = newer.date
+  AND cs.period IS NOT DISTINCT FROM newer.period
+  AND cs.session_id < newer.session_id;
+
+-- ▼ 同じセッションに同じ生徒の結果が複数ある場合は最新の1件だけ残す
+DELETE FROM attendance_results ar
+USING attendance_results newer
+WHERE ar.session_id = newer.session_id
+  AND ar.student_number = newer.student_number
+  AND ar.result_id < newer.result_id;
+
+-- ▼ 一意制約 (インデックスも兼ねる)
+-- check_attend / update_status の (session_id, student_number) 検索
+ALTER TABLE attendance_results
+    ADD CONSTRAINT attendance_results_session_student_key UNIQUE (session_id, student_number);
+-- update_status の (class_id, date, period) 検索
+ALTER TABLE class_sessions
+    ADD CONSTRAINT class_sessions_class_date_period_key UNIQUE (class_id, date, period);
+
+-- ▼ 検索用インデックス
+-- attendanceResult / download_csv のクラス別生徒一覧
+CREATE INDEX IF NOT EXISTS idx_students_homeroom ON students (homeroom_class, attendance_no);
+-- ログイン・ユーザー追加時のメールアドレス検索
+CREATE INDEX IF NOT EXISTS idx_students_email ON students (email);
+-- 期間指定の検索
+CREATE INDEX IF NOT EXISTS idx_class_sessions_date ON class_sessions (date, period);
+-- 生徒ごとの結果 (delete_users や生徒起点の結合)
+CREATE INDEX IF NOT EXISTS idx_attendance_results_student ON attendance_results (student_number);
+-- 講師の担当クラス一覧
+CREATE INDEX IF NOT EXISTS idx_classes_teacher ON classes (teacher_id, class_name);
+-- クラス名からの検索
+CREATE INDEX IF NOT EXISTS idx_classes_name ON classes (class_name);
@@ -0,0 +1,71 @@
+-- ==========================================
+-- 0002: 生徒・クラス・月ごとの出欠集計テーブル
+-- ==========================================
+-- attendance_results への書き込み (check_attend / update_status / delete_users)
+-- のたびにトリガーで差分だけ更新する。出欠状況ページや集計APIはここを読む。
+-- 全件作り直しは python rollup.py rebuild
+
+CREATE TABLE IF NOT EXISTS attendance_monthly_rollup (
+    student_number TEXT NOT NULL,
+    class_id INT NOT NULL,          -- クラス未指定のセッションは 0
+    month DATE NOT NULL,            -- 月初日
+    status TEXT NOT NULL,
+    count INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (student_number, class_id, month, status)
+);
+
+CREATE INDEX IF NOT EXISTS idx_rollup_class_month ON attendance_monthly_rollup (class_id, month);
+
+-- ▼ 1件分の増減を反映する
+CREATE OR REPLACE FUNCTION rollup_apply(p_session_id INT, p_student TEXT, p_status TEXT, p_delta INT)
+RETURNS VOID AS $$
+DECLARE
+    v_class_id INT;
+    v_month DATE;
+BEGIN
+    SELECT COALESCE(class_id, 0), CAST(date_trunc('month', date) AS DATE)
+    INTO v_class_id, v_month
+    FROM class_sessions WHERE session_id = p_session_id;
+
+    IF NOT FOUND THEN
+        RETURN;
+    END IF;
+
+    INSERT INTO attendance_monthly_rollup AS r (student_number, class_id, month, status, count)
+    VALUES (p_student, v_class_id, v_month, p_status, p_delta)
+    ON CONFLICT (student_number, class_id, month, status)
+    DO UPDATE SET count = r.count + EXCLUDED.count;
+
+    IF p_delta < 0 THEN
+        DELETE FROM attendance_monthly_rollup
+        WHERE student_number = p_student AND class_id = v_class_id
+          AND month = v_month AND status = p_status AND count <= 0;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION attendance_rollup_trigger()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM rollup_apply(OLD.session_id, OLD.student_number, OLD.status, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM rollup_apply(NEW.session_id, NEW.student_number, NEW.status, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_attendance_rollup ON attendance_results;
+CREATE TRIGGER trg_attendance_rollup
+AFTER INSERT OR DELETE OR UPDATE OF session_id, student_number, status ON attendance_results
+FOR EACH ROW EXECUTE FUNCTION attendance_rollup_trigger();
+
+-- ▼ 既存データから初期値を作る
+INSERT INTO attendance_monthly_rollup (student_number, class_id, month, status, count)
+SELECT ar.student_number, COALESCE(cs.class_id, 0), CAST(date_trunc('month', cs.date) AS DATE), ar.status, COUNT(*)
+FROM attendance_results ar
+JOIN class_sessions cs ON cs.session_id = ar.session_id
+GROUP BY 1, 2, 3, 4
+ON CONFLICT (student_number, class_id, month, status) DO UPDATE SET count = EXCLUDED.count;
@@ -0,0 +1,27 @@
+-- ==========================================
+-- 0003: attendance_results に最終更新時刻を持たせる
+-- ==========================================
+-- 出席簿API (/api/attendance_matrix) の ETag は、範囲内の結果の件数と
+-- updated_at の最大値から作る。update_status による状態の変更も
+-- 拾えるよう、UPDATE のたびにトリガーで更新する。
+
+ALTER TABLE attendance_results ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP;
+
+UPDATE attendance_results SET updated_at = registered_at WHERE updated_at IS NULL;
+
+ALTER TABLE attendance_results
+    ALTER COLUMN updated_at SET DEFAULT clock_timestamp(),
+    ALTER COLUMN updated_at SET NOT NULL;
+
+CREATE OR REPLACE FUNCTION attendance_touch_trigger()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.updated_at := clock_timestamp();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_attendance_touch ON attendance_results;
+CREATE TRIGGER trg_attendance_touch
+BEFORE UPDATE ON attendance_results
+FOR EACH ROW EXECUTE FUNCTION attendance_touch_trigger();
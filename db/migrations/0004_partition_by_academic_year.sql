@@ -0,0 +1,191 @@
+-- ==========================================
+-- 0004: class_sessions / attendance_results を年度 (4月〜翌3月) ごとに分割する
+-- ==========================================
+-- 期間指定の検索 (出席簿・CSV出力) は、日付の範囲に入る年度のパーティションだけを読む。
+-- 終わった年度は python archive.py archive <年度> で gzip CSV に書き出して切り離す。
+--
+-- PostgreSQL 13 でも動くように:
+-- - パーティションの主キー・一意制約には分割キーを含める
+-- - attendance_results には分割キーとして session_date (= class_sessions.date) を持たせ、
+--   class_sessions とは (session_id, session_date) で結合・外部キー参照する
+
+-- ▼ 年度 (4月始まり)
+CREATE OR REPLACE FUNCTION academic_year(d DATE)
+RETURNS INT AS $$
+    SELECT CAST(EXTRACT(YEAR FROM d - INTERVAL '3 months') AS INT)
+$$ LANGUAGE sql IMMUTABLE;
+
+-- ▼ 既存のテーブルを退避 (連番のシーケンスは新しいテーブルで引き続き使う)
+DROP VIEW IF EXISTS attendance_book_view;
+ALTER SEQUENCE class_sessions_session_id_seq OWNED BY NONE;
+ALTER SEQUENCE attendance_results_result_id_seq OWNED BY NONE;
+ALTER TABLE attendance_results RENAME TO attendance_results_old;
+ALTER TABLE class_sessions RENAME TO class_sessions_old;
+
+-- ▼ 分割したテーブル
+CREATE TABLE class_sessions (
+    session_id INT NOT NULL DEFAULT nextval('class_sessions_session_id_seq'),
+    class_id INT,
+    date DATE NOT NULL,
+    period INT,
+    sound_token TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+) PARTITION BY RANGE (date);
+
+CREATE TABLE attendance_results (
+    result_id INT NOT NULL DEFAULT nextval('attendance_results_result_id_seq'),
+    session_id INT NOT NULL,
+    session_date DATE NOT NULL,
+    student_number TEXT,
+    status TEXT NOT NULL,
+    note TEXT,
+    registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP NOT NULL DEFAULT clock_timestamp()
+) PARTITION BY RANGE (session_date);
+
+ALTER SEQUENCE class_sessions_session_id_seq OWNED BY class_sessions.session_id;
+ALTER SEQUENCE attendance_results_result_id_seq OWNED BY attendance_results.result_id;
+
+-- ▼ 年度のパーティションを作る (既にあれば何もしない)
+CREATE OR REPLACE FUNCTION attendance_create_partitions(p_year INT)
+RETURNS VOID AS $$
+DECLARE
+    v_from DATE := make_date(p_year, 4, 1);
+    v_to DATE := make_date(p_year + 1, 4, 1);
+BEGIN
+    EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF class_sessions FOR VALUES FROM (%L) TO (%L)',
+                   'class_sessions_y' || p_year, v_from, v_to);
+    EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF attendance_results FOR VALUES FROM (%L) TO (%L)',
+                   'attendance_results_y' || p_year, v_from, v_to);
+END;
+$$ LANGUAGE plpgsql;
+
+-- 既存データの年度から来年度まで
+DO $$
+DECLARE
+    v_year INT;
+BEGIN
+    FOR v_year IN
+        SELECT generate_series(
+            LEAST(COALESCE((SELECT MIN(academic_year(date)) FROM class_sessions_old), academic_year(CURRENT_DATE)),
+                  academic_year(CURRENT_DATE)),
+            academic_year(CURRENT_DATE) + 1)
+    LOOP
+        PERFORM attendance_create_partitions(v_year);
+    END LOOP;
+END;
+$$;
+
+-- ▼ データの移し替え (トリガーを作る前なので集計テーブルはそのまま)
+INSERT INTO class_sessions (session_id, class_id, date, period, sound_token, created_at)
+SELECT session_id, class_id, date, period, sound_token, created_at FROM class_sessions_old;
+
+INSERT INTO attendance_results (result_id, session_id, session_date, student_number, status, note, registered_at, updated_at)
+SELECT ar.result_id, ar.session_id, cs.date, ar.student_number, ar.status, ar.note, ar.registered_at, ar.updated_at
+FROM attendance_results_old ar
+JOIN class_sessions_old cs ON cs.session_id = ar.session_id;
+
+DO $$
+DECLARE
+    v_orphans BIGINT;
+BEGIN
+    -- セッションのない結果は画面・CSVのどこにも出ないので移さない
+    SELECT COUNT(*) INTO v_orphans
+    FROM attendance_results_old ar
+    WHERE NOT EXISTS (SELECT 1 FROM class_sessions_old cs WHERE cs.session_id = ar.session_id);
+    IF v_orphans > 0 THEN
+        RAISE NOTICE 'attendance_results: % rows without a session were not migrated', v_orphans;
+    END IF;
+END;
+$$;
+
+DROP TABLE attendance_results_old;
+DROP TABLE class_sessions_old;
+
+-- ▼ 制約 (0001 と同じ名前。一意制約には分割キーを含める)
+ALTER TABLE class_sessions
+    ADD CONSTRAINT class_sessions_pkey PRIMARY KEY (session_id, date),
+    ADD CONSTRAINT class_sessions_class_date_period_key UNIQUE (class_id, date, period),
+    ADD CONSTRAINT class_sessions_class_id_fkey FOREIGN KEY (class_id) REFERENCES classes (class_id);
+
+ALTER TABLE attendance_results
+    ADD CONSTRAINT attendance_results_pkey PRIMARY KEY (result_id, session_date),
+    ADD CONSTRAINT attendance_results_session_student_key UNIQUE (session_id, student_number, session_date),
+    ADD CONSTRAINT attendance_results_session_fkey FOREIGN KEY (session_id, session_date)
+        REFERENCES class_sessions (session_id, date),
+    ADD CONSTRAINT attendance_results_student_number_fkey FOREIGN KEY (student_number)
+        REFERENCES students (student_number);
+
+-- ▼ 検索用インデックス (各パーティションに作られる)
+CREATE INDEX IF NOT EXISTS idx_class_sessions_date ON class_sessions (date, period);
+-- 生徒ごとの結果 (出席簿は生徒 × 期間で引く)
+CREATE INDEX IF NOT EXISTS idx_attendance_results_student ON attendance_results (student_number, session_date);
+
+-- ▼ トリガー (0002, 0003)。集計は結果の session_date で対象のパーティションだけを引く
+DROP FUNCTION IF EXISTS rollup_apply(INT, TEXT, TEXT, INT);
+
+CREATE OR REPLACE FUNCTION rollup_apply(p_session_id INT, p_date DATE, p_student TEXT, p_status TEXT, p_delta INT)
+RETURNS VOID AS $$
+DECLARE
+    v_class_id INT;
+    v_month DATE;
+BEGIN
+    SELECT COALESCE(class_id, 0), CAST(date_trunc('month', date) AS DATE)
+    INTO v_class_id, v_month
+    FROM class_sessions WHERE session_id = p_session_id AND date = p_date;
+
+    IF NOT FOUND THEN
+        RETURN;
+    END IF;
+
+    INSERT INTO attendance_monthly_rollup AS r (student_number, class_id, month, status, count)
+    VALUES (p_student, v_class_id, v_month, p_status, p_delta)
+    ON CONFLICT (student_number, class_id, month, status)
+    DO UPDATE SET count = r.count + EXCLUDED.count;
+
+    IF p_delta < 0 THEN
+        DELETE FROM attendance_monthly_rollup
+        WHERE student_number = p_student AND class_id = v_class_id
+          AND month = v_month AND status = p_status AND count <= 0;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION attendance_rollup_trigger()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM rollup_apply(OLD.session_id, OLD.session_date, OLD.student_number, OLD.status, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM rollup_apply(NEW.session_id, NEW.session_date, NEW.student_number, NEW.status, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_attendance_rollup
+AFTER INSERT OR DELETE OR UPDATE OF session_id, student_number, status ON attendance_results
+FOR EACH ROW EXECUTE FUNCTION attendance_rollup_trigger();
+
+CREATE TRIGGER trg_attendance_touch
+BEFORE UPDATE ON attendance_results
+FOR EACH ROW EXECUTE FUNCTION attendance_touch_trigger();
+
+-- ▼ ビュー (init.sql と同じ内容)
+CREATE VIEW attendance_book_view AS
+SELECT
+    ar.result_id,
+    ar.registered_at,
+    ar.status,
+    s.student_number,
+    s.name AS student_name,
+    s.homeroom_class AS student_homeroom,
+    t.name AS teacher_name,
+    c.class_name AS target_class,
+    cs.date AS session_date
+FROM attendance_results ar
+JOIN students s ON ar.student_number = s.student_number
+JOIN class_sessions cs ON ar.session_id = cs.session_id AND ar.session_date = cs.date
+JOIN classes c ON cs.class_id = c.class_id
+JOIN teachers t ON c.teacher_id = t.teacher_id;
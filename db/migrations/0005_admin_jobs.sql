@@ -0,0 +1,23 @@
+-- ==========================================
+-- 0005: 時間のかかる管理操作 (一括削除・CSV取り込み・CSV出力) の進み具合
+-- ==========================================
+-- 処理は受け付けたワーカーのバックグラウンドで動く (jobs.py)。
+-- 進み具合はここに書くので、どのワーカーに問い合わせても同じ結果が返る。
+
+CREATE TABLE IF NOT EXISTS admin_jobs (
+    job_id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    owner TEXT,
+    status TEXT NOT NULL DEFAULT 'queued',   -- queued / running / done / error
+    done BIGINT NOT NULL DEFAULT 0,
+    total BIGINT,
+    message TEXT,
+    result JSONB,
+    file_path TEXT,                           -- CSV出力の書き出し先
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+-- 古いジョブの掃除用
+CREATE INDEX IF NOT EXISTS idx_admin_jobs_created ON admin_jobs (created_at);
@@ -0,0 +1,24 @@
+-- ==========================================
+-- 0006: ユーザー管理の生徒一覧 (/api/students/search) 用
+-- ==========================================
+-- 入学年は学籍番号 (s20250001 / 20250001) の先頭4桁。毎回 Python で切り出さず、
+-- 生成列として保存しておき、絞り込みと並び順にインデックスを使う。
+
+ALTER TABLE students ADD COLUMN IF NOT EXISTS admission_year INT GENERATED ALWAYS AS (
+    CASE
+        WHEN student_number ~ '^s[0-9]{4}' THEN CAST(substr(student_number, 2, 4) AS INT)
+        WHEN student_number ~ '^[0-9]{4}' THEN CAST(substr(student_number, 1, 4) AS INT)
+    END
+) STORED;
+
+-- 一覧の並び順 (クラス, 出席番号, 学籍番号)。クラス・出席番号が空の生徒もキーセットで辿れるよう COALESCE する
+CREATE INDEX IF NOT EXISTS idx_students_directory
+    ON students ((COALESCE(homeroom_class, '')), (COALESCE(attendance_no, 0)), student_number);
+
+-- 入学年で絞り込んだ一覧
+CREATE INDEX IF NOT EXISTS idx_students_admission_directory
+    ON students (admission_year, (COALESCE(homeroom_class, '')), (COALESCE(attendance_no, 0)), student_number);
+
+-- 学籍番号・氏名の前方一致検索 (LIKE 'xxx%')
+CREATE INDEX IF NOT EXISTS idx_students_number_prefix ON students (student_number text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_students_name_prefix ON students (name text_pattern_ops);
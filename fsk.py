@@ -0,0 +1,223 @@
+"""音響OTP (FSK) の合成・復号
+
+teacher.js が鳴らす信号と同じ波形を作り、録音した音声から符号を読み取る。
+ブラウザ側の実装を変える前に、ビット長・雑音・符号長を変えたときに
+正しく読めるかを bench/fsk_benchmark.py で確認するためのもの。
+
+信号の形式 (teacher.js / student.js と同じ):
+    開始音 (FREQ_MARKER) のあと、1ビットずつ bit_duration 秒ごとに
+    0 なら FREQ_BIT_0、1 なら FREQ_BIT_1 を tone_length 秒鳴らす。上位ビットから順。
+"""
+import io
+import wave
+from dataclasses import dataclass, replace
+from typing import Optional, Sequence
+
+import numpy as np
+
+from session_registry import OTP_BITS
+
+FREQ_MARKER = 17000.0
+FREQ_BIT_0 = 18000.0
+FREQ_BIT_1 = 19000.0
+SAMPLE_RATE = 48000
+
+# 端末ごとの周波数のずれ。開始音をこの範囲で探し、同じだけビットの周波数もずらす
+# (student.js の START_RANGE と同じ考え方)
+MAX_FREQ_OFFSET = 400.0
+FREQ_OFFSET_STEP = 25.0
+# ビットの判定で電力を計算する区間の長さ (秒)
+SUBFRAME = 0.02
+
+
+@dataclass(frozen=True)
+class FskParams:
+    bits: int = OTP_BITS
+    bit_duration: float = 0.5       # 1ビットの間隔 (秒)
+    tone_length: float = 0.4        # 1つの音を鳴らす長さ (秒)
+    loop_gap: float = 2.0           # 1周ごとの無音 (秒)
+    sample_rate: int = SAMPLE_RATE
+    volume_db: float = -5.0         # teacher.js の synth.volume
+
+    @property
+    def cycle_seconds(self) -> float:
+        # teacher.js の Tone.Loop の周期
+        return (1 + self.bits) * self.bit_duration + self.loop_gap
+
+    def scaled(self, bit_duration: float) -> "FskParams":
+        # 音の長さとビット間隔の比率を保ったまま間隔だけ変える
+        return replace(self, bit_duration=bit_duration,
+                       tone_length=bit_duration * self.tone_length / self.bit_duration)
+
+
+DEFAULT_PARAMS = FskParams()
+
+
+def code_to_bits(code: int, bits: int) -> str:
+    return format(code, f"0{bits}b")
+
+
+# ==========================================
+# 合成
+# ==========================================
+
+def _envelope(n: int, sr: int, attack=0.05, decay=0.1, sustain=0.8, release=0.05) -> np.ndarray:
+    # teacher.js の Tone.Synth と同じADSR (release はtone_lengthの後ろに続く)
+    t = np.arange(n) / sr
+    env = np.where(t < attack, t / attack,
+                   np.where(t < attack + decay, 1 - (1 - sustain) * (t - attack) / decay, sustain))
+    tail = np.arange(int(release * sr)) / sr
+    return np.concatenate([env, sustain * (1 - tail / release)])
+
+
+def synthesize(code: int, params: FskParams = DEFAULT_PARAMS, lead_in: float = 0.3,
+               freq_offset: float = 0.0, cycles: int = 1) -> np.ndarray:
+    """code の信号を float32 の波形 (-1〜1) で返す。前に lead_in 秒の無音を入れる"""
+    sr = params.sample_rate
+    bits = code_to_bits(code, params.bits)
+    total = lead_in + params.cycle_seconds * cycles
+    out = np.zeros(int(total * sr) + sr, dtype=np.float64)
+    amp = 10 ** (params.volume_db / 20)
+    env = _envelope(int(params.tone_length * sr), sr)
+    t = np.arange(len(env)) / sr
+
+    freqs = [FREQ_MARKER] + [FREQ_BIT_1 if b == "1" else FREQ_BIT_0 for b in bits]
+    for c in range(cycles):
+        cycle_start = lead_in + c * params.cycle_seconds
+        for i, f in enumerate(freqs):
+            s = int((cycle_start + i * params.bit_duration) * sr)
+            out[s:s + len(env)] += amp * env * np.sin(2 * np.pi * (f + freq_offset) * t)
+    return out[:int(total * sr)].astype(np.float32)
+
+
+def add_noise(signal: np.ndarray, snr_db: float, rng: Optional[np.random.Generator] = None) -> np.ndarray:
+    """白色雑音を加える。SNRは音が鳴っている部分の電力に対する比"""
+    rng = rng or np.random.default_rng()
+    active = signal[np.abs(signal) > 1e-4]
+    power = float(np.mean(active ** 2)) if active.size else 1e-6
+    noise = rng.normal(0.0, np.sqrt(power / 10 ** (snr_db / 10)), size=signal.shape)
+    return (signal + noise).astype(np.float32)
+
+
+# ==========================================
+# 復号
+# ==========================================
+
+def tone_power(frames: np.ndarray, freqs: Sequence[float], sr: int) -> np.ndarray:
+    """各フレームの、指定した周波数だけの電力 (Goertzel と同じ値を行列積でまとめて計算)。
+
+    frames: (フレーム数, 長さ)、戻り値: (フレーム数, 周波数の数)
+    """
+    n = frames.shape[-1]
+    window = np.hanning(n)
+    basis = np.exp(-2j * np.pi * np.outer(np.arange(n), np.asarray(freqs, dtype=np.float64)) / sr)
+    spec = (frames * window) @ basis
+    return (spec.real ** 2 + spec.imag ** 2) / n
+
+
+@dataclass
+class DecodeResult:
+    code: Optional[int]
+    bits: str
+    onset: float = 0.0              # 開始音の位置 (秒)
+    freq_offset: float = 0.0
+    confidence: float = 0.0         # 最も自信のないビットの 0/1 の電力比 (dB)
+
+
+def decode(samples: np.ndarray, params: FskParams = DEFAULT_PARAMS, sr: Optional[int] = None,
+           hop: float = 0.005, min_confidence_db: float = 3.0) -> DecodeResult:
+    """録音から最初の1周分の符号を読み取る。読み取れなければ code = None"""
+    sr = sr or params.sample_rate
+    x = np.asarray(samples, dtype=np.float64)
+    if x.ndim > 1:
+        x = x.mean(axis=1)
+
+    # 1. 開始音を探す: 短いフレームごとに開始音の候補周波数の電力を計算
+    win = max(32, int(sr * min(0.05, params.tone_length / 2)))
+    step = max(1, int(sr * hop))
+    if len(x) < win:
+        return DecodeResult(None, "")
+    frames = np.lib.stride_tricks.sliding_window_view(x, win)[::step]
+    offsets = np.arange(-MAX_FREQ_OFFSET, MAX_FREQ_OFFSET + 1, FREQ_OFFSET_STEP)
+    marker = tone_power(frames, FREQ_MARKER + offsets, sr)           # (F, 候補数)
+    bits_band = tone_power(frames, [FREQ_BIT_0, FREQ_BIT_1], sr).max(axis=1)
+
+    best = marker.max(axis=1)
+    floor = np.median(best) + 1e-12
+    # 開始音らしいフレーム: 雑音より十分大きく (最も強い開始音の 1/4 以上)、ビットの周波数より強い
+    threshold = max(floor * 8, best.max() / 4)
+    candidates = np.flatnonzero((best > threshold) & (best > bits_band * 2))
+    seq_len = (1 + params.bits) * params.bit_duration
+    while candidates.size:
+        first = candidates[0]
+        peak = first + int(np.argmax(best[first:first + max(1, int(params.tone_length / hop))]))
+        # ピークの半分以上になった最初のフレーム (音がフレームの半分を占める) の中心を開始位置とする
+        rising = np.flatnonzero(best[first:peak + 1] >= best[peak] / 2)
+        onset_frame = first + (rising[0] if rising.size else 0)
+        onset = float(onset_frame * step + win / 2) / sr
+        if onset + seq_len > len(x) / sr:
+            break
+        offset = float(offsets[int(np.argmax(marker[peak]))])
+        result = _read_bits(x, sr, params, onset, offset)
+        if result.confidence >= min_confidence_db:
+            return result
+        # 雑音を開始音と見誤った場合は次の候補から探し直す
+        candidates = candidates[candidates > peak]
+    return DecodeResult(None, "")
+
+
+def _read_bits(x: np.ndarray, sr: int, params: FskParams, onset: float, offset: float) -> DecodeResult:
+    # 各ビットの音の中央 (前後1割を除く) をまとめて取り出し、0/1 の周波数の電力を比べる。
+    # 長い区間を1回で変換すると周波数の分解能が細かくなりすぎ、開始音から推定した
+    # ずれの誤差 (数十Hz) で外れるので、SUBFRAME 秒ごとに分けて電力を足し合わせる
+    sub = max(32, int(sr * SUBFRAME))
+    seg_start = onset + params.tone_length * 0.1
+    n_sub = max(1, int(sr * params.tone_length * 0.8) // sub)
+    starts = (np.round((seg_start + params.bit_duration * np.arange(1, params.bits + 1)) * sr)).astype(int)
+    idx = starts[:, None] + np.arange(n_sub * sub)[None, :]
+    segs = x[np.clip(idx, 0, len(x) - 1)].reshape(params.bits * n_sub, sub)
+    power = tone_power(segs, [FREQ_BIT_0 + offset, FREQ_BIT_1 + offset], sr)
+    power = power.reshape(params.bits, n_sub, 2).sum(axis=1) + 1e-20
+    ratio_db = 10 * np.log10(power[:, 1] / power[:, 0])
+    bits = "".join("1" if r > 0 else "0" for r in ratio_db)
+    return DecodeResult(int(bits, 2), bits, onset, offset, float(np.min(np.abs(ratio_db))))
+
+
+# ==========================================
+# WAV の読み書き
+# ==========================================
+
+def read_wav(source) -> tuple:
+    """WAV (パス / bytes / ファイルオブジェクト) を (float32 の波形, サンプリング周波数) で返す"""
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    with wave.open(source, "rb") as w:
+        sr = w.getframerate()
+        width = w.getsampwidth()
+        channels = w.getnchannels()
+        raw = w.readframes(w.getnframes())
+    if width == 2:
+        data = np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768
+    elif width == 4:
+        data = np.frombuffer(raw, dtype="<i4").astype(np.float32) / 2147483648
+    elif width == 1:
+        data = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128) / 128
+    else:
+        raise ValueError(f"未対応のサンプル幅です: {width * 8}bit")
+    if channels > 1:
+        data = data.reshape(-1, channels).mean(axis=1)
+    return data, sr
+
+
+def write_wav(path, samples: np.ndarray, sr: int = SAMPLE_RATE):
+    pcm = (np.clip(samples, -1, 1) * 32767).astype("<i2")
+    with wave.open(path, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sr)
+        w.writeframes(pcm.tobytes())
+
+
+def decode_wav(source, params: FskParams = DEFAULT_PARAMS) -> DecodeResult:
+    samples, sr = read_wav(source)
+    return decode(samples, params, sr=sr)
@@ -0,0 +1,433 @@
+"""時間のかかる管理操作をバックグラウンドで行う
+
+卒業生の一括削除・CSV取り込み・長い期間のCSV出力は、1回のリクエストの中で
+行うと attendance_results を長くロックしたり、応答が返る前にタイムアウトしたりする。
+ここでは受け付けたらすぐジョブIDを返し、処理は JOB_WORKERS 本のワーカーで
+JOB_CHUNK_ROWS 件ずつコミットしながら進める。
+
+進み具合は admin_jobs (db/migrations/0005) に書くので、複数ワーカーで
+動かしていても GET /api/jobs/{job_id} はどのワーカーからでも同じ結果を返す。
+"""
+import os
+import json
+import time
+import uuid
+import asyncio
+import datetime
+import tempfile
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from sqlalchemy import text
+
+from csv_export import stream_attendance_csv, count_export_rows
+from user_import import import_students, ImportReport, CsvImportError
+
+# 同時に動かすジョブの数
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "1"))
+# 順番待ちできるジョブの数。溢れたら受け付けない
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "20"))
+# 1回のトランザクションで削除・登録する行数
+JOB_CHUNK_ROWS = int(os.getenv("JOB_CHUNK_ROWS", "1000"))
+# 終わったジョブ (と出力ファイル) を残しておく秒数
+JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL", "3600"))
+# CSV出力・取り込みファイルの置き場所 (複数ワーカーで共有できる場所)
+JOB_DIR = os.getenv("JOB_DIR") or os.path.join(tempfile.gettempdir(), "cocone_jobs")
+
+# 進み具合を admin_jobs に書く間隔 (秒)
+JOB_SYNC_INTERVAL = 1.0
+# この秒数 updated_at が進んでいない実行中のジョブは、ワーカーが止まったものとみなす
+JOB_STALE_SECONDS = 60
+# 古いジョブを掃除する間隔 (秒)
+JOB_SWEEP_INTERVAL = 600
+# 取り込み用に保存したアップロードの拡張子 (job_file(job_id, UPLOAD_SUFFIX))
+UPLOAD_SUFFIX = ".upload"
+
+INSERT_JOB_SQL = text("""
+    INSERT INTO admin_jobs (job_id, kind, owner, total, message)
+    VALUES (:id, :kind, :owner, :total, :message)
+""")
+
+SYNC_JOBS_SQL = text("""
+    UPDATE admin_jobs j
+    SET done = u.done, total = u.total, message = u.message, updated_at = CURRENT_TIMESTAMP
+    FROM unnest(CAST(:ids AS TEXT[]), CAST(:dones AS BIGINT[]), CAST(:totals AS BIGINT[]), CAST(:messages AS TEXT[]))
+        AS u(job_id, done, total, message)
+    WHERE j.job_id = u.job_id
+""").execution_options(metrics_name="job_sync")
+
+FINISH_JOB_SQL = text("""
+    UPDATE admin_jobs
+    SET status = :status, done = :done, total = :total, message = :message,
+        result = CAST(:result AS JSONB), file_path = :file_path,
+        updated_at = CURRENT_TIMESTAMP, finished_at = CURRENT_TIMESTAMP
+    WHERE job_id = :id
+""")
+
+GET_JOB_SQL = text("""
+    SELECT job_id, kind, owner, status, done, total, message, result, file_path, created_at, finished_at,
+           (status IN ('queued', 'running')
+            AND updated_at < CURRENT_TIMESTAMP - make_interval(secs => :stale)) AS stale
+    FROM admin_jobs WHERE job_id = :id
+""").execution_options(metrics_name="job_status")
+
+SWEEP_JOBS_SQL = text("""
+    DELETE FROM admin_jobs
+    WHERE created_at < CURRENT_TIMESTAMP - make_interval(secs => :ttl)
+    RETURNING job_id, file_path
+""")
+
+
+class JobQueueFull(Exception):
+    """順番待ちのジョブが JOB_QUEUE_SIZE を超えた"""
+
+
+@dataclass
+class Job:
+    job_id: str
+    kind: str
+    owner: Optional[str] = None
+    status: str = "queued"
+    done: int = 0
+    total: Optional[int] = None
+    message: str = ""
+    result: Optional[dict] = None
+    file_path: Optional[str] = None
+    created_at: datetime.datetime = field(default_factory=datetime.datetime.now)
+    finished_at: Optional[datetime.datetime] = None
+
+    def progress(self, advance: int = 0, done: Optional[int] = None,
+                 total: Optional[int] = None, message: Optional[str] = None):
+        """進み具合を更新する (DBへは JOB_SYNC_INTERVAL ごとにまとめて書く)"""
+        self.done = self.done + advance if done is None else done
+        if total is not None:
+            self.total = total
+        if message is not None:
+            self.message = message
+
+    def to_dict(self) -> dict:
+        percent = None
+        if self.total:
+            percent = min(100, int(self.done * 100 / self.total))
+        elif self.status == "done":
+            percent = 100
+        return {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "status": self.status,
+            "done": self.done,
+            "total": self.total,
+            "percent": percent,
+            "message": self.message,
+            "result": self.result,
+            "download": self.file_path is not None and self.status == "done",
+            "created_at": self.created_at.isoformat(timespec="seconds"),
+            "finished_at": self.finished_at.isoformat(timespec="seconds") if self.finished_at else None,
+        }
+
+
+JobFn = Callable[..., Awaitable[Optional[dict]]]
+
+
+class JobRunner:
+    """ジョブの受け付けと実行 (ワーカー数・順番待ちの数に上限あり)"""
+
+    def __init__(self, engine, workers: int = JOB_WORKERS, queue_size: int = JOB_QUEUE_SIZE):
+        self.engine = engine
+        self.workers = workers
+        self.queue_size = queue_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        # このワーカーで順番待ち・実行中のジョブ
+        self._active: Dict[str, Job] = {}
+        # 統計
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    async def start(self):
+        if self._tasks:
+            return
+        os.makedirs(JOB_DIR, exist_ok=True)
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._sync_loop()))
+        self._tasks.append(asyncio.create_task(self._sweep_loop()))
+
+    async def stop(self):
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # 途中で止めたジョブは中断として残す (次の起動では再開しない)
+        for job in list(self._active.values()):
+            job.status = "error"
+            job.message = "サーバーの停止により中断しました"
+            await self._finish(job)
+
+    async def submit(self, kind: str, fn: JobFn, *args, owner: Optional[str] = None,
+                     total: Optional[int] = None, message: str = "順番待ち", job_id: Optional[str] = None) -> Job:
+        """fn(job, *args) を順番待ちに入れる。fn の戻り値 (dict) がジョブの結果になる"""
+        if self._queue is None:
+            raise RuntimeError("JobRunner is not started")
+        if self._queue.full():
+            self.rejected += 1
+            raise JobQueueFull(f"処理待ちのジョブが多すぎます ({self.queue_size}件)。しばらくしてから実行してください")
+        job = Job(job_id or new_job_id(), kind, owner, total=total, message=message)
+        async with self.engine.begin() as conn:
+            await conn.execute(INSERT_JOB_SQL, {"id": job.job_id, "kind": kind, "owner": owner,
+                                                "total": total, "message": message})
+        self._active[job.job_id] = job
+        self._queue.put_nowait((job, fn, args))
+        self.submitted += 1
+        return job
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        job = self._active.get(job_id)
+        if job is not None:
+            return job
+        async with self.engine.connect() as conn:
+            r = (await conn.execute(GET_JOB_SQL, {"id": job_id, "stale": JOB_STALE_SECONDS})).fetchone()
+        if r is None:
+            return None
+        job = Job(r.job_id, r.kind, r.owner, status=r.status, done=r.done, total=r.total,
+                  message=r.message or "", result=r.result, file_path=r.file_path,
+                  created_at=r.created_at, finished_at=r.finished_at)
+        if r.stale:
+            # 実行していたワーカーが落ちた
+            job.status = "error"
+            job.message = "処理が中断されました (サーバーの再起動など)。もう一度実行してください"
+        return job
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "active": len(self._active),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+
+    async def _worker(self):
+        while True:
+            job, fn, args = await self._queue.get()
+            job.status = "running"
+            job.message = "処理中"
+            started = time.perf_counter()
+            try:
+                async with self.engine.begin() as conn:
+                    await conn.execute(text("UPDATE admin_jobs SET status = 'running', updated_at = CURRENT_TIMESTAMP "
+                                            "WHERE job_id = :id"), {"id": job.job_id})
+                job.result = await fn(job, *args) or {}
+                job.status = "done"
+                if job.total is not None:
+                    job.done = job.total
+                self.completed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Job Error ({job.kind} {job.job_id}): {e}")
+                job.status = "error"
+                job.message = str(e)
+                self.failed += 1
+            finally:
+                if job.status != "running":
+                    print(f"✅ Job {job.kind} {job.job_id}: {job.status} in {time.perf_counter() - started:.1f}s")
+                    await self._finish(job)
+                self._queue.task_done()
+
+    async def _finish(self, job: Job):
+        job.finished_at = datetime.datetime.now()
+        try:
+            async with self.engine.begin() as conn:
+                await conn.execute(FINISH_JOB_SQL, {
+                    "id": job.job_id, "status": job.status, "done": job.done, "total": job.total,
+                    "message": job.message, "result": json.dumps(job.result, ensure_ascii=False) if job.result is not None else None,
+                    "file_path": job.file_path,
+                })
+        except Exception as e:
+            print(f"Job Finish Error ({job.job_id}): {e}")
+        finally:
+            self._active.pop(job.job_id, None)
+            # 始まる前に止めた・失敗したジョブのアップロードは、ジョブの中で消されずに残っている
+            remove_file(job_file(job.job_id, UPLOAD_SUFFIX))
+
+    async def _sync_loop(self):
+        # 実行中・順番待ちのジョブの進み具合をまとめて書く (updated_at が生きている印になる)
+        while True:
+            await asyncio.sleep(JOB_SYNC_INTERVAL)
+            jobs = list(self._active.values())
+            if not jobs:
+                continue
+            try:
+                async with self.engine.begin() as conn:
+                    await conn.execute(SYNC_JOBS_SQL, {
+                        "ids": [j.job_id for j in jobs],
+                        "dones": [j.done for j in jobs],
+                        "totals": [j.total for j in jobs],
+                        "messages": [j.message for j in jobs],
+                    })
+            except Exception as e:
+                print(f"Job Sync Error: {e}")
+
+    async def _sweep_loop(self):
+        while True:
+            try:
+                async with self.engine.begin() as conn:
+                    rows = (await conn.execute(SWEEP_JOBS_SQL, {"ttl": JOB_RESULT_TTL})).fetchall()
+                for r in rows:
+                    # 実行中にワーカーが落ちたジョブはアップロードが残っている
+                    for p in (r.file_path, job_file(r.job_id, UPLOAD_SUFFIX)):
+                        if p:
+                            remove_file(p)
+            except Exception as e:
+                print(f"Job Sweep Error: {e}")
+            await asyncio.sleep(JOB_SWEEP_INTERVAL)
+
+
+def new_job_id() -> str:
+    return uuid.uuid4().hex
+
+
+def job_file(job_id: str, suffix: str) -> str:
+    return os.path.join(JOB_DIR, f"{job_id}{suffix}")
+
+
+def remove_file(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+# ==========================================
+# ジョブの中身
+# ==========================================
+
+COUNT_RESULTS_SQL = text("SELECT COUNT(*) FROM attendance_results WHERE student_number = ANY(:ids)")
+
+# 対象の生徒の出欠を n 件ずつ削除する (1回のロックを短くするため)
+DELETE_RESULTS_CHUNK_SQL = text("""
+    DELETE FROM attendance_results ar
+    USING (
+        SELECT result_id, session_date FROM attendance_results
+        WHERE student_number = ANY(:ids)
+        LIMIT :n
+    ) AS d
+    WHERE ar.result_id = d.result_id AND ar.session_date = d.session_date
+""").execution_options(metrics_name="job_delete_results_chunk")
+
+
+async def delete_students(job: Job, engine, student_numbers: List[str], chunk_rows: int = JOB_CHUNK_ROWS) -> dict:
+    """生徒とその出欠を削除する。出欠は chunk_rows 件ずつ別のトランザクションで消す"""
+    ids = list(dict.fromkeys(student_numbers))
+    async with engine.connect() as conn:
+        n_results = (await conn.execute(COUNT_RESULTS_SQL, {"ids": ids})).scalar()
+    job.progress(done=0, total=n_results + len(ids), message="出欠記録を削除しています")
+
+    deleted_results = 0
+    while True:
+        async with engine.begin() as conn:
+            n = (await conn.execute(DELETE_RESULTS_CHUNK_SQL, {"ids": ids, "n": chunk_rows})).rowcount
+        deleted_results += n
+        job.progress(advance=n)
+        if n < chunk_rows:
+            break
+
+    job.progress(message="生徒を削除しています")
+    deleted_students = 0
+    for i in range(0, len(ids), chunk_rows):
+        part = ids[i:i + chunk_rows]
+        async with engine.begin() as conn:
+            # 削除中に登録された出欠があれば一緒に消す
+            deleted_results += (await conn.execute(
+                text("DELETE FROM attendance_results WHERE student_number = ANY(:ids)"), {"ids": part}
+            )).rowcount
+            deleted_students += (await conn.execute(
+                text("DELETE FROM students WHERE student_number = ANY(:ids)"), {"ids": part}
+            )).rowcount
+        job.progress(advance=len(part))
+
+    job.progress(message=f"{deleted_students}人を削除しました (出欠記録 {deleted_results}件)")
+    return {"deleted_students": deleted_students, "deleted_results": deleted_results}
+
+
+class _FileReader:
+    """取り込み用に保存したファイルを UploadFile と同じ read() で読む (読んだバイト数を進み具合にする)"""
+
+    def __init__(self, f, job: Job):
+        self._f = f
+        self._job = job
+
+    async def read(self, size: int = -1) -> bytes:
+        # ファイルの読み込みでイベントループを止めない
+        chunk = await asyncio.to_thread(self._f.read, size)
+        self._job.progress(advance=len(chunk))
+        return chunk
+
+
+async def import_students_file(job: Job, engine, path: str) -> dict:
+    """保存したCSVから生徒を登録する。IMPORT_BATCH_ROWS 件ごとにコミットする。
+
+    途中で失敗した場合 (ファイルの途中で文字コードが変わっているなど)、それまでにコミットした
+    分は登録されたまま残る。どの生徒が登録されたか分かるよう、そこまでの結果を job.result に入れてから失敗させる。
+    """
+    report = ImportReport()
+    committed = 0  # コミット済みの登録件数 (report.inserted の先頭から)
+    try:
+        job.progress(done=0, total=os.path.getsize(path), message="取り込み中")
+        async with engine.connect() as conn:
+            async def commit_batch(report):
+                nonlocal committed
+                await conn.commit()
+                committed = len(report.inserted)
+                job.progress(message=f"{committed}件追加しました")
+
+            with open(path, "rb") as f:
+                await import_students(conn, _FileReader(f, job), on_batch=commit_batch, report=report)
+            await conn.commit()
+    except Exception as e:
+        if not committed:
+            raise
+        # コミットされなかった最後の分は登録されていない
+        del report.inserted[committed:]
+        message = f"{committed}件を登録したところで中断しました (残りは登録されていません): {e}"
+        job.result = {"message": message, "report": report.to_dict(), "partial": True}
+        raise CsvImportError(message) from e
+    finally:
+        os.remove(path)
+
+    if not report.inserted and not report.skipped and not report.invalid:
+        raise CsvImportError("ファイルの中身が空です")
+    message = f"{len(report.inserted)}件のユーザーを追加しました"
+    if report.skipped or report.invalid:
+        message += f" (登録済み {len(report.skipped)}件 / 不正な行 {len(report.invalid)}件)"
+    job.progress(message=message)
+    return {"message": message, "report": report.to_dict()}
+
+
+async def export_attendance_csv(job: Job, engine, class_name: str, start_date: str, end_date: str) -> dict:
+    """出席簿のCSVを JOB_DIR に書き出す (GET /api/jobs/{job_id}/download で受け取る)"""
+    async with engine.connect() as conn:
+        total = await count_export_rows(conn, class_name, start_date, end_date)
+    job.progress(done=0, total=total, message="CSVを作成しています")
+
+    path = job_file(job.job_id, ".csv")
+    part = path + ".part"
+    try:
+        with open(part, "wb") as f:
+            async for chunk in stream_attendance_csv(engine, class_name, start_date, end_date,
+                                                     on_rows=lambda n: job.progress(advance=n), raise_errors=True):
+                f.write(chunk)
+        os.replace(part, path)
+    finally:
+        if os.path.exists(part):
+            os.remove(part)
+
+    job.file_path = path
+    job.progress(message=f"{job.done}行を書き出しました")
+    return {"rows": job.done, "filename": f"attendance_{class_name}_{start_date}.csv"}
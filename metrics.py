@@ -0,0 +1,304 @@
+"""アプリ内のメトリクス (Prometheus のテキスト形式で /metrics から出力)
+
+- http_request_duration_seconds: ルートごとの応答時間 (MetricsMiddleware)
+- db_statement_duration_seconds: SQLごとの実行時間 (instrument_engine)
+- db_pool_checkout_wait_seconds: コネクションプールから接続を借りるまでの待ち時間 (InstrumentedPool)
+- db_statement_prepares_total: SQLごとのサーバー側プリペアの回数 (接続ごとのキャッシュに無かった回数)
+
+どれも1回あたり数マイクロ秒の処理なので、本番でも有効のままにしておける。
+"""
+import re
+import time
+import uuid
+import bisect
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+# 応答時間・SQL実行時間の区切り (秒)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _num(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_num(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # ラベル -> [区切りごとの件数..., 合計, 件数]
+        self._values: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        v = self._values.get(labels)
+        if v is None:
+            v = self._values[labels] = [0] * len(self.buckets) + [0.0, 0]
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            v[i] += 1
+        v[-2] += value
+        v[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, v in sorted(self._values.items()):
+            cumulative = 0
+            for le, n in zip(self.buckets, v):
+                cumulative += n
+                bucket_labels = _labels(self.labelnames, labels, 'le="%s"' % le)
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            inf_labels = _labels(self.labelnames, labels, 'le="+Inf"')
+            plain = _labels(self.labelnames, labels)
+            lines.append(f"{self.name}_bucket{inf_labels} {v[-1]}")
+            lines.append(f"{self.name}_sum{plain} {_num(v[-2])}")
+            lines.append(f"{self.name}_count{plain} {v[-1]}")
+        return lines
+
+
+class GaugeCallback:
+    """出力するときに fn() を呼んで値を読む (他のモジュールが持っている統計用)"""
+
+    def __init__(self, name: str, help: str, fn: Callable[[], float], kind: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.kind = kind
+
+    def render(self) -> List[str]:
+        try:
+            value = self.fn()
+        except Exception as e:
+            print(f"Metrics Error ({self.name}): {e}")
+            return []
+        if value is None:
+            return []
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", f"{self.name} {_num(value)}"]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()) -> Counter:
+        return self.register(Counter(name, help, tuple(labelnames)))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, tuple(labelnames), buckets))
+
+    def gauge_callback(self, name, help, fn, kind="gauge") -> GaugeCallback:
+        return self.register(GaugeCallback(name, help, fn, kind))
+
+    def render(self) -> str:
+        lines = []
+        for m in self._metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.counter(
+    "http_requests_total", "HTTP requests by route, method and status", ("route", "method", "status"))
+http_duration = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("route", "method"))
+db_duration = registry.histogram(
+    "db_statement_duration_seconds", "SQL statement execution time", ("statement",))
+db_errors = registry.counter(
+    "db_statement_errors_total", "SQL statements that raised an error", ("statement",))
+pool_wait = registry.histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0))
+pool_timeouts = registry.counter(
+    "db_pool_checkout_timeouts_total", "Pool checkouts that gave up waiting")
+db_prepares = registry.counter(
+    "db_statement_prepares_total", "Server-side prepares (prepared statement cache misses)", ("statement",))
+
+
+# ==========================================
+# HTTP
+# ==========================================
+
+class MetricsMiddleware:
+    """ルートごとの応答時間とステータスを記録する (BaseHTTPMiddleware を使わない素のASGI)。
+
+    ルート名はパスそのものではなく "/api/attendance_matrix" のような定義上のパスを使う。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            if route is not None:
+                label = route.path
+            elif scope.get("root_path"):
+                label = scope["root_path"] + "/*"   # /static などのマウント
+            else:
+                label = "unmatched"
+            method = scope["method"]
+            http_duration.observe(time.perf_counter() - start, label, method)
+            http_requests.inc(label, method, str(status))
+
+
+# ==========================================
+# DB
+# ==========================================
+
+_VERB_RE = re.compile(r"^\s*(\w+)")
+_TABLE_RE = re.compile(r"\b(?:FROM|JOIN|INTO|UPDATE|TABLE)\s+([a-z_][a-z0-9_]*)", re.IGNORECASE)
+_SQL_KEYWORDS = {"select", "set", "lateral", "unnest", "generate_series", "only"}
+_statement_names: Dict[str, str] = {}
+
+
+def statement_name(sql: str) -> str:
+    """名前の付いていないSQLの名前 ("select students,classes" など)。同じSQLは結果を使い回す"""
+    name = _statement_names.get(sql)
+    if name is None:
+        m = _VERB_RE.match(sql)
+        verb = m.group(1).lower() if m else "sql"
+        tables = []
+        for t in _TABLE_RE.findall(sql):
+            t = t.lower()
+            if t not in tables and t not in _SQL_KEYWORDS:
+                tables.append(t)
+        name = f"{verb} {','.join(tables[:4])}".strip()
+        if len(_statement_names) < 5000:
+            _statement_names[sql] = name
+    return name
+
+
+def instrument_engine(engine) -> None:
+    """SQLごとの実行時間を記録する。
+
+    text(...).execution_options(metrics_name="...") で名前を付けたSQLはその名前、
+    それ以外はSQL文から作った名前で集計する。
+    """
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        name = context.execution_options.get("metrics_name") if context is not None else None
+        # この後プリペアされたら、その回数をこの名前で数える
+        _current_statement.set(name or statement_name(statement))
+        conn.info.setdefault("_metrics_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info["_metrics_start"].pop()
+        name = context.execution_options.get("metrics_name") if context is not None else None
+        db_duration.observe(time.perf_counter() - start, name or statement_name(statement))
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _error(exception_context):
+        conn = exception_context.connection
+        stack = conn.info.get("_metrics_start") if conn is not None else None
+        if stack:
+            stack.pop()
+        ctx = exception_context.execution_context
+        name = ctx.execution_options.get("metrics_name") if ctx is not None else None
+        db_errors.inc(name or statement_name(exception_context.statement or ""))
+
+
+_current_statement: ContextVar[str] = ContextVar("current_statement", default="unknown")
+
+
+def prepared_statement_name() -> str:
+    """asyncpg がSQLをサーバー側でプリペアするたびに呼ばれる (database.py の prepared_statement_name_func)"""
+    db_prepares.inc(_current_statement.get())
+    return f"__asyncpg_{uuid.uuid4()}__"
+
+
+def statement_stats() -> dict:
+    """SQLごとの実行回数・プリペア回数・平均実行時間 (/api/queries/stats)"""
+    prepares = {labels[0]: n for labels, n in db_prepares._values.items()}
+    stats = {}
+    for (name,), v in sorted(db_duration._values.items(), key=lambda kv: -kv[1][-1]):
+        calls = v[-1]
+        stats[name] = {
+            "calls": calls,
+            "prepares": int(prepares.get(name, 0)),
+            "mean_ms": round(v[-2] / calls * 1000, 3) if calls else 0.0,
+            "total_ms": round(v[-2] * 1000, 1),
+        }
+    return stats
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """接続を借りるまでの待ち時間を記録するコネクションプール"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            pool_timeouts.inc()
+            raise
+        finally:
+            pool_wait.observe(time.perf_counter() - start)
+
+
+def register_pool_gauges(engine) -> None:
+    pool = engine.pool
+    registry.gauge_callback("db_pool_size", "Configured pool size", pool.size)
+    registry.gauge_callback("db_pool_checked_out", "Connections currently checked out", pool.checkedout)
+    registry.gauge_callback("db_pool_overflow", "Connections opened beyond pool_size", lambda: max(0, pool.overflow()))
+
+
+def render_metrics() -> str:
+    return registry.render()
@@ -0,0 +1,220 @@
+"""DBマイグレーションの実行ツール
+
+db/migrations/ の NNNN_*.sql を番号順に1回ずつ適用する。
+init.sql を流し直さずに既存環境のスキーマを更新できる。
+
+    python migrations.py upgrade   # 未適用のマイグレーションを適用
+    python migrations.py status    # 適用状況を表示
+    python migrations.py explain   # 主要クエリがインデックスを使っているか確認
+"""
+import os
+import re
+import sys
+import json
+import asyncio
+import datetime
+
+from sqlalchemy import text
+
+import queries
+from database import engine
+from student_directory import search_sql
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "db", "migrations")
+MIGRATION_FILE_RE = re.compile(r"^(\d{4})_([\w\-]+)\.sql$")
+
+# 起動時に未適用のマイグレーションを自動で適用するか
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "1") == "1"
+
+# 複数プロセスが同時に起動しても1つだけが適用するためのロックキー
+ADVISORY_LOCK_KEY = 727_0001
+
+
+def list_migrations():
+    migrations = []
+    for fname in sorted(os.listdir(MIGRATIONS_DIR)):
+        m = MIGRATION_FILE_RE.match(fname)
+        if m:
+            migrations.append((m.group(1), m.group(2), os.path.join(MIGRATIONS_DIR, fname)))
+    return migrations
+
+
+async def ensure_version_table(conn):
+    await conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """))
+
+
+async def applied_versions(conn):
+    rows = (await conn.execute(text("SELECT version FROM schema_migrations"))).fetchall()
+    return {r.version for r in rows}
+
+
+async def run_script(conn, sql: str):
+    # 複数文・関数定義を含むファイルをそのまま流すため、ドライバの接続で直接実行する
+    raw = await conn.get_raw_connection()
+    await raw.driver_connection.execute(sql)
+
+
+async def upgrade(eng=engine, verbose: bool = True):
+    applied_now = []
+    async with eng.begin() as conn:
+        await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": ADVISORY_LOCK_KEY})
+        await ensure_version_table(conn)
+        done = await applied_versions(conn)
+
+        for version, name, path in list_migrations():
+            if version in done:
+                continue
+            with open(path, encoding="utf-8") as f:
+                sql = f.read()
+            if verbose:
+                print(f"▶ Applying migration {version}_{name}")
+            # 1ファイルごとにセーブポイントを切り、失敗したら全体を巻き戻す
+            async with conn.begin_nested():
+                await run_script(conn, sql)
+                await conn.execute(
+                    text("INSERT INTO schema_migrations (version, name) VALUES (:v, :n)"),
+                    {"v": version, "n": name}
+                )
+            applied_now.append(version)
+
+    if verbose and not applied_now:
+        print("✅ Schema is up to date")
+    return applied_now
+
+
+async def status():
+    async with engine.begin() as conn:
+        await ensure_version_table(conn)
+        done = await applied_versions(conn)
+    for version, name, _ in list_migrations():
+        mark = "applied" if version in done else "pending"
+        print(f"{version}_{name}: {mark}")
+
+
+# ==========================================
+# EXPLAINによるインデックス使用チェック
+# ==========================================
+
+def _sample_params():
+    today = datetime.date.today()
+    return {
+        "email": "student@hcs.ac.jp",
+        "tid": 1,
+        "c_name": "R4A1",
+        "start": today - datetime.timedelta(days=30),
+        "end": today,
+        "name": "R4A1",
+        "cid": 1,
+        "date": today,
+        "period": 1,
+        "sid": 1,
+        "stu": "s20250001",
+        "ids": ["s20250001"],
+        "limit": 50,
+        "offset": 0,
+        "class_name": "R4A1",
+        "admission_year": today.year,
+        "lo": "s2025",
+        "hi": "s2026",
+        "k_class": "R4A1",
+        "k_no": 10,
+        "k_stu": "s20250010",
+    }
+
+
+# main.py の主要クエリ (名前, SQL, Seq Scan を許さないテーブル)
+HOT_QUERIES = [
+    ("login_lookup", queries.LOGIN_LOOKUP.text, ["teachers", "students"]),
+    ("teacher_classes", queries.TEACHER_CLASSES.text, ["classes"]),
+    ("class_students", "SELECT student_number, name, attendance_no FROM students WHERE homeroom_class = :c_name ORDER BY attendance_no", ["students"]),
+    ("class_sessions_in_range", """
+        SELECT DISTINCT s.session_id, s.date, s.period
+        FROM class_sessions s
+        JOIN attendance_results ar ON s.session_id = ar.session_id AND s.date = ar.session_date
+        JOIN students stu ON ar.student_number = stu.student_number
+        WHERE stu.homeroom_class = :c_name AND s.date >= :start AND s.date <= :end
+          AND ar.session_date >= :start AND ar.session_date <= :end
+        ORDER BY s.date, s.period
+    """, ["class_sessions", "attendance_results", "students"]),
+    ("matrix_version", """
+        SELECT COUNT(ar.result_id), MAX(ar.updated_at)
+        FROM attendance_results ar
+        WHERE ar.student_number IN (
+            SELECT student_number FROM students WHERE homeroom_class = :c_name
+            ORDER BY attendance_no, student_number LIMIT :limit OFFSET :offset
+        )
+          AND ar.session_date >= :start AND ar.session_date <= :end
+    """, ["attendance_results", "students"]),
+    ("class_by_name", queries.CLASS_BY_NAME.text, ["classes"]),
+    ("session_by_slot", queries.SESSION_BY_SLOT.text, ["class_sessions"]),
+    ("result_by_session_student", queries.RESULT_BY_SESSION_STUDENT.text, ["attendance_results"]),
+    ("delete_results_by_students", "SELECT result_id FROM attendance_results WHERE student_number = ANY(:ids)", ["attendance_results"]),
+    ("student_exists", queries.STUDENT_EXISTS.text, ["students"]),
+    ("student_email_exists", queries.STUDENT_EMAIL_EXISTS.text, ["students"]),
+    # ユーザー管理の生徒一覧 (student_directory.search_sql の組み合わせのうち代表的なもの)
+    ("student_search_next_page", search_sql(False, False, False, True, True).text, ["students"]),
+    ("student_search_class_year", search_sql(True, True, False, True, True).text, ["students"]),
+    ("student_search_prefix", search_sql(False, False, True, True, False).text, ["students"]),
+]
+
+
+# 年度ごとのパーティション (class_sessions_y2025 など) は元のテーブル名で数える
+PARTITION_NAME_RE = re.compile(r"^(.*)_y\d{4}$")
+
+
+def _seq_scans(plan, found):
+    if plan.get("Node Type") == "Seq Scan":
+        name = plan.get("Relation Name") or ""
+        m = PARTITION_NAME_RE.match(name)
+        found.append(m.group(1) if m else name)
+    for child in plan.get("Plans", []):
+        _seq_scans(child, found)
+    return found
+
+
+async def explain():
+    params = _sample_params()
+    failures = []
+    async with engine.begin() as conn:
+        # テストデータが少ないとSeq Scanの方が安くなるため、
+        # インデックスが「使える」かどうかを確認する目的でSeq Scanを抑止する
+        await conn.execute(text("SET LOCAL enable_seqscan = off"))
+        for name, sql, tables in HOT_QUERIES:
+            stmt = text(f"EXPLAIN (FORMAT JSON) {sql}")
+            used = {k: v for k, v in params.items() if f":{k}" in sql}
+            plan_json = (await conn.execute(stmt, used)).scalar()
+            plan = (json.loads(plan_json) if isinstance(plan_json, str) else plan_json)[0]["Plan"]
+            bad = [t for t in _seq_scans(plan, []) if t in tables]
+            if bad:
+                failures.append(name)
+                print(f"❌ {name}: Seq Scan on {', '.join(bad)}")
+            else:
+                print(f"✅ {name}")
+    return failures
+
+
+async def _main(cmd: str):
+    try:
+        if cmd == "upgrade":
+            await upgrade()
+        elif cmd == "status":
+            await status()
+        elif cmd == "explain":
+            if await explain():
+                return 1
+        else:
+            print(__doc__)
+            return 2
+        return 0
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main(sys.argv[1] if len(sys.argv) > 1 else "")))
@@ -0,0 +1,90 @@
+"""出欠テーブルの年度パーティション (db/migrations/0004)
+
+class_sessions / attendance_results は年度 (4月〜翌3月) ごとのパーティション
+(class_sessions_y2025 など) に分かれている。今年度と来年度の分は起動時に
+ensure_partitions で作っておく。終わった年度の切り離しは archive.py。
+"""
+import os
+import re
+import datetime
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+
+from database import engine
+
+# 年度の開始月
+ACADEMIC_YEAR_START_MONTH = 4
+# 今年度に加えて何年度先までパーティションを作っておくか
+PARTITION_AHEAD_YEARS = int(os.getenv("PARTITION_AHEAD_YEARS", "1"))
+
+# 複数ワーカーが同時に起動しても1つだけが作るためのロックキー
+PARTITION_LOCK_KEY = 727_0002
+
+PARTITION_NAME_RE = re.compile(r"^(class_sessions|attendance_results)_y(\d{4})$")
+
+PARTITIONS_SQL = text("""
+    SELECT p.relname AS parent, c.relname AS name
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    JOIN pg_class p ON p.oid = i.inhparent
+    WHERE p.relname IN ('class_sessions', 'attendance_results')
+      AND p.relnamespace = to_regnamespace(current_schema())
+""")
+
+
+def academic_year(d: datetime.date) -> int:
+    return d.year if d.month >= ACADEMIC_YEAR_START_MONTH else d.year - 1
+
+
+def year_range(year: int) -> Tuple[datetime.date, datetime.date]:
+    """年度の (開始日, 翌年度の開始日)"""
+    return (datetime.date(year, ACADEMIC_YEAR_START_MONTH, 1),
+            datetime.date(year + 1, ACADEMIC_YEAR_START_MONTH, 1))
+
+
+def partition_names(year: int) -> Tuple[str, str]:
+    return f"class_sessions_y{year}", f"attendance_results_y{year}"
+
+
+@dataclass
+class YearPartition:
+    year: int
+    start: datetime.date
+    end: datetime.date          # この日を含まない
+    tables: List[str]
+
+
+async def live_years(conn) -> List[YearPartition]:
+    """今ある年度のパーティション (古い順)"""
+    years = {}
+    for r in (await conn.execute(PARTITIONS_SQL)).fetchall():
+        m = PARTITION_NAME_RE.match(r.name)
+        if not m:
+            continue
+        year = int(m.group(2))
+        if year not in years:
+            years[year] = YearPartition(year, *year_range(year), [])
+        years[year].tables.append(r.name)
+    return [years[y] for y in sorted(years)]
+
+
+def is_missing_partition(e: Exception) -> bool:
+    """パーティションの無い年度の日付を書き込もうとしたエラーか (check_violation の一種)"""
+    return getattr(getattr(e, "orig", None), "sqlstate", None) == "23514" and "no partition of relation" in str(e)
+
+
+async def live_from(conn) -> Optional[datetime.date]:
+    """残っている最も古い年度の開始日 (それより前は archive.py で切り離し済み)"""
+    years = await live_years(conn)
+    return years[0].start if years else None
+
+
+async def ensure_partitions(eng=engine, today: Optional[datetime.date] = None, ahead: int = PARTITION_AHEAD_YEARS):
+    """今年度から ahead 年度先までのパーティションを作る (あれば何もしない)"""
+    current = academic_year(today or datetime.date.today())
+    async with eng.begin() as conn:
+        await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": PARTITION_LOCK_KEY})
+        for year in range(current, current + ahead + 1):
+            await conn.execute(text("SELECT attendance_create_partitions(:year)"), {"year": year})
@@ -0,0 +1,163 @@
+import os
+import hmac
+import time
+import base64
+import asyncio
+import hashlib
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+# scrypt のコスト。変更すると、次回ログイン時に新しいコストで作り直される
+SCRYPT_N = int(os.getenv("PASSWORD_SCRYPT_N", str(2 ** 14)))
+SCRYPT_R = int(os.getenv("PASSWORD_SCRYPT_R", "8"))
+SCRYPT_P = int(os.getenv("PASSWORD_SCRYPT_P", "1"))
+SCRYPT_DKLEN = 32
+SALT_BYTES = 16
+# ハッシュ計算に使うスレッド数 (= 同時に計算する最大数)。0 ならイベントループ上で計算する (比較用)
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+HASH_PREFIX = "scrypt"
+# 保存されたハッシュとして受け付けるコストの上限 (これを超える値は壊れたデータか細工されたものとみなす)
+MAX_SCRYPT_N = max(2 ** 20, SCRYPT_N)
+MAX_SCRYPT_R = max(32, SCRYPT_R)
+MAX_SCRYPT_P = max(16, SCRYPT_P)
+
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii")
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    # hashlib.scrypt は計算中にGILを手放すので、スレッドで並列に動く
+    return hashlib.scrypt(password.encode("utf-8"), salt=salt, n=n, r=r, p=p,
+                          maxmem=128 * n * r * p + 1024 * 1024, dklen=SCRYPT_DKLEN)
+
+
+def make_hash(password: str) -> str:
+    salt = secrets.token_bytes(SALT_BYTES)
+    digest = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return f"{HASH_PREFIX}${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64(salt)}${_b64(digest)}"
+
+
+def parse_hash(stored: Optional[str]) -> Optional[Tuple[int, int, int, bytes, bytes]]:
+    """make_hash の形式なら (n, r, p, salt, digest)、そうでなければ None"""
+    if not stored or not stored.startswith(HASH_PREFIX + "$"):
+        return None
+    parts = stored.split("$")
+    if len(parts) != 6:
+        return None
+    try:
+        n, r, p = int(parts[1]), int(parts[2]), int(parts[3])
+        salt = base64.b64decode(parts[4], validate=True)
+        digest = base64.b64decode(parts[5], validate=True)
+    except ValueError:
+        return None
+    # n は2の累乗 (hashlib.scrypt の条件)。大きすぎる値で照合のたびにメモリとCPUを使い切らないようにする
+    if not (1 < n <= MAX_SCRYPT_N and n & (n - 1) == 0 and 0 < r <= MAX_SCRYPT_R and 0 < p <= MAX_SCRYPT_P):
+        return None
+    if len(salt) != SALT_BYTES or len(digest) != SCRYPT_DKLEN:
+        return None
+    return n, r, p, salt, digest
+
+
+def is_hashed(stored: Optional[str]) -> bool:
+    return parse_hash(stored) is not None
+
+
+def check(password: str, stored: Optional[str]) -> Tuple[bool, bool]:
+    """(一致したか, 作り直しが必要か) を返す。
+
+    stored が平文 (移行前のデータ) の場合もそのまま比べ、一致したら作り直しが必要とする。
+    """
+    if not stored:
+        return False, False
+    parsed = parse_hash(stored)
+    if parsed is None:
+        return hmac.compare_digest(stored.encode("utf-8"), password.encode("utf-8")), True
+    n, r, p, salt, expected = parsed
+    try:
+        actual = _scrypt(password, salt, n, r, p)
+    except ValueError:
+        return False, False
+    ok = hmac.compare_digest(actual, expected)
+    return ok, ok and (n, r, p) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+
+
+class PasswordHasher:
+    """パスワードの照合・ハッシュ化をスレッドプールで行う。
+
+    scrypt は1回数十ミリ秒CPUを使うため、async のハンドラ内で直接呼ぶと
+    朝のログイン集中時にイベントループ全体が止まる。同時に計算する数は
+    workers までで、それ以上は順番待ちになる (待ち時間は stats で確認できる)。
+    """
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS):
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pwhash") if workers > 0 else None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        # 統計
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_compute = 0.0
+
+    async def _run(self, func, *args):
+        if self._executor is None:
+            start = time.perf_counter()
+            try:
+                return func(*args)
+            finally:
+                self.completed += 1
+                self.total_compute += time.perf_counter() - start
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.workers)
+        queued_at = time.perf_counter()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        started_at = time.perf_counter()
+        wait = started_at - queued_at
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self.running += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        finally:
+            self.running -= 1
+            self._semaphore.release()
+            self.completed += 1
+            self.total_compute += time.perf_counter() - started_at
+
+    async def hash(self, password: str) -> str:
+        return await self._run(make_hash, password)
+
+    async def verify(self, password: str, stored: Optional[str]) -> Tuple[bool, bool]:
+        if not is_hashed(stored):
+            # 平文の比較はすぐ終わるのでプールに回さない
+            return check(password, stored)
+        return await self._run(check, password, stored)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "scrypt": {"n": SCRYPT_N, "r": SCRYPT_R, "p": SCRYPT_P},
+            "waiting": self.waiting,
+            "running": self.running,
+            "completed": self.completed,
+            "avg_wait_ms": round(self.total_wait * 1000 / self.completed, 2) if self.completed else None,
+            "max_wait_ms": round(self.max_wait * 1000, 2),
+            "avg_compute_ms": round(self.total_compute * 1000 / self.completed, 2) if self.completed else None,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+
+password_hasher = PasswordHasher()
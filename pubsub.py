@@ -0,0 +1,99 @@
+import os
+import asyncio
+from typing import Any, Dict, Hashable, Optional, Set
+
+# 購読者ごとに溜めておけるイベント数。溢れた購読者は切断する
+PUBSUB_BUFFER_SIZE = int(os.getenv("PUBSUB_BUFFER_SIZE", "100"))
+
+
+class Subscription:
+    def __init__(self, broker: "PubSub", topic: Hashable, maxsize: int):
+        self.broker = broker
+        self.topic = topic
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = False
+
+    async def get(self) -> Optional[Any]:
+        """次のイベント。切断された場合は None"""
+        if self.dropped and self.queue.empty():
+            return None
+        return await self.queue.get()
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PubSub:
+    """プロセス内の簡単なpub/sub (トピックごとに購読者へ配る)。
+
+    publish は待たずに各購読者のキューへ入れるだけ。読み出しが追いつかず
+    キューが一杯になった購読者は、溜め続けずにその場で切断する
+    (クライアント側は再接続して最初から受け取り直す)。
+    """
+
+    def __init__(self, buffer_size: int = PUBSUB_BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        self._topics: Dict[Hashable, Set[Subscription]] = {}
+        # 統計
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    def subscribe(self, topic: Hashable) -> Subscription:
+        sub = Subscription(self, topic, self.buffer_size)
+        self._topics.setdefault(topic, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        subs = self._topics.get(sub.topic)
+        if subs is None:
+            return
+        subs.discard(sub)
+        if not subs:
+            del self._topics[sub.topic]
+
+    def publish(self, topic: Hashable, event: Any) -> int:
+        self.published += 1
+        sent = 0
+        for sub in list(self._topics.get(topic, ())):
+            try:
+                sub.queue.put_nowait(event)
+                sent += 1
+            except asyncio.QueueFull:
+                self._drop(sub)
+        self.delivered += sent
+        return sent
+
+    def _drop(self, sub: Subscription, count: bool = True):
+        # 溜まっている分を捨て、切断の合図 (None) だけを残す
+        sub.dropped = True
+        if count:
+            self.dropped += 1
+        self.unsubscribe(sub)
+        while not sub.queue.empty():
+            sub.queue.get_nowait()
+        sub.queue.put_nowait(None)
+
+    def disconnect_all(self) -> int:
+        """全購読者を切断する (取りこぼした可能性があるとき、再接続して読み直させる)"""
+        subs = [sub for subs in self._topics.values() for sub in subs]
+        for sub in subs:
+            self._drop(sub, count=False)
+        return len(subs)
+
+    def stats(self) -> dict:
+        return {
+            "topics": len(self._topics),
+            "subscribers": sum(len(s) for s in self._topics.values()),
+            "buffer_size": self.buffer_size,
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+        }
+
@@ -0,0 +1,122 @@
+"""main.py のハンドラで使うSQL
+
+どれも名前付きで、パラメータの数・型が変わらない (可変長の IN (...) は使わず配列で渡す)。
+同じ文字列のSQLは、プールの接続ごとに1回だけサーバー側でプリペアされ
+(DB_STATEMENT_CACHE_SIZE)、以降は解析・実行計画の作成を省いて実行される。
+名前は /metrics (db_statement_*{statement="..."}) と /api/queries/stats に出る。
+
+ここに無いSQLも、各モジュールで定数として名前を付けて定義している
+(attendance_matrix.MATRIX_SQL, checkin_queue.INSERT_CHECKINS_SQL など)。
+"""
+from typing import Dict
+
+from sqlalchemy import text
+from sqlalchemy.sql.elements import TextClause
+
+STATEMENTS: Dict[str, TextClause] = {}
+
+
+def statement(name: str, sql: str) -> TextClause:
+    """名前付きのSQLを定義する (名前は重複させない)"""
+    if name in STATEMENTS:
+        raise ValueError(f"duplicate statement name: {name}")
+    stmt = text(sql).execution_options(metrics_name=name)
+    STATEMENTS[name] = stmt
+    return stmt
+
+
+# ==========================================
+# ログイン・教員
+# ==========================================
+
+# 教師・生徒を1回の問い合わせで探す (同じメールがあれば教師を優先)
+LOGIN_LOOKUP = statement("login_lookup", """
+    SELECT 'teacher' AS role, CAST(teacher_id AS TEXT) AS user_id, name, password_hash, NULL AS homeroom_class
+    FROM teachers WHERE email = :email
+    UNION ALL
+    SELECT 'student' AS role, student_number, name, password_hash, homeroom_class
+    FROM students WHERE email = :email
+""")
+
+# 他で変更されていたら上書きしない
+UPGRADE_TEACHER_HASH = statement("upgrade_teacher_hash", """
+    UPDATE teachers SET password_hash = :new WHERE teacher_id = :id AND password_hash = :old
+""")
+UPGRADE_STUDENT_HASH = statement("upgrade_student_hash", """
+    UPDATE students SET password_hash = :new WHERE student_number = :id AND password_hash = :old
+""")
+
+TEACHER_CLASSES = statement("teacher_classes", """
+    SELECT class_id, class_name FROM classes WHERE teacher_id = :tid ORDER BY class_name
+""")
+
+CLASS_BY_NAME = statement("class_by_name", "SELECT class_id FROM classes WHERE class_name = :name")
+
+# ==========================================
+# 出席確認
+# ==========================================
+
+# 再起動直後でも出席確認中のセッションを引き継げるよう、有効期限内のものを読み込む
+ACTIVE_SESSIONS = statement("active_sessions", """
+    SELECT DISTINCT ON (cs.class_id)
+        cs.session_id, cs.class_id, c.class_name, cs.sound_token, cs.period, cs.date,
+        EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - cs.created_at)) AS age
+    FROM class_sessions cs
+    LEFT JOIN classes c ON cs.class_id = c.class_id
+    WHERE cs.created_at >= CURRENT_TIMESTAMP - make_interval(secs => :ttl)
+      AND cs.date >= CURRENT_DATE - 1 -- 分割キーの条件。昨日以降を含む年度のパーティションだけを読む
+      AND cs.sound_token <> '0000' -- 手動変更で作られたセッションは除外
+    ORDER BY cs.class_id, cs.session_id DESC
+""")
+
+# 同じコマのセッションがあればOTPを差し替える
+UPSERT_SESSION = statement("upsert_session", """
+    WITH new_sess AS (
+        INSERT INTO class_sessions (class_id, date, period, sound_token)
+        VALUES (:cid, :date, :period, :token)
+        ON CONFLICT (class_id, date, period)
+        DO UPDATE SET sound_token = EXCLUDED.sound_token, created_at = CURRENT_TIMESTAMP
+        RETURNING session_id, class_id
+    )
+    SELECT n.session_id, c.class_name
+    FROM new_sess n LEFT JOIN classes c ON n.class_id = c.class_id
+""")
+
+# 出席確認中の画面 (/api/rollcall_feed) を開いた教師の担当クラスか確かめる
+SESSION_CLASS = statement("session_class", """
+    SELECT class_id FROM class_sessions WHERE session_id = :sid AND date = :date
+""")
+
+# ==========================================
+# 出席簿の手動変更 (update_status)
+# ==========================================
+
+SESSION_BY_SLOT = statement("session_by_slot", """
+    SELECT session_id FROM class_sessions WHERE class_id = :cid AND date = :date AND period = :period
+""")
+INSERT_MANUAL_SESSION = statement("insert_manual_session", """
+    INSERT INTO class_sessions (class_id, date, period, sound_token)
+    VALUES (:cid, :date, :period, '0000') RETURNING session_id
+""")
+RESULT_BY_SESSION_STUDENT = statement("result_by_session_student", """
+    SELECT result_id FROM attendance_results
+    WHERE session_id = :sid AND student_number = :stu AND session_date = :date
+""")
+UPDATE_RESULT = statement("update_result", """
+    UPDATE attendance_results SET status = :st, note = :nt WHERE result_id = :rid AND session_date = :date
+""")
+INSERT_RESULT = statement("insert_result", """
+    INSERT INTO attendance_results (session_id, session_date, student_number, status, note)
+    VALUES (:sid, :date, :stu, :st, :nt)
+""")
+
+# ==========================================
+# ユーザー管理
+# ==========================================
+
+STUDENT_EXISTS = statement("student_exists", "SELECT 1 FROM students WHERE student_number = :stu")
+STUDENT_EMAIL_EXISTS = statement("student_email_exists", "SELECT 1 FROM students WHERE email = :email")
+INSERT_STUDENT = statement("insert_student", """
+    INSERT INTO students (student_number, name, email, password_hash, homeroom_class, attendance_no)
+    VALUES (:id, :name, :email, :pass, :cls, :no)
+""")
@@ -0,0 +1,148 @@
+import os
+import math
+import time
+import asyncio
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Hashable, Optional
+
+# 生徒ごと: 連続で送れる回数と、1秒あたりの回復量 (OTPの当てずっぽう対策)
+CHECKIN_STUDENT_BURST = float(os.getenv("CHECKIN_STUDENT_BURST", "5"))
+CHECKIN_STUDENT_PER_SEC = float(os.getenv("CHECKIN_STUDENT_PER_SEC", "0.5"))
+# 授業セッションごと: DBへ送る出席登録の量
+CHECKIN_SESSION_BURST = float(os.getenv("CHECKIN_SESSION_BURST", "100"))
+CHECKIN_SESSION_PER_SEC = float(os.getenv("CHECKIN_SESSION_PER_SEC", "50"))
+# 出席登録で同時にDBを使う最大数と、空きを待つ最大時間 (ミリ秒)
+CHECKIN_MAX_CONCURRENCY = int(os.getenv("CHECKIN_MAX_CONCURRENCY", "16"))
+CHECKIN_ADMISSION_WAIT_MS = int(os.getenv("CHECKIN_ADMISSION_WAIT_MS", "200"))
+# 保持するバケット数の上限。超えたら最後に使ってから最も長いものから捨てる
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "10000"))
+
+
+class RateLimited(Exception):
+    """受け付けられない場合。retry_after 秒後に再試行できる"""
+
+    def __init__(self, scope: str, retry_after: float):
+        super().__init__(f"{scope}: retry after {retry_after:.1f}s")
+        self.scope = scope
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        # Retry-After は整数秒
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, capacity: float, now: float):
+        self.tokens = capacity
+        self.updated = now
+
+
+class KeyedRateLimiter:
+    """キーごとのトークンバケット。1回ごとに1トークン使い、rate/秒で回復する"""
+
+    def __init__(self, name: str, capacity: float, rate: float, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.name = name
+        self.capacity = capacity
+        self.rate = rate
+        self.max_keys = max_keys
+        # 最後に使った順 (先頭が最も古い)
+        self._buckets: "OrderedDict[Hashable, TokenBucket]" = OrderedDict()
+        # 統計
+        self.allowed = 0
+        self.rejected = 0
+        self.evicted = 0
+
+    def _refill(self, bucket: TokenBucket, now: float):
+        bucket.tokens = min(self.capacity, bucket.tokens + (now - bucket.updated) * self.rate)
+        bucket.updated = now
+
+    def hit(self, key: Hashable) -> None:
+        """1回分を使う。足りなければ RateLimited"""
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            # 古いものを1つ捨てるだけなので、キーが多くても O(1)。
+            # 長く使われていないバケットはほぼ満タンまで回復しているので、作り直しても変わらない
+            while len(self._buckets) >= self.max_keys:
+                self._buckets.popitem(last=False)
+                self.evicted += 1
+            bucket = self._buckets[key] = TokenBucket(self.capacity, now)
+        else:
+            self._buckets.move_to_end(key)
+            self._refill(bucket, now)
+
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            self.allowed += 1
+            return
+        self.rejected += 1
+        raise RateLimited(self.name, (1 - bucket.tokens) / self.rate)
+
+    def stats(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "per_sec": self.rate,
+            "keys": len(self._buckets),
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+            "evicted": self.evicted,
+        }
+
+
+class ConcurrencyGate:
+    """同時に実行できる数の上限。空きを wait 秒まで待ち、それでも空かなければ RateLimited"""
+
+    def __init__(self, limit: int, wait_ms: int):
+        self.limit = limit
+        self.wait = wait_ms / 1000
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        # 統計
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    @asynccontextmanager
+    async def admit(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.limit)
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.wait)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise RateLimited("concurrency", 1.0)
+        self.admitted += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
+
+
+# check_attend 用
+student_limiter = KeyedRateLimiter("student", CHECKIN_STUDENT_BURST, CHECKIN_STUDENT_PER_SEC)
+session_limiter = KeyedRateLimiter("class_session", CHECKIN_SESSION_BURST, CHECKIN_SESSION_PER_SEC)
+checkin_gate = ConcurrencyGate(CHECKIN_MAX_CONCURRENCY, CHECKIN_ADMISSION_WAIT_MS)
+
+
+def rate_limit_stats() -> dict:
+    return {
+        "student": student_limiter.stats(),
+        "class_session": session_limiter.stats(),
+        "concurrency": checkin_gate.stats(),
+    }
@@ -0,0 +1,72 @@
+import os
+import json
+import asyncio
+import datetime
+from typing import AsyncIterator
+
+from sqlalchemy import text
+
+from pubsub import PubSub
+
+# 何も起きていない間に送る keep-alive の間隔 (秒)
+ROLLCALL_FEED_HEARTBEAT = float(os.getenv("ROLLCALL_FEED_HEARTBEAT", "15"))
+
+# 出席確認中のセッションごとの出席登録イベント (トピック = session_id)
+rollcall_feed = PubSub()
+
+# 接続時点で既に出席している生徒 (再接続した場合もここから受け取り直す)
+# 同じコマのセッションには出席簿の手動変更 (欠席・遅刻など) も入るので、アプリからの出席だけを返す
+# (checkin_queue.INSERT_CHECKINS_SQL と同じ status / note)
+CHECKED_IN_SQL = text("""
+    SELECT ar.student_number, s.attendance_no, s.name, ar.registered_at
+    FROM attendance_results ar
+    JOIN students s ON s.student_number = ar.student_number
+    WHERE ar.session_id = :sid
+      AND ar.session_date = :date -- 分割キー。セッションの年度のパーティションだけを読む
+      AND ar.status = '出席' AND ar.note = 'アプリ'
+    ORDER BY ar.result_id
+""").execution_options(metrics_name="rollcall_checked_in")
+
+
+def checkin_event(student_number: str, attendance_no, name: str, at: datetime.datetime) -> dict:
+    return {
+        "student_number": student_number,
+        "number": attendance_no,
+        "name": name,
+        "time": at.strftime('%H:%M:%S'),
+    }
+
+
+def _sse(event: str, data) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+async def stream_rollcall(engine, session_id: int, session_date: datetime.date) -> AsyncIterator[bytes]:
+    """Server-Sent Events で出席登録を1件ずつ送る。
+
+    先に購読してから既存分を送るので、その間の登録も取りこぼさない
+    (同じ生徒が2回届くことはあるので、クライアント側で学籍番号で重ねる)。
+    """
+    with rollcall_feed.subscribe(session_id) as sub:
+        # 切断時にブラウザが再接続するまでの待ち時間 (ミリ秒)
+        yield b"retry: 3000\n\n"
+        try:
+            async with engine.connect() as conn:
+                rows = (await conn.execute(CHECKED_IN_SQL, {"sid": session_id, "date": session_date})).fetchall()
+        except Exception as e:
+            print(f"❌ Feed Error: {e}")
+            yield _sse("error", {"message": "データ取得エラー"})
+            return
+        for r in rows:
+            yield _sse("checkin", checkin_event(r.student_number, r.attendance_no, r.name, r.registered_at))
+
+        while True:
+            try:
+                event = await asyncio.wait_for(sub.get(), ROLLCALL_FEED_HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield b": ping\n\n"
+                continue
+            if event is None:
+                # 読み出しが遅れて切断された。クライアントは再接続して既存分から受け取り直す
+                return
+            yield _sse("checkin", event)
@@ -0,0 +1,103 @@
+"""出欠集計テーブル (attendance_monthly_rollup) の読み出しと再構築
+
+集計はトリガーで自動的に更新されるので、普段は何もしなくてよい。
+過去データの取り込み後などに全件作り直す場合
+(archive.py で切り離した年度の集計は元データがないので残す):
+
+    python rollup.py rebuild
+"""
+import sys
+import asyncio
+import datetime
+from typing import List, Optional
+
+from sqlalchemy import text
+
+from database import engine
+from attendance_matrix import STATUS_CLASSES
+from partitions import live_from
+
+SUMMARY_SQL = text("""
+    SELECT st.student_number, st.name, st.attendance_no, r.status, SUM(r.count) AS cnt
+    FROM attendance_monthly_rollup r
+    JOIN students st ON st.student_number = r.student_number
+    WHERE r.class_id = :cid
+      AND r.month >= :from_month
+      AND r.month <= :to_month
+    GROUP BY st.student_number, st.name, st.attendance_no, r.status
+    ORDER BY st.attendance_no, st.student_number
+""").execution_options(metrics_name="attendance_summary")
+
+
+def month_start(d: datetime.date) -> datetime.date:
+    return d.replace(day=1)
+
+
+def parse_month(value: Optional[str], default: datetime.date) -> datetime.date:
+    # "YYYY-MM" または "YYYY-MM-DD" を月初日に変換
+    if not value:
+        return month_start(default)
+    if len(value) == 7:
+        value += "-01"
+    return month_start(datetime.date.fromisoformat(value))
+
+
+async def class_summary(conn, class_id: int, from_month: datetime.date, to_month: datetime.date) -> List[dict]:
+    """クラス・期間 (月単位) の生徒ごとの出欠件数。集計テーブルだけを読む"""
+    rows = (await conn.execute(SUMMARY_SQL, {
+        "cid": class_id, "from_month": month_start(from_month), "to_month": month_start(to_month)
+    })).fetchall()
+
+    students = {}
+    for r in rows:
+        stu = students.get(r.student_number)
+        if stu is None:
+            stu = students[r.student_number] = {
+                "student_number": r.student_number,
+                "name": r.name,
+                "number": r.attendance_no,
+                "counts": {status: 0 for status in STATUS_CLASSES},
+                "total": 0,
+            }
+        stu["counts"][r.status] = stu["counts"].get(r.status, 0) + int(r.cnt)
+        stu["total"] += int(r.cnt)
+
+    for stu in students.values():
+        present = stu["counts"]["出席"] + stu["counts"]["遅刻"] + stu["counts"]["早退"]
+        # 公欠・特欠は出席すべき回数から除く
+        required = stu["total"] - stu["counts"]["公欠"] - stu["counts"]["特欠"]
+        stu["rate"] = round(present * 100 / required, 1) if required > 0 else None
+    return list(students.values())
+
+
+async def rebuild(eng=engine):
+    async with eng.begin() as conn:
+        # 作り直し中に出席が登録されて数がずれないよう書き込みを止める
+        await conn.execute(text("LOCK TABLE attendance_results IN SHARE MODE"))
+        # archive.py で切り離した年度は元データがないので、残っている年度の月だけ作り直す
+        await conn.execute(text("DELETE FROM attendance_monthly_rollup WHERE month >= :from"),
+                           {"from": await live_from(conn) or datetime.date.min})
+        result = await conn.execute(text("""
+            INSERT INTO attendance_monthly_rollup (student_number, class_id, month, status, count)
+            SELECT ar.student_number, COALESCE(cs.class_id, 0), CAST(date_trunc('month', cs.date) AS DATE), ar.status, COUNT(*)
+            FROM attendance_results ar
+            JOIN class_sessions cs ON cs.session_id = ar.session_id AND cs.date = ar.session_date
+            GROUP BY 1, 2, 3, 4
+        """))
+    return result.rowcount
+
+
+async def _main(cmd: str):
+    try:
+        if cmd == "rebuild":
+            n = await rebuild()
+            print(f"✅ Rebuilt attendance_monthly_rollup ({n} rows)")
+            return 0
+        print(__doc__)
+        return 2
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main(sys.argv[1] if len(sys.argv) > 1 else "")))
@@ -0,0 +1,72 @@
+"""本番用の起動スクリプト (複数ワーカー・--reload なし)
+
+    python serve.py                     # WEB_CONCURRENCY (未設定ならCPU数) のワーカーで起動
+    python serve.py --workers 4 --port 8000
+
+ワーカーごとに別プロセスになるので、
+- コネクションプールはワーカーごとに持つ。DB_CONNECTION_BUDGET (全ワーカー合計の接続数) を
+  設定すると、ワーカー数で割って DB_POOL_SIZE / DB_MAX_OVERFLOW を決める
+- 出席確認中のセッションなどメモリ上の状態は、cluster_bus (LISTEN/NOTIFY) で他のワーカーへ伝える
+- 出席登録の流量制限 (CHECKIN_*) はワーカーごとに数える
+
+開発時は従来どおり uvicorn main:app --reload を使う (docker-compose.yml)。
+"""
+import os
+import argparse
+
+import uvicorn
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def worker_settings(workers: int, budget: int) -> dict:
+    """ワーカー1つあたりの設定 (環境変数) を返す"""
+    env = {}
+    if workers > 1 and "CLUSTER_NOTIFY" not in os.environ:
+        env["CLUSTER_NOTIFY"] = "1"
+    if budget > 0:
+        # LISTEN 用に1本ずつ取っておく
+        per_worker = budget // workers - (1 if workers > 1 else 0)
+        if per_worker < 2:
+            raise SystemExit(f"DB_CONNECTION_BUDGET={budget} では {workers} ワーカーに足りません (1ワーカー2本以上)")
+        pool_size = max(1, per_worker // 2)
+        env["DB_POOL_SIZE"] = str(pool_size)
+        env["DB_MAX_OVERFLOW"] = str(per_worker - pool_size)
+        # 出席登録が同時に使う接続はプールの範囲内に収める
+        concurrency = int(os.getenv("CHECKIN_MAX_CONCURRENCY", "16"))
+        env["CHECKIN_MAX_CONCURRENCY"] = str(max(1, min(concurrency, per_worker - 1)))
+    return env
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY") or 0) or os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    budget = int(os.getenv("DB_CONNECTION_BUDGET", "0"))
+    env = worker_settings(args.workers, budget)
+    # ワーカーは環境変数を引き継ぐ (main.py の load_dotenv は既にある値を上書きしない)
+    os.environ.update(env)
+
+    print(f"▶ cocone: {args.workers} workers on {args.host}:{args.port}, "
+          f"pool {os.getenv('DB_POOL_SIZE', '10')}+{os.getenv('DB_MAX_OVERFLOW', '10')} per worker, "
+          f"cluster notify {'on' if os.getenv('CLUSTER_NOTIFY') == '1' else 'off'}")
+    uvicorn.run(
+        "main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        # リバースプロキシ (nginx など) の X-Forwarded-* を信用するアドレス
+        proxy_headers=True,
+        forwarded_allow_ips=os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1"),
+        # アクセスログは /metrics で代わりに見られるので、既定では出さない
+        access_log=os.getenv("ACCESS_LOG", "0") == "1",
+        timeout_keep_alive=int(os.getenv("KEEP_ALIVE_TIMEOUT", "5")),
+    )
+
+
+if __name__ == "__main__":
+    main()
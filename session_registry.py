@@ -0,0 +1,79 @@
+import os
+import time
+import datetime
+from dataclasses import dataclass
+from typing import Optional, Dict
+
+# OTPの有効期限 (秒)。generate_otp から この時間が過ぎたセッションは無効になる
+OTP_SESSION_TTL = int(os.getenv("OTP_SESSION_TTL", "600"))
+# OTPのビット数 (音響信号で送る)。bench/fsk_benchmark.py で読み取れることを確認した値にする
+OTP_BITS = int(os.getenv("OTP_BITS", "4"))
+
+
+@dataclass
+class ActiveSession:
+    session_id: int
+    class_id: Optional[int]
+    class_name: Optional[str]
+    otp_value: int
+    period: int
+    date: datetime.date
+    expires_at: float
+
+
+class ActiveSessionRegistry:
+    """出席確認中の授業セッションをクラスごとにメモリ上で保持する。
+
+    check_attend はここを参照するだけでOTP照合ができるので、
+    生徒1人ごとの class_sessions への問い合わせが不要になる。
+    """
+
+    def __init__(self, ttl: int = OTP_SESSION_TTL):
+        self.ttl = ttl
+        # クラス名 -> 現在有効なセッション (クラス未指定の出席確認は None キー)
+        self._sessions: Dict[Optional[str], ActiveSession] = {}
+
+    def publish(self, session_id: int, class_id: Optional[int], class_name: Optional[str],
+                otp_value: int, period: int, date: datetime.date, age: float = 0.0) -> ActiveSession:
+        self.evict_expired()
+        sess = ActiveSession(
+            session_id=session_id,
+            class_id=class_id,
+            class_name=class_name,
+            otp_value=otp_value,
+            period=period,
+            date=date,
+            expires_at=time.monotonic() + self.ttl - age,
+        )
+        self._sessions[class_name] = sess
+        return sess
+
+    def get(self, class_name: Optional[str]) -> Optional[ActiveSession]:
+        sess = self._sessions.get(class_name)
+        if sess is None:
+            return None
+        if sess.expires_at <= time.monotonic():
+            # 期限切れは見つけた時点で削除
+            self._sessions.pop(class_name, None)
+            return None
+        return sess
+
+    def lookup_for_student(self, homeroom_class: Optional[str]) -> Optional[ActiveSession]:
+        # 自分のクラスのセッションを優先し、なければクラス未指定の出席確認を使う
+        return self.get(homeroom_class) or self.get(None)
+
+    def discard(self, class_name: Optional[str]) -> None:
+        self._sessions.pop(class_name, None)
+
+    def evict_expired(self) -> int:
+        now = time.monotonic()
+        expired = [k for k, v in self._sessions.items() if v.expires_at <= now]
+        for k in expired:
+            del self._sessions[k]
+        return len(expired)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+active_sessions = ActiveSessionRegistry()
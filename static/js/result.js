@@ -11,7 +11,7 @@ document.addEventListener('DOMContentLoaded', function() {
     // --- ダウンロードボタン (CSVダウンロード実装) ---
     const downloadBtn = document.getElementById('download-btn');
     if (downloadBtn) {
-        downloadBtn.addEventListener('click', function() {
+        downloadBtn.addEventListener('click', async function() {
             // URLパラメータから現在の検索条件を取得
             const urlParams = new URLSearchParams(window.location.search);
             const className = urlParams.get('class_name');
@@ -23,10 +23,323 @@ document.addEventListener('DOMContentLoaded', function() {
                 return;
             }
 
-            // APIへリダイレクトしてダウンロードを開始
-            // encodeURIComponentで日本語クラス名などを安全に送信
-            const url = `/api/download_csv?class_name=${encodeURIComponent(className)}&start_date=${startDate}&end_date=${endDate}`;
-            window.location.href = url;
+            // CSVはサーバーのバックグラウンドで作り、できあがったらダウンロードする
+            // (期間が長くても応答待ちでタイムアウトしない)
+            const label = downloadBtn.textContent;
+            downloadBtn.disabled = true;
+            try {
+                const res = await fetch('/api/jobs/export_csv', {
+                    method: 'POST',
+                    headers: {'Content-Type': 'application/json'},
+                    body: JSON.stringify({class_name: className, start_date: startDate, end_date: endDate})
+                });
+                const data = await res.json();
+                if (data.status !== 'success') throw new Error(data.message || '不明なエラー');
+
+                let job = data.job;
+                while (job.status !== 'done' && job.status !== 'error') {
+                    await new Promise(resolve => setTimeout(resolve, 1000));
+                    const poll = await (await fetch(`/api/jobs/${data.job_id}`)).json();
+                    if (poll.status !== 'success') throw new Error(poll.message || '不明なエラー');
+                    job = poll.job;
+                    if (job.percent !== null) downloadBtn.textContent = `作成中 ${job.percent}%`;
+                }
+                if (job.status === 'error') throw new Error(job.message || '不明なエラー');
+                window.location.href = `/api/jobs/${data.job_id}/download`;
+            } catch (e) {
+                console.error(e);
+                alert('CSVの作成に失敗しました: ' + e.message);
+            } finally {
+                downloadBtn.disabled = false;
+                downloadBtn.textContent = label;
+            }
+        });
+    }
+
+    // --- 出席簿の読み込み ---
+    // 生徒はページ単位、日付はウィンドウ単位で /api/attendance_matrix から取得し、
+    // 下にスクロールしたら次の生徒、右にスクロールしたら次の日付を追加する
+    const table = document.getElementById('attendance-table');
+    const tableBody = table ? table.querySelector('tbody') : null;
+    const tableWrapper = document.getElementById('table-wrapper');
+    const loadingEl = document.getElementById('matrix-loading');
+
+    const matrix = {
+        className: table ? table.dataset.className : '',
+        startDate: table ? table.dataset.startDate : '',
+        endDate: table ? table.dataset.endDate : '',
+        pageSize: table ? parseInt(table.dataset.pageStudents) || 50 : 50,
+        windows: [],        // 読み込み済みの日付ウィンドウ {start, end}
+        offsets: [],        // 読み込み済みの生徒ページの先頭位置
+        nextStart: null,    // 次の日付ウィンドウの開始日 (null = 最後まで読み込み済み)
+        nextOffset: null,   // 次の生徒ページの先頭位置 (null = 最後まで読み込み済み)
+        busy: false,
+    };
+    const rowsByStudent = new Map();
+
+    async function fetchMatrix(offset, start, end) {
+        const params = new URLSearchParams({
+            class_name: matrix.className, start_date: start, end_date: end,
+            offset: offset, limit: matrix.pageSize
+        });
+        // ETag はブラウザのキャッシュが送るので、変わっていなければ 304 で済む
+        const response = await fetch('/api/attendance_matrix?' + params.toString());
+        const data = await response.json();
+        if (!response.ok || data.status !== 'success') {
+            throw new Error(data.message || '不明なエラー');
+        }
+        return data;
+    }
+
+    function appendHeaders(data) {
+        const headRow = table.querySelector('thead tr');
+        data.date_headers.forEach(date => {
+            const th = document.createElement('th');
+            th.dataset.date = date;
+            th.textContent = date;
+            headRow.appendChild(th);
+        });
+    }
+
+    function appendCells(data, createRows) {
+        const nPeriods = data.periods.length;
+        data.students.forEach(student => {
+            let row = rowsByStudent.get(student.student_number);
+            if (!row) {
+                if (!createRows) return;
+                row = document.createElement('tr');
+                row.dataset.realId = student.student_number;
+                const noTd = document.createElement('td');
+                noTd.className = 'fixed-col student-id';
+                noTd.textContent = student.number ?? '';
+                const nameTd = document.createElement('td');
+                nameTd.className = 'fixed-col name-col student-name';
+                nameTd.textContent = student.name;
+                row.append(noTd, nameTd);
+                tableBody.appendChild(row);
+                rowsByStudent.set(student.student_number, row);
+            }
+
+            const fragment = document.createDocumentFragment();
+            data.date_headers.forEach((date, d) => {
+                const td = document.createElement('td');
+                td.dataset.date = date;
+                const stack = document.createElement('div');
+                stack.className = 'cell-stack';
+                data.periods.forEach((period, p) => {
+                    const status = student.cells[d * nPeriods + p];
+                    const span = document.createElement('span');
+                    span.className = 'status ' + (status ? data.status_classes[status] : 'no-data');
+                    span.dataset.period = period;
+                    span.textContent = status || 'データなし';
+                    stack.appendChild(span);
+                });
+                td.appendChild(stack);
+                fragment.appendChild(td);
+            });
+            row.appendChild(fragment);
+        });
+    }
+
+    // 読み込み済みの全生徒について、次の日付ウィンドウを追加
+    async function loadNextWindow() {
+        const start = matrix.nextStart;
+        let nextStart = null;
+        let end = null;
+        for (let i = 0; i < matrix.offsets.length; i++) {
+            const data = await fetchMatrix(matrix.offsets[i], start, end || matrix.endDate);
+            if (i === 0) {
+                appendHeaders(data);
+                end = data.end_date;
+                nextStart = data.next_start;
+            }
+            appendCells(data, false);
+        }
+        matrix.windows.push({ start: start, end: end });
+        matrix.nextStart = nextStart;
+    }
+
+    // 読み込み済みの全日付ウィンドウについて、次の生徒ページを追加
+    async function loadNextPage() {
+        const offset = matrix.nextOffset;
+        let nextOffset = null;
+        for (let i = 0; i < matrix.windows.length; i++) {
+            const data = await fetchMatrix(offset, matrix.windows[i].start, matrix.windows[i].end);
+            if (i === 0) nextOffset = data.next_offset;
+            appendCells(data, i === 0);
+        }
+        matrix.offsets.push(offset);
+        matrix.nextOffset = nextOffset;
+    }
+
+    async function loadFirst() {
+        const data = await fetchMatrix(0, matrix.startDate, matrix.endDate);
+        appendHeaders(data);
+        appendCells(data, true);
+        matrix.windows.push({ start: data.start_date, end: data.end_date });
+        matrix.offsets.push(0);
+        matrix.nextStart = data.next_start;
+        matrix.nextOffset = data.next_offset;
+        if (data.total_students === 0) {
+            loadingEl.textContent = 'このクラスの生徒はいません';
+            loadingEl.classList.add('is-active');
+        }
+    }
+
+    function nearRightEdge() {
+        return tableWrapper.scrollLeft + tableWrapper.clientWidth >= tableWrapper.scrollWidth - 300;
+    }
+
+    function nearBottom() {
+        return window.innerHeight + window.scrollY >= document.documentElement.scrollHeight - 300;
+    }
+
+    async function loadMore() {
+        if (matrix.busy) return;
+        matrix.busy = true;
+        loadingEl.classList.add('is-active');
+        try {
+            if (matrix.offsets.length === 0) {
+                await loadFirst();
+            }
+            // 画面が埋まるまで続けて読み込む
+            while (true) {
+                if (matrix.nextStart && nearRightEdge()) {
+                    await loadNextWindow();
+                } else if (matrix.nextOffset !== null && nearBottom()) {
+                    await loadNextPage();
+                } else {
+                    break;
+                }
+            }
+            if (rowsByStudent.size > 0) loadingEl.classList.remove('is-active');
+        } catch (e) {
+            console.error(e);
+            loadingEl.textContent = 'データ取得エラー: ' + e.message;
+        } finally {
+            matrix.busy = false;
+        }
+    }
+
+    if (table && matrix.className && tableBody) {
+        tableWrapper.addEventListener('scroll', loadMore, { passive: true });
+        window.addEventListener('scroll', loadMore, { passive: true });
+        window.addEventListener('resize', loadMore);
+        loadMore();
+    } else if (loadingEl) {
+        loadingEl.remove();
+    }
+
+    // --- まとめて変更 ---
+    // 「まとめて変更」を押している間は、マスをクリックすると選択になる (日付の見出しでその日の全コマ)。
+    // 選んだマスを /api/update_status_batch で1回に送る
+    const bulkModeBtn = document.getElementById('bulk-mode-btn');
+    const bulkBar = document.getElementById('bulk-bar');
+    const bulkCount = document.getElementById('bulk-count');
+    const bulkSelect = document.getElementById('bulk-status-select');
+    const bulkApplyBtn = document.getElementById('bulk-apply-btn');
+    const bulkClearBtn = document.getElementById('bulk-clear-btn');
+    const bulkMessage = document.getElementById('bulk-message');
+
+    const bulk = {
+        active: false,
+        selected: new Set(),   // 選択中のマス (span.status)
+        batchMax: table ? parseInt(table.dataset.batchMax) || 500 : 500,
+    };
+
+    function updateBulkCount() {
+        if (bulkCount) bulkCount.textContent = `${bulk.selected.size}件選択中`;
+        if (bulkApplyBtn) bulkApplyBtn.disabled = bulk.selected.size === 0;
+    }
+
+    function setSelected(cell, selected) {
+        if (selected) bulk.selected.add(cell);
+        else bulk.selected.delete(cell);
+        cell.classList.toggle('is-selected', selected);
+    }
+
+    function clearSelection() {
+        bulk.selected.forEach(cell => cell.classList.remove('is-selected'));
+        bulk.selected.clear();
+        updateBulkCount();
+    }
+
+    function setBulkMode(active) {
+        bulk.active = active;
+        if (!active) clearSelection();
+        if (bulkModeBtn) bulkModeBtn.classList.toggle('is-active', active);
+        if (bulkBar) bulkBar.classList.toggle('is-active', active);
+        if (table) table.classList.toggle('is-selecting', active);
+        if (bulkMessage) bulkMessage.textContent = '';
+        updateBulkCount();
+    }
+
+    if (bulkModeBtn && table) {
+        bulkModeBtn.addEventListener('click', () => setBulkMode(!bulk.active));
+
+        // 日付の見出し: 読み込み済みの生徒のその日の全コマを選ぶ (全部選択済みなら外す)
+        table.querySelector('thead').addEventListener('click', function(e) {
+            const th = e.target.closest('th[data-date]');
+            if (!bulk.active || !th) return;
+            const cells = tableBody.querySelectorAll(`td[data-date="${th.dataset.date}"] .status`);
+            const allSelected = Array.from(cells).every(cell => bulk.selected.has(cell));
+            cells.forEach(cell => setSelected(cell, !allSelected));
+            updateBulkCount();
+        });
+    }
+
+    if (bulkClearBtn) bulkClearBtn.addEventListener('click', clearSelection);
+
+    if (bulkApplyBtn && bulkSelect) {
+        bulkApplyBtn.addEventListener('click', async function() {
+            if (bulk.selected.size === 0) return;
+            const selectedValue = bulkSelect.value;
+            const selectedText = bulkSelect.options[bulkSelect.selectedIndex].text;
+            const cells = Array.from(bulk.selected);
+            const edits = cells.map(cell => ({
+                student_number: cell.closest('tr').dataset.realId,
+                date: cell.closest('td').dataset.date,
+                period: parseInt(cell.dataset.period) || 1,
+                status: selectedText,
+                note: "手動変更"
+            }));
+
+            bulkApplyBtn.disabled = true;
+            if (bulkMessage) bulkMessage.textContent = '';
+            const errors = [];
+            try {
+                // 1回に送れる件数 (STATUS_BATCH_MAX) ごとに分けて送る
+                for (let i = 0; i < edits.length; i += bulk.batchMax) {
+                    const response = await fetch('/api/update_status_batch', {
+                        method: 'POST',
+                        headers: { 'Content-Type': 'application/json' },
+                        body: JSON.stringify({ class_name: matrix.className, edits: edits.slice(i, i + bulk.batchMax) })
+                    });
+                    const data = await response.json();
+                    if (!response.ok || data.status !== 'success') {
+                        throw new Error(data.message || '不明なエラー');
+                    }
+                    // 変更できたマスは画面も更新して選択を外す (失敗したマスは選択したまま残す)
+                    data.results.forEach((result, j) => {
+                        const cell = cells[i + j];
+                        if (result.status === 'success' || result.status === 'unchanged') {
+                            cell.className = 'status ' + selectedValue;
+                            cell.textContent = selectedText;
+                            bulk.selected.delete(cell);
+                        } else {
+                            errors.push(result.message || result.status);
+                        }
+                    });
+                }
+                if (errors.length > 0 && bulkMessage) {
+                    bulkMessage.textContent = `${errors.length}件は変更できませんでした: ${[...new Set(errors)].join(' / ')}`;
+                }
+            } catch (e) {
+                console.error(e);
+                alert("保存に失敗しました: " + e.message);
+            } finally {
+                updateBulkCount();
+            }
         });
     }
 
@@ -48,69 +361,67 @@ document.addEventListener('DOMContentLoaded', function() {
     // 本当の学籍番号を保持する変数
     let currentRealStudentId = ""; 
 
-    // ステータスセルクリックイベント
-    const statusCells = document.querySelectorAll('.status');
-    statusCells.forEach(function(cell) {
-        cell.addEventListener('click', function() {
-            currentTargetElement = cell;
-
-            const row = cell.closest('tr');
-            
-            // 行(tr)から data-real-id を取得
-            currentRealStudentId = row.dataset.realId; 
-
-            // 表示用の出席番号
-            const studentIdEl = row.querySelector('.student-id');
-            const studentIdDisplay = studentIdEl ? studentIdEl.textContent.trim() : '';
-
-            // 氏名
-            const studentNameEl = row.querySelector('.student-name');
-            const studentName = studentNameEl ? studentNameEl.textContent.trim() : '';
-
-            // 日付
-            const cellTd = cell.closest('td');
-            const allTds = Array.from(row.children);
-            const tdIndex = allTds.indexOf(cellTd);
-            const headerRow = document.querySelector('.result-table thead tr');
-            const targetHeader = headerRow ? headerRow.children[tdIndex] : null;
-            
-            currentRawDate = targetHeader ? targetHeader.textContent.trim() : '';
-
-            // 表示用に日付フォーマット
-            let dateDisplay = currentRawDate;
-            try {
-                const d = new Date(currentRawDate);
-                if (!isNaN(d.getTime())) {
-                    dateDisplay = `${d.getMonth() + 1}月${d.getDate()}日`;
-                }
-            } catch(e) {}
-
-            // 時限
-            const rawPeriod = cell.dataset.period || '1';
-            const periodText = rawPeriod + 'コマ目';
-
-            // モーダルにセット
-            if (modalStudentNum) modalStudentNum.textContent = studentIdDisplay;
-            if (modalStudentName) modalStudentName.textContent = studentName;
-            if (modalDate) modalDate.textContent = dateDisplay;
-            if (modalPeriod) modalPeriod.textContent = periodText;
-
-            // ステータス選択の初期値
-            if (modalSelect) {
-                const statusClasses = ['attend', 'absent', 'late', 'early', 'public-abs', 'special-abs', 'no-data'];
-                let currentStatus = 'no-data';
-                
-                statusClasses.forEach(cls => {
-                    if (cell.classList.contains(cls)) {
-                        currentStatus = cls;
-                    }
-                });
-                modalSelect.value = currentStatus;
+    // ステータスセルクリックイベント (行は後から追加されるので tbody で受け取る)
+    if (tableBody) tableBody.addEventListener('click', function(e) {
+        const cell = e.target.closest('.status');
+        if (!cell) return;
+        if (bulk.active) {
+            setSelected(cell, !bulk.selected.has(cell));
+            updateBulkCount();
+            return;
+        }
+        currentTargetElement = cell;
+
+        const row = cell.closest('tr');
+
+        // 行(tr)から data-real-id を取得
+        currentRealStudentId = row.dataset.realId;
+
+        // 表示用の出席番号
+        const studentIdEl = row.querySelector('.student-id');
+        const studentIdDisplay = studentIdEl ? studentIdEl.textContent.trim() : '';
+
+        // 氏名
+        const studentNameEl = row.querySelector('.student-name');
+        const studentName = studentNameEl ? studentNameEl.textContent.trim() : '';
+
+        // 日付
+        currentRawDate = cell.closest('td').dataset.date || '';
+
+        // 表示用に日付フォーマット
+        let dateDisplay = currentRawDate;
+        try {
+            const d = new Date(currentRawDate);
+            if (!isNaN(d.getTime())) {
+                dateDisplay = `${d.getMonth() + 1}月${d.getDate()}日`;
             }
+        } catch(e) {}
 
-            // モーダル表示
-            if (modal) modal.classList.add('active');
-        });
+        // 時限
+        const rawPeriod = cell.dataset.period || '1';
+        const periodText = rawPeriod + 'コマ目';
+
+        // モーダルにセット
+        if (modalStudentNum) modalStudentNum.textContent = studentIdDisplay;
+        if (modalStudentName) modalStudentName.textContent = studentName;
+        if (modalDate) modalDate.textContent = dateDisplay;
+        if (modalPeriod) modalPeriod.textContent = periodText;
+
+        // ステータス選択の初期値
+        if (modalSelect) {
+            const statusClasses = ['attend', 'absent', 'late', 'early', 'public-abs', 'special-abs', 'no-data'];
+            let currentStatus = 'no-data';
+
+            statusClasses.forEach(cls => {
+                if (cell.classList.contains(cls)) {
+                    currentStatus = cls;
+                }
+            });
+            modalSelect.value = currentStatus;
+        }
+
+        // モーダル表示
+        if (modal) modal.classList.add('active');
     });
 
     // 閉じる処理
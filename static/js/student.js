@@ -10,6 +10,8 @@ const BASE_0     = 18000;
 const BASE_1     = 19000;
 const START_RANGE = 400;   
 const STRICT_RANGE = 400; 
+// 受信するビット数 (サーバーの OTP_BITS。テンプレートで設定)
+const OTP_BITS = window.OTP_BITS || 4;
 
 // キャリブレーション
 let targetStart = BASE_START;
@@ -127,7 +129,7 @@ async function startReceivingSequence() {
     const startTime = performance.now(); 
     const firstBitOffset = 550; 
 
-    for (let i = 1; i <= 4; i++) {
+    for (let i = 1; i <= OTP_BITS; i++) {
         const targetTime = startTime + firstBitOffset + ((i - 1) * 500);
         const waitTime = targetTime - performance.now();
         if (waitTime > 0) await sleep(waitTime);
@@ -179,7 +181,10 @@ async function handleResult(isAborted, resultBits) {
     }
 }
 
-async function submitAttendance(bits) {
+// 混雑 (429) の場合に再送する最大回数
+const MAX_BUSY_RETRIES = 3;
+
+async function submitAttendance(bits, retry = 0) {
     const otpVal = parseInt(bits, 2);
     
     try {
@@ -188,6 +193,14 @@ async function submitAttendance(bits) {
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({ otp_value: otpVal })
         });
+
+        // 混雑中はサーバーが指定した秒数だけ待って同じコードを再送する
+        if (response.status === 429 && retry < MAX_BUSY_RETRIES) {
+            const waitSec = parseInt(response.headers.get('Retry-After')) || 1;
+            registerBtn.textContent = `混雑しています (${waitSec}秒後に再送)`;
+            await sleep(waitSec * 1000);
+            return submitAttendance(bits, retry + 1);
+        }
         
         const result = await response.json();
         
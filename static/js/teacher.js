@@ -1,3 +1,18 @@
+// ★BGMの候補 (小さい順)。ページから渡され、このブラウザで再生できる最初のものを使う
+const BGM_URL = (() => {
+    const fallback = "/static/sounds/bgm.wav";
+    try {
+        const sources = JSON.parse(document.currentScript.dataset.bgmSources || "[]");
+        const probe = document.createElement("audio");
+        const playable = sources.find(s => probe.canPlayType(s.type) !== "");
+        return playable ? playable.url : fallback;
+    } catch (e) {
+        return fallback;
+    }
+})();
+// 出席確認ボタンを押す前に読み込んでおく (押したときはブラウザのキャッシュから読む)
+fetch(BGM_URL).catch(() => {});
+
 document.addEventListener('DOMContentLoaded', () => {
     // ==========================================
     // 1. UI要素の取得
@@ -35,7 +50,7 @@ document.addEventListener('DOMContentLoaded', () => {
         // ★BGMプレーヤーの初期化
         if (!bgmPlayer) {
             bgmPlayer = new Tone.Player({
-                url: "/static/sounds/bgm.wav", 
+                url: BGM_URL,
                 loop: true, 
                 volume: -8
             }).toDestination();
@@ -52,10 +67,10 @@ document.addEventListener('DOMContentLoaded', () => {
         }
 
         // 信号パターンのループ再生
-        const totalDuration = (1 + 4) * DURATION + 2.0; 
+        const totalDuration = (1 + binaryStr.length) * DURATION + 2.0; 
         sequenceLoop = new Tone.Loop((time) => {
             synth.triggerAttackRelease(FREQ_MARKER, TONE_LENGTH, time);
-            for (let i = 0; i < 4; i++) {
+            for (let i = 0; i < binaryStr.length; i++) {
                 const bit = binaryStr[i];
                 const freq = (bit === '1') ? FREQ_BIT_1 : FREQ_BIT_0;
                 const noteTime = time + ((i + 1) * DURATION);
@@ -67,6 +82,54 @@ document.addEventListener('DOMContentLoaded', () => {
         isPlaying = true;
     }
 
+    // ==========================================
+    // 出席した生徒の一覧 (サーバーから順次受け取る)
+    // ==========================================
+    const feedArea = document.getElementById('checkin-feed');
+    const feedList = document.getElementById('checkin-list');
+    const feedCount = document.getElementById('checkin-count');
+    let feedSource = null;
+    const checkedIn = new Set();
+
+    function addCheckin(item) {
+        // 再接続時は既存分も届くので、学籍番号で重複を除く
+        if (checkedIn.has(item.student_number)) return;
+        checkedIn.add(item.student_number);
+
+        const li = document.createElement('li');
+        const no = document.createElement('span');
+        no.className = 'checkin-no';
+        no.textContent = item.number ?? '';
+        const name = document.createElement('span');
+        name.textContent = item.name;
+        const time = document.createElement('span');
+        time.className = 'checkin-time';
+        time.textContent = item.time;
+        li.append(no, name, time);
+        feedList.prepend(li);
+        feedCount.textContent = checkedIn.size;
+    }
+
+    function startFeed(sessionId, sessionDate) {
+        if (!feedArea || !window.EventSource) return;
+        stopFeed();
+        checkedIn.clear();
+        feedList.innerHTML = '';
+        feedCount.textContent = '0';
+        feedArea.classList.add('is-visible');
+
+        // 切断されてもブラウザが自動で再接続する
+        feedSource = new EventSource(`/api/rollcall_feed?session_id=${sessionId}&date=${sessionDate}`);
+        feedSource.addEventListener('checkin', (e) => addCheckin(JSON.parse(e.data)));
+    }
+
+    function stopFeed() {
+        if (feedSource) {
+            feedSource.close();
+            feedSource = null;
+        }
+    }
+
     function updateDisplay(msg, otp = null, color = "#666") {
         if (!statusArea) return;
         if (otp !== null) {
@@ -89,7 +152,9 @@ document.addEventListener('DOMContentLoaded', () => {
                 return;
             }
 
-            const classId = "1"; // 文字列で指定
+            // 選択中のクラス (選択肢がなければ従来どおり "1")
+            const classSelect = document.getElementById('class-select');
+            const classId = (classSelect && classSelect.value) ? classSelect.value : "1"; // 文字列で指定
 
             try {
                 updateDisplay("準備中...");
@@ -122,6 +187,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 
                 console.log(`Sending: ${otpBinary}`);
                 playSoundPattern(otpBinary);
+                startFeed(data.session_id, data.date);
 
             } catch (err) {
                 console.error(err);
@@ -148,6 +214,8 @@ document.addEventListener('DOMContentLoaded', () => {
 
         Tone.Transport.stop();
         isPlaying = false;
+        // 一覧は停止後も表示したまま、受信だけ止める
+        stopFeed();
 
         if (startBtn) {
             startBtn.textContent = "出席確認";
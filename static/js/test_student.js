@@ -10,6 +10,8 @@ let animationId = null;
 const BASE_START = 17000;
 const BASE_0     = 18000;
 const BASE_1     = 19000;
+// 受信するビット数 (サーバーの OTP_BITS。テンプレートで設定)
+const OTP_BITS = window.OTP_BITS || 4;
 
 // ★椅子の音対策: 範囲は狭いまま維持 (誤検知防止の要)
 const START_RANGE = 400; 
@@ -164,7 +166,7 @@ async function startReceivingSequence() {
     // マージンを見て 550ms に設定します。
     const firstBitOffset = 550; 
 
-    for (let i = 1; i <= 4; i++) {
+    for (let i = 1; i <= OTP_BITS; i++) {
         // 次のターゲット時刻
         const targetTime = startTime + firstBitOffset + ((i - 1) * 500);
         const waitTime = targetTime - performance.now();
@@ -1,3 +1,18 @@
+// ★BGMの候補 (小さい順)。ページから渡され、このブラウザで再生できる最初のものを使う
+const BGM_URL = (() => {
+    const fallback = "/static/sounds/bgm.wav";
+    try {
+        const sources = JSON.parse(document.currentScript.dataset.bgmSources || "[]");
+        const probe = document.createElement("audio");
+        const playable = sources.find(s => probe.canPlayType(s.type) !== "");
+        return playable ? playable.url : fallback;
+    } catch (e) {
+        return fallback;
+    }
+})();
+// 出席確認ボタンを押す前に読み込んでおく (押したときはブラウザのキャッシュから読む)
+fetch(BGM_URL).catch(() => {});
+
 document.addEventListener('DOMContentLoaded', () => {
     // UI要素
     const startBtn = document.getElementById('submit-btn');      
@@ -39,7 +54,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
         if (!bgmPlayer) {
             bgmPlayer = new Tone.Player({
-                url: "/static/sounds/bgm.wav", 
+                url: BGM_URL,
                 loop: true, volume: -15
             }).toDestination();
         }
@@ -53,14 +68,14 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     function playSoundPattern(binaryStr) {
-        const totalDuration = (1 + 4) * DURATION + 2.0; 
+        const totalDuration = (1 + binaryStr.length) * DURATION + 2.0; 
 
         sequenceLoop = new Tone.Loop((time) => {
             // Start
             synth.triggerAttackRelease(FREQ_MARKER, TONE_LENGTH, time);
 
             // Bits
-            for (let i = 0; i < 4; i++) {
+            for (let i = 0; i < binaryStr.length; i++) {
                 const bit = binaryStr[i];
                 const freq = (bit === '1') ? FREQ_BIT_1 : FREQ_BIT_0;
                 const noteTime = time + ((i + 1) * DURATION);
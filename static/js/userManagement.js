@@ -1,60 +1,144 @@
 document.addEventListener('DOMContentLoaded', function() {
     
-    // --- フィルタリング機能 ---
+    // --- 生徒一覧 ---
+    // /api/students/search からページ単位で読み込み、下までスクロールしたら続きを読み込む
+    // (クラス・入学年・検索の絞り込みはサーバー側で行う)
     const classFilter = document.getElementById('class-filter');
     const yearFilter = document.getElementById('year-filter');
-    const tableRows = document.querySelectorAll('.user-table tbody tr');
+    const searchFilter = document.getElementById('search-filter');
+    const userTable = document.getElementById('user-table');
+    const tableBody = userTable ? userTable.querySelector('tbody') : null;
+    const listStatus = document.getElementById('user-list-status');
+    const selectAllCheckbox = document.getElementById('select-all');
 
-    function filterTable() {
-        const selectedClass = classFilter ? classFilter.value : '';
-        const selectedYear = yearFilter ? yearFilter.value : '';
+    const list = {
+        pageSize: userTable ? parseInt(userTable.dataset.pageSize) || 50 : 50,
+        cursor: null,       // 次のページのカーソル
+        done: false,        // 最後まで読み込み済み
+        busy: false,
+        generation: 0,      // 絞り込みを変えたら増やし、古い応答を捨てる
+        count: 0,
+    };
+
+    function appendStudentRow(student) {
+        const tr = document.createElement('tr');
+        const checkCell = document.createElement('td');
+        checkCell.className = 'checkbox-col';
+        const checkbox = document.createElement('input');
+        checkbox.type = 'checkbox';
+        checkbox.className = 'user-checkbox';
+        checkbox.value = student.student_number;
+        checkCell.appendChild(checkbox);
+        tr.appendChild(checkCell);
+        [student.student_number, student.email, student.name, student.homeroom_class,
+         student.attendance_no, student.admission_year].forEach(value => {
+            const td = document.createElement('td');
+            td.textContent = value ?? '';
+            tr.appendChild(td);
+        });
+        tableBody.appendChild(tr);
+    }
 
-        tableRows.forEach(row => {
-            const rowClass = row.children[4].textContent.trim();
-            const rowYear = row.children[6].textContent.trim();
-            const isClassMatch = (selectedClass === '') || (rowClass === selectedClass);
-            const isYearMatch = (selectedYear === '') || (rowYear === selectedYear);
+    function setListStatus() {
+        if (!listStatus) return;
+        if (list.busy) listStatus.textContent = '読み込み中...';
+        else if (list.count === 0) listStatus.textContent = '該当するユーザーはいません';
+        else listStatus.textContent = list.done ? `${list.count} 件` : `${list.count} 件表示 (スクロールで続きを表示)`;
+    }
 
-            if (isClassMatch && isYearMatch) {
-                row.style.display = ''; 
-            } else {
-                row.style.display = 'none'; 
+    function isNearBottom() {
+        return window.innerHeight + window.scrollY >= document.documentElement.scrollHeight - 300;
+    }
+
+    async function loadStudents(reset = false) {
+        if (!tableBody) return;
+        if (reset) {
+            list.generation++;
+            list.cursor = null;
+            list.done = false;
+            list.busy = false;
+            list.count = 0;
+            tableBody.innerHTML = '';
+            if (selectAllCheckbox) selectAllCheckbox.checked = false;
+        }
+        if (list.busy || list.done) return;
+
+        const generation = list.generation;
+        const params = new URLSearchParams({limit: list.pageSize});
+        if (classFilter && classFilter.value) params.set('class_name', classFilter.value);
+        if (yearFilter && yearFilter.value) params.set('admission_year', yearFilter.value);
+        if (searchFilter && searchFilter.value.trim()) params.set('q', searchFilter.value.trim());
+        if (list.cursor) params.set('cursor', list.cursor);
+
+        list.busy = true;
+        setListStatus();
+        try {
+            const res = await fetch('/api/students/search?' + params.toString());
+            const data = await res.json();
+            if (generation !== list.generation) return;
+            if (data.status !== 'success') throw new Error(data.message || '不明なエラー');
+
+            data.students.forEach(appendStudentRow);
+            list.count += data.students.length;
+            list.cursor = data.next_cursor;
+            list.done = !data.next_cursor;
+            if (selectAllCheckbox) selectAllCheckbox.checked = false;
+        } catch (e) {
+            console.error(e);
+            if (generation === list.generation) showPageError('※ ユーザー一覧の読み込みに失敗しました');
+            list.done = true;
+        } finally {
+            if (generation === list.generation) {
+                list.busy = false;
+                setListStatus();
             }
-        });
-        if (selectAllCheckbox) selectAllCheckbox.checked = false;
-        
+        }
+        // 画面が埋まるまで続きを読む
+        if (generation === list.generation && !list.done && isNearBottom()) loadStudents();
+    }
+
+    function filterChanged() {
         clearPageError();
+        loadStudents(true);
     }
-    if (classFilter) classFilter.addEventListener('change', filterTable);
-    if (yearFilter) yearFilter.addEventListener('change', filterTable);
+    if (classFilter) classFilter.addEventListener('change', filterChanged);
+    if (yearFilter) yearFilter.addEventListener('change', filterChanged);
+    if (searchFilter) {
+        let searchTimer = null;
+        searchFilter.addEventListener('input', function() {
+            clearTimeout(searchTimer);
+            searchTimer = setTimeout(filterChanged, 300);
+        });
+    }
+    window.addEventListener('scroll', function() {
+        if (isNearBottom()) loadStudents();
+    }, { passive: true });
 
     // --- チェックボックス制御 ---
-    const selectAllCheckbox = document.getElementById('select-all');
-    const userCheckboxes = document.querySelectorAll('.user-checkbox');
-
+    // (行は後から追加されるので、tbody でまとめて受け取る)
     if (selectAllCheckbox) {
         selectAllCheckbox.addEventListener('change', function() {
             const isChecked = this.checked;
-            userCheckboxes.forEach(function(checkbox) {
-                const row = checkbox.closest('tr');
-                if (row.style.display !== 'none') checkbox.checked = isChecked;
+            document.querySelectorAll('.user-checkbox').forEach(function(checkbox) {
+                checkbox.checked = isChecked;
             });
             clearPageError();
         });
     }
 
-    userCheckboxes.forEach(function(checkbox) {
-        checkbox.addEventListener('change', function() {
+    if (tableBody) {
+        tableBody.addEventListener('change', function(event) {
+            if (!event.target.classList.contains('user-checkbox')) return;
             clearPageError();
-            if (!this.checked) {
+            if (!selectAllCheckbox) return;
+            if (!event.target.checked) {
                 selectAllCheckbox.checked = false;
             } else {
-                const visibleCheckboxes = Array.from(userCheckboxes).filter(cb => cb.closest('tr').style.display !== 'none');
-                const allVisibleChecked = visibleCheckboxes.every(cb => cb.checked);
-                if (allVisibleChecked && visibleCheckboxes.length > 0) selectAllCheckbox.checked = true;
+                const checkboxes = Array.from(document.querySelectorAll('.user-checkbox'));
+                selectAllCheckbox.checked = checkboxes.length > 0 && checkboxes.every(cb => cb.checked);
             }
         });
-    });
+    }
 
     // --- ページ全体のエラー表示 ---
     const pageErrorArea = document.getElementById('management-error-msg');
@@ -65,6 +149,32 @@ document.addEventListener('DOMContentLoaded', function() {
         if (pageErrorArea) pageErrorArea.textContent = '';
     }
 
+    // --- バックグラウンド処理 (削除・一括追加) の完了待ち ---
+    // 受け付けた処理は /api/jobs/{job_id} で進み具合を確認し、終わったら結果を返す
+    const JOB_POLL_INTERVAL_MS = 1000;
+    async function waitForJob(jobId, label) {
+        while (true) {
+            await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+            let data;
+            try {
+                const res = await fetch(`/api/jobs/${encodeURIComponent(jobId)}`);
+                data = await res.json();
+            } catch (e) {
+                // 一時的な通信エラーは次の確認で取り戻す
+                console.error(e);
+                continue;
+            }
+            if (data.status !== 'success') throw new Error(data.message || '不明なエラー');
+            const job = data.job;
+            if (job.status === 'done' || job.status === 'error') {
+                showPageError('');
+                return job;
+            }
+            const percent = job.percent !== null ? ` ${job.percent}%` : '';
+            showPageError(`${label}${percent} ${job.message || ''}`);
+        }
+    }
+
     // =========================================
     // カスタムモーダル (Alert / Confirm)
     // =========================================
@@ -137,8 +247,7 @@ document.addEventListener('DOMContentLoaded', function() {
         deleteBtn.addEventListener('click', async function() {
             clearPageError();
 
-            const checkedBoxes = Array.from(document.querySelectorAll('.user-checkbox:checked'))
-                                      .filter(cb => cb.closest('tr').style.display !== 'none');
+            const checkedBoxes = Array.from(document.querySelectorAll('.user-checkbox:checked'));
             
             const targetCount = checkedBoxes.length;
 
@@ -158,15 +267,23 @@ document.addEventListener('DOMContentLoaded', function() {
                 });
                 const data = await res.json();
 
-                if (data.status === 'success') {
-                    await customAlert('削除しました');
-                    location.reload();
-                } else {
+                if (data.status !== 'success') {
                     await customAlert('削除失敗: ' + (data.message || '不明なエラー'));
+                    return;
+                }
+                deleteBtn.disabled = true;
+                const job = await waitForJob(data.job_id, '削除中...');
+                if (job.status === 'done') {
+                    await customAlert(job.message || '削除しました');
+                    loadStudents(true);
+                } else {
+                    await customAlert('削除失敗: ' + (job.message || '不明なエラー'));
                 }
             } catch (e) {
                 console.error(e);
                 await customAlert('通信エラーが発生しました');
+            } finally {
+                deleteBtn.disabled = false;
             }
         });
     }
@@ -238,7 +355,31 @@ document.addEventListener('DOMContentLoaded', function() {
                 }
 
                 if (data.status === 'success') {
-                    await customAlert(data.message);
+                    if (addModal) addModal.classList.remove('active');
+                    const job = await waitForJob(data.job_id, '一括追加中...');
+                    if (job.status !== 'done') {
+                        let message = 'エラー: ' + (job.message || '不明なエラー');
+                        // 途中まで登録された場合は、登録された学籍番号を表示する
+                        const inserted = (job.result && job.result.report && job.result.report.inserted) || [];
+                        if (inserted.length > 0) {
+                            message += '\n登録済み: ' + inserted.slice(0, 5).join(', ');
+                            if (inserted.length > 5) message += ` ほか ${inserted.length - 5} 件`;
+                        }
+                        await customAlert(message);
+                        if (inserted.length > 0) location.reload();
+                        return;
+                    }
+                    let message = job.result.message;
+                    // 登録できなかった行を先頭から数件だけ表示
+                    const report = job.result.report || {};
+                    const problems = [].concat(report.invalid || [], report.skipped || [])
+                                       .sort((a, b) => a.line - b.line);
+                    if (problems.length > 0) {
+                        const lines = problems.slice(0, 5).map(p => `${p.line}行目 ${p.student_number}: ${p.reason}`);
+                        if (problems.length > 5) lines.push(`ほか ${problems.length - 5} 件`);
+                        message += '\n' + lines.join('\n');
+                    }
+                    await customAlert(message);
                     location.reload();
                 } else {
                     let errorMsg = data.message;
@@ -256,8 +397,9 @@ document.addEventListener('DOMContentLoaded', function() {
             } catch (e) {
                 console.error(e);
                 await customAlert('通信エラーが発生しました');
+            } finally {
+                this.value = '';
             }
-            this.value = '';
         });
     }
 
@@ -360,6 +502,9 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     });
 
+    // 最初のページを読み込む
+    loadStudents(true);
+
     function clearModalError() {
         if (modalErrorArea) modalErrorArea.textContent = '';
         modalInputs.forEach(input => {
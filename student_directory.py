@@ -0,0 +1,120 @@
+"""ユーザー管理の生徒一覧 (/api/students/search)
+
+並び順は (クラス, 出席番号, 学籍番号)。OFFSET を使わず、前のページの最後の
+生徒の並びキーをカーソルにして続きを読むので、何ページ目でもインデックスを
+1ページ分だけ読めば済む (db/migrations/0006)。
+"""
+import os
+import json
+import base64
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+
+# 1ページの生徒数 (既定値と上限)
+STUDENT_PAGE_SIZE = int(os.getenv("STUDENT_PAGE_SIZE", "50"))
+STUDENT_PAGE_MAX = 200
+
+# 並びキー。インデックス (idx_students_directory) と同じ式にする
+SORT_KEY = "COALESCE(homeroom_class, ''), COALESCE(attendance_no, 0), student_number"
+
+ADMISSION_YEARS_SQL = text("SELECT MIN(admission_year) AS min_year, MAX(admission_year) AS max_year FROM students")
+
+
+class InvalidCursor(ValueError):
+    """カーソルが壊れている"""
+
+
+def encode_cursor(k_class: str, k_no: int, student_number: str) -> str:
+    raw = json.dumps([k_class, k_no, student_number], ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        k_class, k_no, student_number = json.loads(raw)
+        return str(k_class), int(k_no), str(student_number)
+    except (ValueError, TypeError):
+        raise InvalidCursor("カーソルが正しくありません")
+
+
+def prefix_bounds(prefix: str) -> Tuple[str, Optional[str]]:
+    """前方一致を範囲 [lo, hi) にする (LIKE と違い、パラメータのままでもインデックスを使える)"""
+    last = ord(prefix[-1])
+    if last >= 0x10FFFF:
+        return prefix, None
+    return prefix, prefix[:-1] + chr(last + 1)
+
+
+@lru_cache(maxsize=None)
+def search_sql(by_class: bool, by_year: bool, by_prefix: bool, bounded: bool, after: bool):
+    # 条件の組み合わせごとに同じ文を使い回す (プリペアドステートメントのキャッシュが効く)
+    where = []
+    if by_class:
+        where.append("COALESCE(homeroom_class, '') = :class_name")
+    if by_year:
+        where.append("admission_year = :admission_year")
+    if by_prefix:
+        # 学籍番号または氏名の前方一致 (text_pattern_ops のインデックスで範囲検索)
+        # (上限を作れない文字で終わる場合は starts_with で確かめる)
+        upper_no = " AND student_number ~<~ :hi" if bounded else " AND starts_with(student_number, :lo)"
+        upper_name = " AND name ~<~ :hi" if bounded else " AND starts_with(name, :lo)"
+        where.append(f"((student_number ~>=~ :lo{upper_no}) OR (name ~>=~ :lo{upper_name}))")
+    if after:
+        where.append(f"({SORT_KEY}) > (:k_class, :k_no, :k_stu)")
+    return text(f"""
+        SELECT student_number, email, name, homeroom_class, attendance_no, admission_year,
+               COALESCE(homeroom_class, '') AS k_class, COALESCE(attendance_no, 0) AS k_no
+        FROM students
+        {"WHERE " + " AND ".join(where) if where else ""}
+        ORDER BY {SORT_KEY}
+        LIMIT :limit
+    """).execution_options(metrics_name="student_search")
+
+
+async def search_students(conn, class_name: Optional[str] = None, admission_year: Optional[int] = None,
+                          q: Optional[str] = None, cursor: Optional[str] = None,
+                          limit: int = STUDENT_PAGE_SIZE) -> Tuple[List[dict], Optional[str]]:
+    """(生徒のリスト, 次のページのカーソル) を返す。最後のページならカーソルは None"""
+    limit = max(1, min(limit, STUDENT_PAGE_MAX))
+    q = (q or "").strip()
+    params = {"limit": limit + 1}
+    if class_name:
+        params["class_name"] = class_name
+    if admission_year is not None:
+        params["admission_year"] = admission_year
+    hi = None
+    if q:
+        params["lo"], hi = prefix_bounds(q)
+        if hi is not None:
+            params["hi"] = hi
+    if cursor:
+        params["k_class"], params["k_no"], params["k_stu"] = decode_cursor(cursor)
+
+    stmt = search_sql(bool(class_name), admission_year is not None, bool(q), hi is not None, bool(cursor))
+    rows = (await conn.execute(stmt, params)).fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last.k_class, last.k_no, last.student_number)
+    students = [{
+        "student_number": r.student_number,
+        "email": r.email,
+        "name": r.name,
+        "homeroom_class": r.homeroom_class,
+        "attendance_no": r.attendance_no,
+        "admission_year": r.admission_year,
+    } for r in rows]
+    return students, next_cursor
+
+
+async def admission_years(conn) -> Optional[Tuple[int, int]]:
+    """(最も古い入学年, 最も新しい入学年)。入学年の分かる生徒がいなければ None"""
+    r = (await conn.execute(ADMISSION_YEARS_SQL)).fetchone()
+    if r is None or r.min_year is None:
+        return None
+    return r.min_year, r.max_year
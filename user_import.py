@@ -0,0 +1,210 @@
+import os
+import csv
+import codecs
+import asyncio
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Awaitable, Callable, List, Optional
+
+from sqlalchemy import text
+
+from passwords import PasswordHasher, is_hashed
+
+# 1回のINSERTでまとめる行数
+IMPORT_BATCH_ROWS = int(os.getenv("IMPORT_BATCH_ROWS", "1000"))
+# 取り込みのパスワードハッシュ計算に使うスレッド数。ログイン用 (password_hasher) とは別にし、
+# 数千件の取り込み中でもログインが取り込みの後ろで順番待ちにならないようにする
+IMPORT_HASH_WORKERS = int(os.getenv("IMPORT_HASH_WORKERS", "1"))
+# アップロードファイルを読む単位
+IMPORT_READ_CHUNK = 64 * 1024
+# 文字コード判定に使う先頭部分の大きさ
+ENCODING_PROBE_BYTES = 64 * 1024
+
+CSV_COLUMNS = 6  # 学籍番号,氏名,メール,パスワード,クラス,出席番号
+
+# まとめて登録し、実際に追加できた学籍番号だけを返す (既存の学籍番号は飛ばす)
+# パスワードは insert_batch でハッシュにしてから渡す (平文のまま保存しない)
+INSERT_STUDENTS_SQL = text("""
+    INSERT INTO students (student_number, name, email, password_hash, homeroom_class, attendance_no)
+    SELECT * FROM unnest(
+        CAST(:ids AS TEXT[]), CAST(:names AS TEXT[]), CAST(:emails AS TEXT[]),
+        CAST(:passes AS TEXT[]), CAST(:classes AS TEXT[]), CAST(:nos AS INT[])
+    )
+    ON CONFLICT DO NOTHING
+    RETURNING student_number
+""").execution_options(metrics_name="import_students")
+
+# バッチの中で既に登録されている学籍番号 (この行はパスワードのハッシュを計算せずに飛ばす)
+EXISTING_STUDENTS_SQL = text(
+    "SELECT student_number FROM students WHERE student_number = ANY(CAST(:ids AS TEXT[]))"
+).execution_options(metrics_name="import_existing_students")
+
+import_hasher = PasswordHasher(workers=IMPORT_HASH_WORKERS)
+
+
+class CsvImportError(Exception):
+    """ファイル全体を処理できない場合 (文字コード不明・空ファイル)"""
+
+
+@dataclass
+class ImportReport:
+    inserted: List[str] = field(default_factory=list)
+    skipped: List[dict] = field(default_factory=list)
+    invalid: List[dict] = field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        return {
+            "inserted_count": len(self.inserted),
+            "skipped_count": len(self.skipped),
+            "invalid_count": len(self.invalid),
+            "inserted": self.inserted,
+            "skipped": self.skipped,
+            "invalid": self.invalid,
+        }
+
+
+def detect_encoding(prefix: bytes) -> Optional[str]:
+    if prefix.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    for encoding in ("utf-8", "cp932"):
+        try:
+            # 先頭部分の末尾で文字が途切れていてもエラーにしない
+            codecs.getincrementaldecoder(encoding)().decode(prefix, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return None
+
+
+async def iter_records(file, chunk_size: int = IMPORT_READ_CHUNK) -> AsyncIterator[str]:
+    """アップロードを少しずつ読み、CSVの1レコード分 (改行込み) ずつ返す"""
+    prefix = await file.read(ENCODING_PROBE_BYTES)
+    if not prefix:
+        raise CsvImportError("ファイルの中身が空です")
+    encoding = detect_encoding(prefix)
+    if encoding is None:
+        raise CsvImportError("ファイルの文字コードを判別できませんでした。UTF-8またはShift-JISで保存してください。")
+
+    decoder = codecs.getincrementaldecoder(encoding)()
+    carry = ""      # 改行で終わっていない行の途中
+    record = ""     # 引用符内の改行をまたいで組み立て中のレコード
+    in_quotes = False
+    chunk = prefix
+    while chunk:
+        try:
+            decoded = decoder.decode(chunk)
+        except UnicodeDecodeError:
+            # 先頭はASCIIのみで、途中から別の文字コードになっている場合
+            raise CsvImportError(f"ファイルの途中で {encoding} として読めない文字がありました。UTF-8またはShift-JISで保存してください。")
+        lines = (carry + decoded).split("\n")
+        carry = lines.pop()
+        for line in lines:
+            record += line + "\n"
+            # 引用符で囲まれた中の改行ではレコードを区切らない
+            if line.count('"') % 2:
+                in_quotes = not in_quotes
+            if not in_quotes:
+                yield record
+                record = ""
+        chunk = await file.read(chunk_size)
+
+    rest = record + carry + decoder.decode(b"", final=True)
+    if rest.strip():
+        yield rest
+
+
+def parse_row(row: List[str]):
+    # 戻り値: (登録用タプル, None) または (None, エラー内容)
+    if len(row) < CSV_COLUMNS:
+        return None, "列が不足しています"
+    s_no, name, email, pw, cls = (c.strip() for c in row[:5])
+    if not s_no or not name or not email:
+        return None, "学籍番号・氏名・メールは必須です"
+    try:
+        att_no = int(row[5].strip())
+    except ValueError:
+        att_no = 0
+    return (s_no, name, email, pw, cls, att_no), None
+
+
+async def hash_passwords(passwords) -> List[str]:
+    """import_hasher のスレッドでハッシュにする (既にハッシュのものはそのまま)"""
+    return list(await asyncio.gather(*(
+        _keep(p) if is_hashed(p) else import_hasher.hash(p) for p in passwords
+    )))
+
+
+async def _keep(value: str) -> str:
+    return value
+
+
+async def insert_batch(conn, batch, report: ImportReport):
+    ids = [values[0] for _, values in batch]
+    existing = {r.student_number for r in (await conn.execute(EXISTING_STUDENTS_SQL, {"ids": ids})).fetchall()}
+    # 既存の学籍番号と、ファイル内で2件目以降の学籍番号は登録しないのでハッシュも計算しない
+    new_rows, seen = [], set()
+    for _, values in batch:
+        if values[0] not in existing and values[0] not in seen:
+            seen.add(values[0])
+            new_rows.append(values)
+
+    added = set()
+    if new_rows:
+        cols = list(zip(*new_rows))
+        # ハッシュ計算は INSERT の前に済ませる (計算中にトランザクションを開いたままにしない)
+        passes = await hash_passwords(cols[3])
+        rows = (await conn.execute(INSERT_STUDENTS_SQL, {
+            "ids": list(cols[0]), "names": list(cols[1]), "emails": list(cols[2]),
+            "passes": passes, "classes": list(cols[4]), "nos": list(cols[5]),
+        })).fetchall()
+        added = {r.student_number for r in rows}
+    for line_no, values in batch:
+        s_no = values[0]
+        if s_no in added:
+            report.inserted.append(s_no)
+            # 同じ学籍番号がファイル内で重複している場合、2件目以降は既存扱い
+            added.discard(s_no)
+        else:
+            report.skipped.append({"line": line_no, "student_number": s_no, "reason": "既に登録されています"})
+
+
+async def import_students(conn, file, batch_rows: int = IMPORT_BATCH_ROWS,
+                          on_batch: Optional[Callable[[ImportReport], Awaitable[None]]] = None,
+                          report: Optional[ImportReport] = None) -> ImportReport:
+    """CSVアップロードを読みながら IMPORT_BATCH_ROWS 件ずつ生徒を登録する。
+
+    conn はトランザクション内の接続。1行ごとの結果を ImportReport に記録する。
+    on_batch を渡すと1回登録するごとに呼ぶ (バックグラウンドの取り込みはここでコミットする)。
+    report を渡すと途中で失敗しても、そこまでの結果が呼び出し側に残る。
+    """
+    if report is None:
+        report = ImportReport()
+    batch = []
+
+    line_no = 0
+    async for record in iter_records(file):
+        line_no += 1
+        for row in csv.reader([record]):
+            # 空行はスキップ
+            if not row or all(c.strip() == '' for c in row):
+                continue
+            # ヘッダー行らしきもののスキップ
+            if line_no == 1 and ("学籍番号" in row[0] or "student" in row[0].lower()):
+                continue
+
+            values, error = parse_row(row)
+            if error:
+                report.invalid.append({"line": line_no, "student_number": row[0].strip() if row else "", "reason": error})
+                continue
+            batch.append((line_no, values))
+
+        if len(batch) >= batch_rows:
+            await insert_batch(conn, batch, report)
+            batch = []
+            if on_batch:
+                await on_batch(report)
+
+    if batch:
+        await insert_batch(conn, batch, report)
+        if on_batch:
+            await on_batch(report)
+    return report